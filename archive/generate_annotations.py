@@ -1,4 +1,9 @@
-import json
+import sys
+from pathlib import Path
+
+# Shared JSON helpers live in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from coco_io import DECODE_ERRORS, dump_json, load_json
 
 # --- User Configuration ---
 
@@ -29,12 +34,11 @@ def create_new_annotation_file():
 
     # 1. Read the source JSON file to get the annotations
     try:
-        with open(SOURCE_JSON_FILE, 'r') as f:
-            all_tasks = json.load(f)
+        all_tasks = load_json(SOURCE_JSON_FILE)
     except FileNotFoundError:
         print(f"❌ Error: The source file '{SOURCE_JSON_FILE}' was not found.")
         return
-    except json.JSONDecodeError:
+    except DECODE_ERRORS:
         print(f"❌ Error: The file '{SOURCE_JSON_FILE}' is not a valid JSON file.")
         return
 
@@ -92,8 +96,7 @@ def create_new_annotation_file():
 
     # 6. Write the newly created tasks to the output JSON file
     try:
-        with open(OUTPUT_JSON_FILE, 'w') as f:
-            json.dump(newly_annotated_tasks, f, indent=4)
+        dump_json(newly_annotated_tasks, OUTPUT_JSON_FILE)
         print(f"\n🎉 Success! A new file was created: '{OUTPUT_JSON_FILE}'")
         print(f"It contains annotations for {len(newly_annotated_tasks)} image(s).")
     except IOError as e:
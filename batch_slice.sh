@@ -1,5 +1,14 @@
 # !/bin/bash
 
-sahi coco slice --image_dir /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO --dataset_json_path /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO/annotations_4200K.json --output_dir /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO-4200K-tiled --slice_size 640
-sahi coco slice --image_dir /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO --dataset_json_path /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO/annotations_4800K.json --output_dir /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO-4800K-tiled --slice_size 640
-sahi coco slice --image_dir /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO --dataset_json_path /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO/annotations_5300K.json --output_dir /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO-5300K-tiled --slice_size 640
\ No newline at end of file
+# Tiles all three annotation sets with tiling.py in one pass: each image is decoded once, the tiles are
+# stored once (content-addressed, in B1-8-COCO-tile_store) and linked into every set's output dir.
+# Output layout is the same as `sahi coco slice`. Add slice configs to cut them in the same pass, e.g. --slice 640:0.2 1280:0.2
+python tiling.py --image_dir /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO \
+    --dataset_json_path /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO/annotations_4200K.json \
+                        /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO/annotations_4800K.json \
+                        /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO/annotations_5300K.json \
+    --output_dir /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO-4200K-tiled \
+                 /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO-4800K-tiled \
+                 /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO-5300K-tiled \
+    --tile_store /root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO-tile_store \
+    --slice 640:0.2
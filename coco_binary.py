@@ -0,0 +1,304 @@
+"""
+Compact binary COCO store for training-time random access.
+
+A store is a directory (<name>.cocobin) of .npy arrays plus a string table of
+file names and a small meta.json for everything else (info, licenses,
+categories and the few distinct per-image / per-annotation extra fields).
+Annotations are stored grouped by image, so the boxes of image row r are the
+contiguous slice offsets[r]:offsets[r + 1]. CocoBinary opens every array with
+np.load(mmap_mode='r'): opening is near instant, nothing is parsed, and
+dataloader workers share the same page-cache pages instead of each holding a
+private copy of the parsed JSON.
+
+    python coco_binary.py to-bin annotations.json            # -> annotations.cocobin/
+    python coco_binary.py to-coco annotations.cocobin out.json
+    python coco_binary.py --benchmark [annotations.json] --workers 4
+
+The round trip is lossless: to_coco() gives back the same images and
+annotations, in the original order.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from coco_index import CocoIndex
+from coco_io import dump_json, generate_coco, load_json
+
+FORMAT_VERSION = 2
+IMAGE_COLUMNS = ('id', 'file_name', 'width', 'height')
+
+# name -> dtype of every array in a store
+ARRAYS = {
+    'image_ids': np.int64,
+    'widths': np.int32,             # -1 = not an int in the source
+    'heights': np.int32,
+    'image_extra_ids': np.int32,
+    'file_name_offsets': np.int64,  # file name of image r: file_names.bin[off[r]:off[r + 1]]
+    'offsets': np.int64,            # annotations of image r: rows offsets[r]:offsets[r + 1]
+    'ann_ids': np.int64,
+    'ann_image_ids': np.int64,
+    'ann_category_ids': np.int64,
+    'ann_bboxes': np.float64,       # (n, 4) x, y, w, h; NaN = no bbox
+    'ann_areas': np.float64,        # NaN = no area
+    'ann_iscrowd': np.int8,         # -1 = no iscrowd
+    'ann_int_fields': np.uint8,     # bbox/area values that were ints (see coco_index.AREA_IS_INT)
+    'ann_extra_ids': np.int32,
+    'ann_file_rows': np.int64,      # position of each stored annotation in the source file
+}
+
+
+def binary_path(json_path):
+    """annotations.json(.gz/.zst) -> annotations.cocobin"""
+    name = os.path.basename(json_path).split('.')[0]
+    return os.path.join(os.path.dirname(json_path), f"{name}.cocobin")
+
+
+def _distinct(dicts):
+    """(table of distinct dicts, index into it per input dict)."""
+    table, keys, ids = [], {}, []
+    for d in dicts:
+        key = json.dumps(d, sort_keys=True)
+        if key not in keys:
+            keys[key] = len(table)
+            table.append(d)
+        ids.append(keys[key])
+    return table, np.asarray(ids, dtype=np.int32)
+
+
+def _int_column(images, key):
+    return np.fromiter((img[key] if type(img.get(key)) is int else -1 for img in images),
+                       dtype=np.int32, count=len(images))
+
+
+# --- Writing ---
+
+def write_binary(index, path):
+    """Writes a CocoIndex as a binary store at `path` (replaced atomically if it exists)."""
+    images = index.images
+    image_extras, image_extra_ids = _distinct(
+        {k: v for k, v in img.items()
+         if k not in IMAGE_COLUMNS or (k in ('width', 'height') and type(v) is not int)}
+        for img in images)
+
+    names = [img['file_name'].encode() for img in images]
+    file_name_offsets = np.zeros(len(names) + 1, dtype=np.int64)
+    np.cumsum([len(n) for n in names], out=file_name_offsets[1:])
+
+    # Annotations grouped by image (the index's ann_order), orphans at the end
+    orphans = np.flatnonzero(index.ann_image_rows < 0)
+    rows = np.concatenate([index.ann_order, orphans]).astype(np.int64)
+
+    arrays = {
+        'image_ids': index.image_ids,
+        'widths': _int_column(images, 'width'),
+        'heights': _int_column(images, 'height'),
+        'image_extra_ids': image_extra_ids,
+        'file_name_offsets': file_name_offsets,
+        'offsets': index.offsets,
+        'ann_ids': index.ann_ids[rows],
+        'ann_image_ids': index.ann_image_ids[rows],
+        'ann_category_ids': index.ann_category_ids[rows],
+        'ann_bboxes': index.ann_bboxes[rows],
+        'ann_areas': index.ann_areas[rows],
+        'ann_iscrowd': index.ann_iscrowd[rows],
+        'ann_int_fields': index.ann_int_fields[rows],
+        'ann_extra_ids': index.ann_extra_ids[rows],
+        'ann_file_rows': rows,
+    }
+
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, dtype in ARRAYS.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(arrays[name], dtype=dtype))
+    with open(os.path.join(tmp_path, 'file_names.bin'), 'wb') as f:
+        f.write(b''.join(names))
+    dump_json({
+        'format': 'cocobin', 'version': FORMAT_VERSION,
+        'num_images': len(images), 'num_annotations': int(index.num_annotations),
+        'sections': index.sections, 'image_extras': image_extras, 'ann_extras': index.extras,
+    }, os.path.join(tmp_path, 'meta.json'))
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+    return path
+
+
+def coco_to_binary(json_path, path=None):
+    """Streams a COCO JSON file into a binary store. Returns the store's path."""
+    return write_binary(CocoIndex.load(json_path), path or binary_path(json_path))
+
+
+# --- Reading ---
+
+class CocoBinary:
+    """
+    Read-only, memory-mapped view of a binary store. Array attributes have the
+    names of ARRAYS (ann_* in grouped-by-image order). Safe to open in every
+    dataloader worker: the arrays are shared pages of the same files.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        meta = load_json(os.path.join(path, 'meta.json'))
+        if meta.get('format') != 'cocobin' or meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {FORMAT_VERSION} cocobin store")
+        self.sections = meta['sections']
+        self.image_extras = meta['image_extras']
+        self.ann_extras = meta['ann_extras']
+        self.num_images = meta['num_images']
+        self.num_annotations = meta['num_annotations']
+
+        # Plain ndarray views of the maps: slicing an np.memmap subclass is several times slower
+        for name in ARRAYS:
+            setattr(self, name, np.asarray(np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')))
+        names_path = os.path.join(path, 'file_names.bin')
+        self._names = np.memmap(names_path, dtype=np.uint8, mode='r') if os.path.getsize(names_path) else b''
+
+    def __len__(self):
+        return self.num_images
+
+    @property
+    def categories(self):
+        return self.sections.get('categories', [])
+
+    def file_name(self, row):
+        start, end = self.file_name_offsets[row:row + 2].tolist()
+        return bytes(self._names[start:end]).decode()
+
+    def boxes(self, row):
+        """(bboxes (k, 4), category ids (k,)) of image row `row`, as zero-copy views."""
+        start, end = self.offsets[row:row + 2].tolist()
+        return self.ann_bboxes[start:end], self.ann_category_ids[start:end]
+
+    def image(self, row):
+        """The image dict of image row `row`."""
+        img = {'id': int(self.image_ids[row]), 'file_name': self.file_name(row)}
+        for key, column in (('width', self.widths), ('height', self.heights)):
+            if column[row] >= 0:
+                img[key] = int(column[row])
+        img.update(self.image_extras[self.image_extra_ids[row]])
+        return img
+
+    def to_index(self):
+        """Loads the store into a CocoIndex, annotations back in file order."""
+        index = object.__new__(CocoIndex)
+        index.sections = self.sections
+        index.images = [self.image(row) for row in range(self.num_images)]
+        index.image_ids = np.array(self.image_ids)
+
+        # Stored row of every source-file position
+        file_order = np.empty(self.num_annotations, dtype=np.int64)
+        file_order[self.ann_file_rows] = np.arange(self.num_annotations)
+        index.ann_ids = self.ann_ids[file_order]
+        index.ann_image_ids = self.ann_image_ids[file_order]
+        index.ann_category_ids = self.ann_category_ids[file_order]
+        index.ann_bboxes = self.ann_bboxes[file_order]
+        index.ann_areas = self.ann_areas[file_order]
+        index.ann_iscrowd = self.ann_iscrowd[file_order]
+        index.ann_int_fields = self.ann_int_fields[file_order]
+        index.ann_extra_ids = np.asarray(self.ann_extra_ids[file_order], dtype=np.int64)
+        index.extras = self.ann_extras
+        index._build_lookups()
+        return index
+
+    def to_coco(self):
+        return self.to_index().to_coco()
+
+
+def binary_to_coco(path, json_path, indent=None):
+    """Writes a binary store back out as COCO JSON."""
+    dump_json(CocoBinary(path).to_coco(), json_path, indent=indent)
+    return json_path
+
+
+# --- Benchmark ---
+
+def _memory_mb():
+    """(peak RSS, private RSS, file-backed RSS) of this process in MB (the last two on Linux only)."""
+    fields = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key in ('VmHWM', 'RssAnon', 'RssFile'):
+                    fields[key] = int(value.split()[0]) / 1024
+    except OSError:
+        fields['VmHWM'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return fields.get('VmHWM', 0.0), fields.get('RssAnon', float('nan')), fields.get('RssFile', float('nan'))
+
+
+def _measure(kind, path):
+    """Runs in a fresh worker process: load, then read every box once. Prints a JSON result."""
+    base_peak = _memory_mb()[0]
+    start = time.perf_counter()
+    if kind == 'json':
+        coco_data = load_json(path)
+        loaded = time.perf_counter()
+        total = sum(ann['bbox'][2] * ann['bbox'][3] for ann in coco_data['annotations'])
+    else:
+        store = CocoBinary(path)
+        loaded = time.perf_counter()
+        total = 0.0
+        for row in range(len(store)):
+            bboxes, _ = store.boxes(row)
+            total += float((bboxes[:, 2] * bboxes[:, 3]).sum())
+    done = time.perf_counter()
+    peak, private, shared = _memory_mb()
+    print(json.dumps({'load': loaded - start, 'access': done - loaded, 'peak': peak - base_peak,
+                      'private': private, 'shared': shared, 'check': total}))
+
+
+def benchmark(json_path=None, workers=4, num_annotations=1_000_000):
+    """Load time and memory of `workers` concurrent processes reading JSON vs the binary store."""
+    with tempfile.TemporaryDirectory() as workdir:
+        if json_path is None:
+            print(f"Generating COCO data with {num_annotations} annotations...")
+            json_path = os.path.join(workdir, 'benchmark.json')
+            dump_json(generate_coco(num_annotations), json_path)
+        store_path = coco_to_binary(json_path, os.path.join(workdir, 'benchmark.cocobin'))
+        store_mb = sum(e.stat().st_size for e in os.scandir(store_path)) / 1e6
+        print(f"JSON: {os.path.getsize(json_path) / 1e6:.1f} MB, binary store: {store_mb:.1f} MB")
+
+        print(f"\n{workers} workers, averages per worker")
+        print(f"{'format':<8}{'load s':>10}{'access s':>10}{'peak MB':>10}{'private MB':>12}{'shared MB':>11}")
+        for kind, path in (('json', json_path), ('binary', store_path)):
+            procs = [subprocess.Popen([sys.executable, __file__, '--measure', kind, path], stdout=subprocess.PIPE)
+                     for _ in range(workers)]
+            results = [json.loads(proc.communicate()[0]) for proc in procs]
+            mean = {key: sum(r[key] for r in results) / len(results) for key in results[0]}
+            print(f"{kind:<8}{mean['load']:>10.3f}{mean['access']:>10.3f}{mean['peak']:>10.1f}"
+                  f"{mean['private']:>12.1f}{mean['shared']:>11.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert between COCO JSON and the memory-mapped binary store.")
+    parser.add_argument('command', nargs='?', choices=['to-bin', 'to-coco'])
+    parser.add_argument('source', nargs='?')
+    parser.add_argument('destination', nargs='?')
+    parser.add_argument('--benchmark', nargs='?', const='', metavar='JSON',
+                        help="Compare load time and RSS with JSON (on a generated file if none is given)")
+    parser.add_argument('--workers', type=int, default=4, help="Concurrent reader processes in the benchmark")
+    parser.add_argument('--annotations', type=int, default=1_000_000, help="Annotations in the generated benchmark file")
+    parser.add_argument('--measure', nargs=2, metavar=('KIND', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        _measure(*args.measure)
+    elif args.benchmark is not None:
+        benchmark(args.benchmark or None, args.workers, args.annotations)
+    elif args.command == 'to-bin' and args.source:
+        print(f"Saved binary store to: {coco_to_binary(args.source, args.destination)}")
+    elif args.command == 'to-coco' and args.source and args.destination:
+        print(f"Saved COCO JSON to: {binary_to_coco(args.source, args.destination)}")
+    else:
+        parser.error("use to-bin SOURCE.json [STORE], to-coco STORE DEST.json or --benchmark")
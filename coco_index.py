@@ -0,0 +1,334 @@
+import json
+import os
+from array import array
+
+import numpy as np
+
+from coco_stream import iter_coco
+
+# Annotation fields kept as NumPy columns. Anything else an annotation carries
+# (segmentation, ignore, ...) goes into a small table of distinct "extra" dicts,
+# since Label Studio exports repeat the same few values for every annotation.
+ANNOTATION_COLUMNS = ('id', 'image_id', 'category_id', 'bbox', 'area', 'iscrowd')
+
+# Bits of ann_int_fields: which bbox/area values were JSON integers (bit i: bbox[i], AREA_IS_INT: area),
+# so they are written back as integers even though the columns are float64
+AREA_IS_INT = 1 << 4
+
+
+def _int_fields(bbox, area):
+    flags = AREA_IS_INT if type(area) is int else 0
+    for i, value in enumerate(bbox or ()):
+        if type(value) is int:
+            flags |= 1 << i
+    return flags
+
+
+def _lookup(keys, values, queries, missing=-1):
+    """
+    Vectorized dict lookup: maps each query to values[i] where keys[i] == query,
+    or `missing` if the query isn't in keys.
+    """
+    keys = np.asarray(keys)
+    queries = np.asarray(queries)
+    if len(keys) == 0:
+        return np.full(len(queries), missing, dtype=np.int64)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    pos = np.searchsorted(sorted_keys, queries)
+    pos = np.minimum(pos, len(sorted_keys) - 1)
+    found = sorted_keys[pos] == queries
+    return np.where(found, np.asarray(values)[order][pos], missing)
+
+
+def match_categories(categories, master):
+    """
+    Matches categories to `master` by name, the way merge_datasets.py merges
+    them: dataset 1 might have "Bottle"=0 and dataset 2 "Bottle"=5. Names not
+    in `master` yet are appended to it (in place) with the next free id, so a
+    master built from scratch has 0-based ids in first-seen order.
+    Returns {local category id: master id}.
+    """
+    name_to_id = {cat['name']: cat['id'] for cat in master}
+    next_id = max(name_to_id.values(), default=-1) + 1
+
+    local_to_master = {}
+    for cat in categories:
+        if cat['name'] not in name_to_id:
+            name_to_id[cat['name']] = next_id
+            master.append({"id": next_id, "name": cat['name']})
+            next_id += 1
+        local_to_master[cat['id']] = name_to_id[cat['name']]
+    return local_to_master
+
+
+class _AnnotationColumns:
+    """Append-only builder for the annotation columns."""
+
+    def __init__(self):
+        self.ids = array('q')
+        self.image_ids = array('q')
+        self.category_ids = array('q')
+        self.bboxes = array('d')
+        self.areas = array('d')
+        self.iscrowd = array('b')
+        self.int_fields = array('B')
+        self.extra_ids = array('l')
+        self.extras = []
+        self._extra_keys = {}
+
+    def append(self, ann):
+        self.ids.append(ann['id'])
+        self.image_ids.append(ann['image_id'])
+        self.category_ids.append(ann['category_id'])
+        bbox, area = ann.get('bbox'), ann.get('area', np.nan)
+        self.bboxes.extend(bbox or (np.nan,) * 4)
+        self.areas.append(area)
+        self.iscrowd.append(ann.get('iscrowd', -1))
+        self.int_fields.append(_int_fields(bbox, area))
+
+        extra = {k: v for k, v in ann.items() if k not in ANNOTATION_COLUMNS}
+        key = json.dumps(extra, sort_keys=True)
+        if key not in self._extra_keys:
+            self._extra_keys[key] = len(self.extras)
+            self.extras.append(extra)
+        self.extra_ids.append(self._extra_keys[key])
+
+
+class CocoIndex:
+    """
+    Columnar, in-memory view of a COCO file.
+
+    Images stay as a list of dicts (there are comparatively few of them), while
+    annotations are stored as NumPy arrays:
+
+        ann_ids, ann_image_ids, ann_category_ids  int64   (n,)
+        ann_bboxes                                float64 (n, 4)
+        ann_areas                                 float64 (n,)
+        ann_int_fields                            uint8   (n,)  bbox/area values that were ints
+
+    Annotations are grouped by image through `ann_order` and `offsets`: the
+    annotation rows of image row r are ann_order[offsets[r]:offsets[r + 1]].
+
+    Build one with CocoIndex.load(path) (streams the file, the annotation dicts
+    are never all in memory) or CocoIndex.from_coco(coco_dict).
+    """
+
+    def __init__(self, sections, images, columns):
+        self.sections = sections
+        self.images = images
+        self.image_ids = np.fromiter((img['id'] for img in images), dtype=np.int64, count=len(images))
+
+        self.ann_ids = np.frombuffer(columns.ids, dtype=np.int64).copy()
+        self.ann_image_ids = np.frombuffer(columns.image_ids, dtype=np.int64).copy()
+        self.ann_category_ids = np.frombuffer(columns.category_ids, dtype=np.int64).copy()
+        self.ann_bboxes = np.frombuffer(columns.bboxes, dtype=np.float64).reshape(-1, 4).copy()
+        self.ann_areas = np.frombuffer(columns.areas, dtype=np.float64).copy()
+        self.ann_iscrowd = np.frombuffer(columns.iscrowd, dtype=np.int8).copy()
+        self.ann_int_fields = np.frombuffer(columns.int_fields, dtype=np.uint8).copy()
+        self.ann_extra_ids = np.asarray(columns.extra_ids, dtype=np.int32)
+        self.extras = columns.extras
+
+        self._build_lookups()
+
+    # --- Construction ---
+
+    @classmethod
+    def load(cls, path):
+        """Streams a COCO JSON file into an index."""
+        sections = {}
+        images = []
+        columns = _AnnotationColumns()
+        for key, value in iter_coco(path):
+            if key == 'images':
+                images.append(value)
+            elif key == 'annotations':
+                columns.append(value)
+            else:
+                sections[key] = value
+        return cls(sections, images, columns)
+
+    @classmethod
+    def from_coco(cls, coco_data):
+        """Builds an index from an already loaded COCO dict."""
+        sections = {k: v for k, v in coco_data.items() if k not in ('images', 'annotations')}
+        columns = _AnnotationColumns()
+        for ann in coco_data.get('annotations', []):
+            columns.append(ann)
+        return cls(sections, list(coco_data.get('images', [])), columns)
+
+    @classmethod
+    def concat(cls, indexes, sections):
+        """
+        One index holding the images and annotations of several indexes, in
+        order (ids are kept as they are, see merge_datasets.assign_global_ids).
+        """
+        indexes = list(indexes)
+        extra_offsets = np.cumsum([0] + [len(index.extras) for index in indexes])
+
+        merged = object.__new__(cls)
+        merged.sections = sections
+        merged.images = [img for index in indexes for img in index.images]
+        merged.image_ids = np.concatenate([np.empty(0, np.int64)] + [index.image_ids for index in indexes])
+        for column, empty in (('ann_ids', np.empty(0, np.int64)), ('ann_image_ids', np.empty(0, np.int64)),
+                              ('ann_category_ids', np.empty(0, np.int64)), ('ann_bboxes', np.empty((0, 4))),
+                              ('ann_areas', np.empty(0)), ('ann_iscrowd', np.empty(0, np.int8)),
+                              ('ann_int_fields', np.empty(0, np.uint8))):
+            setattr(merged, column, np.concatenate([empty] + [getattr(index, column) for index in indexes]))
+        merged.ann_extra_ids = np.concatenate(
+            [np.empty(0, np.int32)]
+            + [(index.ann_extra_ids + offset).astype(np.int32) for index, offset in zip(indexes, extra_offsets.tolist())])
+        merged.extras = [extra for index in indexes for extra in index.extras]
+        merged._build_lookups()
+        return merged
+
+    def _build_lookups(self):
+        n_images = len(self.images)
+        self._image_row = {image_id: row for row, image_id in enumerate(self.image_ids.tolist())}
+        self._filename_row = {os.path.basename(img['file_name']): row for row, img in enumerate(self.images)}
+
+        # Image row of every annotation, -1 for annotations whose image isn't listed
+        self.ann_image_rows = _lookup(self.image_ids, np.arange(n_images), self.ann_image_ids)
+
+        # Group annotation rows by image row
+        known = self.ann_image_rows >= 0
+        counts = np.bincount(self.ann_image_rows[known], minlength=n_images)
+        self.offsets = np.zeros(n_images + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.ann_order = np.flatnonzero(known)[np.argsort(self.ann_image_rows[known], kind='stable')]
+
+    # --- Lookups ---
+
+    @property
+    def categories(self):
+        return self.sections.get('categories', [])
+
+    @property
+    def num_images(self):
+        return len(self.images)
+
+    @property
+    def num_annotations(self):
+        return len(self.ann_ids)
+
+    def image_row(self, image_id):
+        """Row of the image with this id, or None."""
+        return self._image_row.get(image_id)
+
+    def image_by_filename(self, filename):
+        """Image dict whose file_name has this base name, or None."""
+        row = self._filename_row.get(os.path.basename(filename))
+        return None if row is None else self.images[row]
+
+    def annotation_rows(self, image_id):
+        """Annotation rows belonging to an image id (empty if unknown)."""
+        row = self._image_row.get(image_id)
+        if row is None:
+            return self.ann_order[:0]
+        return self.ann_order[self.offsets[row]:self.offsets[row + 1]]
+
+    def annotation_counts(self):
+        """Number of annotations per image row."""
+        return np.diff(self.offsets)
+
+    def annotation(self, row):
+        """Rebuilds the annotation dict stored at an annotation row."""
+        return next(self.iter_annotations([row]))
+
+    def iter_annotations(self, rows=None):
+        """Yields annotation dicts, in file order or for the given rows."""
+        if rows is None:
+            rows = np.arange(self.num_annotations)
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = zip(
+            self.ann_ids[rows].tolist(),
+            self.ann_image_ids[rows].tolist(),
+            self.ann_category_ids[rows].tolist(),
+            self.ann_bboxes[rows].tolist(),
+            self.ann_areas[rows].tolist(),
+            self.ann_iscrowd[rows].tolist(),
+            self.ann_int_fields[rows].tolist(),
+            self.ann_extra_ids[rows].tolist(),
+        )
+        for ann_id, image_id, category_id, bbox, area, iscrowd, int_fields, extra_id in columns:
+            ann = {'id': ann_id, 'image_id': image_id, 'category_id': category_id}
+            ann.update(self.extras[extra_id])
+            if bbox[0] == bbox[0]:  # NaN marks a missing bbox
+                if int_fields & 0xF:
+                    bbox = [int(v) if int_fields >> i & 1 else v for i, v in enumerate(bbox)]
+                ann['bbox'] = bbox
+            if area == area:
+                ann['area'] = int(area) if int_fields & AREA_IS_INT else area
+            if iscrowd >= 0:
+                ann['iscrowd'] = iscrowd
+            yield ann
+
+    # --- Filtering ---
+
+    def subset(self, image_rows):
+        """
+        New index with only the given image rows (an index array or a boolean
+        mask) and the annotations that belong to them.
+        """
+        image_rows = np.asarray(image_rows)
+        if image_rows.dtype == bool:
+            image_rows = np.flatnonzero(image_rows)
+        keep = np.zeros(self.num_images, dtype=bool)
+        keep[image_rows] = True
+        ann_rows = np.flatnonzero((self.ann_image_rows >= 0) & keep[np.maximum(self.ann_image_rows, 0)])
+
+        sub = object.__new__(CocoIndex)
+        sub.sections = self.sections
+        sub.images = [dict(self.images[r]) for r in image_rows.tolist()]
+        sub.image_ids = self.image_ids[image_rows]
+        sub.ann_ids = self.ann_ids[ann_rows]
+        sub.ann_image_ids = self.ann_image_ids[ann_rows]
+        sub.ann_category_ids = self.ann_category_ids[ann_rows]
+        sub.ann_bboxes = self.ann_bboxes[ann_rows]
+        sub.ann_areas = self.ann_areas[ann_rows]
+        sub.ann_iscrowd = self.ann_iscrowd[ann_rows]
+        sub.ann_int_fields = self.ann_int_fields[ann_rows]
+        sub.ann_extra_ids = self.ann_extra_ids[ann_rows]
+        sub.extras = self.extras
+        sub._build_lookups()
+        return sub
+
+    def subset_ids(self, image_ids):
+        """Like subset(), but selecting images by id."""
+        rows = _lookup(self.image_ids, np.arange(self.num_images), np.asarray(list(image_ids), dtype=np.int64))
+        return self.subset(rows[rows >= 0])
+
+    # --- Remapping ---
+
+    def renumber_images(self, start):
+        """Gives images consecutive ids from `start` and relinks annotations."""
+        new_ids = np.arange(start, start + self.num_images, dtype=np.int64)
+        known = self.ann_image_rows >= 0
+        self.ann_image_ids[known] = new_ids[self.ann_image_rows[known]]
+        for img, new_id in zip(self.images, new_ids.tolist()):
+            img['id'] = new_id
+        self.image_ids = new_ids
+        self._image_row = {image_id: row for row, image_id in enumerate(new_ids.tolist())}
+
+    def renumber_annotations(self, start):
+        """Gives annotations consecutive ids from `start`, in file order."""
+        self.ann_ids = np.arange(start, start + self.num_annotations, dtype=np.int64)
+
+    def remap_categories(self, mapping):
+        """Rewrites annotation category ids through an {old_id: new_id} dict."""
+        old = np.fromiter(mapping.keys(), dtype=np.int64, count=len(mapping))
+        new = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+        remapped = _lookup(old, new, self.ann_category_ids, missing=np.iinfo(np.int64).min)
+        unmapped = remapped == np.iinfo(np.int64).min
+        if unmapped.any():
+            raise KeyError(f"No mapping for category ids {sorted(set(self.ann_category_ids[unmapped].tolist()))}")
+        self.ann_category_ids = remapped
+
+    # --- Output ---
+
+    def to_coco(self):
+        """Rebuilds a plain COCO dict."""
+        coco_data = dict(self.sections)
+        coco_data['images'] = self.images
+        coco_data['annotations'] = list(self.iter_annotations())
+        return coco_data
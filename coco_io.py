@@ -0,0 +1,206 @@
+"""
+Shared JSON read/write for all the COCO / Label Studio scripts.
+
+Picks the fastest JSON library that is installed (orjson, then msgspec, then
+the standard library; override with COCO_JSON_BACKEND=json|orjson|msgspec) and
+writes compact JSON unless an indent is asked for. Paths ending in .gz or
+.zst are (de)compressed transparently; .zst needs the `zstandard` package.
+
+Run `python coco_io.py --benchmark` to compare the backends on a generated
+COCO file with 1M annotations.
+"""
+import argparse
+import contextlib
+import gzip
+import json
+import os
+import random
+import time
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def available_backends():
+    """Installed JSON libraries, fastest first."""
+    backends = ['json']
+    if msgspec is not None:
+        backends.insert(0, 'msgspec')
+    if orjson is not None:
+        backends.insert(0, 'orjson')
+    return backends
+
+
+BACKEND = os.getenv('COCO_JSON_BACKEND') or available_backends()[0]
+if BACKEND not in available_backends():
+    raise ImportError(f"COCO_JSON_BACKEND={BACKEND} but that library isn't installed")
+
+
+def set_backend(name):
+    """Switches the JSON library used by dumps()/loads() (mainly for benchmarking)."""
+    global BACKEND
+    if name not in available_backends():
+        raise ImportError(f"JSON backend '{name}' isn't installed")
+    BACKEND = name
+
+
+def dumps(obj, indent=None):
+    """Serializes to UTF-8 bytes. Compact unless indent is given."""
+    if BACKEND == 'orjson':
+        # orjson only knows one indent width
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    if BACKEND == 'msgspec':
+        data = msgspec.json.encode(obj)
+        return msgspec.json.format(data, indent=indent) if indent else data
+    if indent:
+        return json.dumps(obj, indent=indent, ensure_ascii=False).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+# What loads() raises on malformed input, whichever backend is active
+DECODE_ERRORS = (ValueError,) + ((msgspec.DecodeError,) if msgspec is not None else ())
+
+
+def loads(data):
+    """Parses JSON from bytes or str."""
+    if BACKEND == 'orjson':
+        return orjson.loads(data)
+    if BACKEND == 'msgspec':
+        return msgspec.json.decode(data)
+    return json.loads(data)
+
+
+def open_binary(path, mode='rb'):
+    """Opens a file for binary reading/writing, (de)compressing .gz and .zst."""
+    path = os.fspath(path)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError("Reading/writing .zst files needs the 'zstandard' package")
+        f = open(path, mode)
+        if 'r' in mode:
+            return zstandard.ZstdDecompressor().stream_reader(f, closefd=True)
+        return zstandard.ZstdCompressor(level=3).stream_writer(f, closefd=True)
+    return open(path, mode)
+
+
+def load_json(path):
+    """Loads a (possibly compressed) JSON file."""
+    with open_binary(path, 'rb') as f:
+        return loads(f.read())
+
+
+def temp_path(path):
+    """
+    A temporary name to write `path` under before renaming it into place.
+    Unique per call, so concurrent writers of one path don't clobber each
+    other's files; keeps .gz/.zst so the contents get compressed.
+    """
+    path = os.fspath(path)
+    suffix = os.path.splitext(path)[1] if path.endswith(('.gz', '.zst')) else ''
+    return f"{path}.{uuid.uuid4().hex[:12]}.tmp{suffix}"
+
+
+@contextlib.contextmanager
+def open_atomic(path):
+    """
+    open_binary(path, 'wb') under temp_path(path), renamed to `path` when the
+    `with` block finishes, so readers never see half a file. If the block
+    raises, the temporary file is removed and `path` is left as it was.
+    """
+    path = os.fspath(path)
+    tmp_path = temp_path(path)
+    try:
+        with open_binary(tmp_path, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def dump_json(obj, path, indent=None):
+    """Writes obj as JSON (compact by default) atomically, compressed if the path ends in .gz/.zst."""
+    with open_atomic(path) as f:
+        f.write(dumps(obj, indent=indent))
+
+
+# --- Benchmark ---
+
+def generate_coco(num_annotations=1_000_000, annotations_per_image=20, seed=0):
+    """A synthetic Label Studio style COCO dict for benchmarking."""
+    rng = random.Random(seed)
+    num_images = num_annotations // annotations_per_image
+    images = [
+        {"width": 640, "height": 640, "id": i, "file_name": f"images/B{i % 8 + 1}-{i:05d}_25112025_{i}.jpg"}
+        for i in range(num_images)
+    ]
+    annotations = []
+    for i in range(num_annotations):
+        x, y = rng.uniform(0, 600), rng.uniform(0, 600)
+        w, h = rng.uniform(5, 40), rng.uniform(5, 40)
+        annotations.append({
+            "id": i, "image_id": i // annotations_per_image, "category_id": 0,
+            "segmentation": [], "bbox": [x, y, w, h], "ignore": 0, "iscrowd": 0, "area": w * h,
+        })
+    return {
+        "images": images,
+        "categories": [{"id": 0, "name": "PCN_Cyst"}],
+        "annotations": annotations,
+        "info": {"year": 2025, "version": "1.0", "description": "", "contributor": "Label Studio"},
+    }
+
+
+def benchmark(num_annotations=1_000_000, workdir='.'):
+    print(f"Generating COCO data with {num_annotations} annotations...")
+    coco_data = generate_coco(num_annotations)
+    backend_before = BACKEND
+
+    print(f"\n{'backend':<10}{'format':<14}{'write s':>10}{'read s':>10}{'size MB':>10}")
+    for backend in available_backends():
+        set_backend(backend)
+        cases = [('indent', '.json', 2), ('compact', '.json', None), ('compact.gz', '.json.gz', None)]
+        if zstandard is not None:
+            cases.append(('compact.zst', '.json.zst', None))
+        for label, extension, indent in cases:
+            path = os.path.join(workdir, f"coco_io_benchmark{extension}")
+            start = time.perf_counter()
+            dump_json(coco_data, path, indent=indent)
+            write_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            load_json(path)
+            read_seconds = time.perf_counter() - start
+
+            size_mb = os.path.getsize(path) / 1e6
+            os.remove(path)
+            print(f"{backend:<10}{label:<14}{write_seconds:>10.2f}{read_seconds:>10.2f}{size_mb:>10.1f}")
+
+    set_backend(backend_before)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="COCO JSON I/O helpers.")
+    parser.add_argument('--benchmark', action='store_true', help="Compare the JSON backends")
+    parser.add_argument('--annotations', type=int, default=1_000_000, help="Annotations in the benchmark file")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.annotations)
+    else:
+        print(f"JSON backend: {BACKEND} (available: {', '.join(available_backends())})")
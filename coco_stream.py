@@ -0,0 +1,155 @@
+import os
+
+import ijson
+from ijson.common import ObjectBuilder
+
+from coco_io import dumps, open_binary, temp_path
+
+# Top-level COCO keys that can hold millions of entries. These are yielded one
+# element at a time, everything else (info, licenses, categories) is small and
+# yielded whole.
+STREAM_KEYS = ('images', 'annotations')
+
+
+def iter_coco(path, stream_keys=STREAM_KEYS, only=None):
+    """
+    Walks a COCO JSON file once with an iterative parser.
+
+    Yields (key, value) pairs. For keys in `stream_keys` one pair is yielded per
+    array element, so e.g. every annotation comes out as ('annotations', {...}).
+    Any other top-level key is yielded once with its whole value.
+    If `only` is given, keys not in it are skipped without building objects.
+    .gz/.zst files are decompressed on the fly.
+    """
+    with open_binary(path, 'rb') as f:
+        key = None
+        builder = None
+        depth = 0
+
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            # Root object: remember which top-level section we are in
+            if builder is None and depth == 0 and prefix == '':
+                if event == 'map_key':
+                    key = value
+                continue
+
+            if only is not None and key not in only:
+                continue
+
+            # The opening/closing bracket of a streamed array is not an item
+            if builder is None and key in stream_keys and prefix == key \
+                    and event in ('start_array', 'end_array'):
+                continue
+
+            if builder is None:
+                builder = ObjectBuilder()
+            builder.event(event, value)
+
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+
+            # A value is complete once its brackets are balanced again
+            if depth == 0 and event != 'map_key':
+                yield key, builder.value
+                builder = None
+
+
+class CocoStreamWriter:
+    """
+    Writes a COCO JSON file section by section, so the big arrays never have to
+    exist in memory. Output is compact (one array element per line) and
+    compressed if the path ends in .gz/.zst. The file is written under a
+    temporary name and only renamed into place if the `with` block finishes
+    without an exception; otherwise it is deleted. Use as a context manager:
+
+        with CocoStreamWriter(path) as out:
+            out.write_section('categories', categories)
+            out.begin_array('annotations')
+            for ann in annotations:
+                out.write_item(ann)
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self.tmp_path = temp_path(self.path)
+        self.counts = {}
+        self._f = None
+        self._array = None
+        self._first_key = True
+        self._first_item = True
+
+    def __enter__(self):
+        self._f = open_binary(self.tmp_path, 'wb')
+        self._f.write(b'{')
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write_key(self, key):
+        self._end_array()
+        if not self._first_key:
+            self._f.write(b',')
+        self._f.write(b'\n' + dumps(key) + b':')
+        self._first_key = False
+
+    def _end_array(self):
+        if self._array is not None:
+            self._f.write(b'\n]')
+            self._array = None
+
+    def write_section(self, key, value):
+        """Writes a whole top-level value (info, licenses, categories, ...)."""
+        self._write_key(key)
+        self._f.write(dumps(value))
+
+    def begin_array(self, key):
+        """Opens a top-level array; follow with write_item() calls."""
+        self._write_key(key)
+        self._f.write(b'[')
+        self._array = key
+        self._first_item = True
+        self.counts[key] = 0
+
+    def write_item(self, item):
+        """Appends one element to the array opened by begin_array()."""
+        self._f.write(b'\n' if self._first_item else b',\n')
+        self._f.write(dumps(item))
+        self._first_item = False
+        self.counts[self._array] += 1
+
+    def write_encoded(self, chunk, count):
+        """
+        Appends `count` elements that are already encoded and joined by b',\\n',
+        e.g. a block shared by several output files.
+        """
+        if count == 0:
+            return
+        self._f.write(b'\n' if self._first_item else b',\n')
+        self._f.write(chunk)
+        self._first_item = False
+        self.counts[self._array] += count
+
+    def close(self):
+        """Finishes the JSON and renames it to the final path."""
+        if self._f is None:
+            return
+        self._end_array()
+        self._f.write(b'\n}\n')
+        self._f.close()
+        self._f = None
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """Drops the unfinished file; an existing file at the final path is left as it was."""
+        if self._f is None:
+            return
+        self._f.close()
+        self._f = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
@@ -0,0 +1,279 @@
+"""
+COCO <-> YOLO conversion.
+
+Boxes are converted in one vectorized pass (clipped to the image, then
+normalized to YOLO's centre x, centre y, width, height), and the thousands of
+small label files are written/read on a thread pool. Instead of (or as well
+as) the .txt files a single label cache (.npz) can be written, which
+yolo_to_coco() and dataloaders read without touching the label directory.
+
+YOLO class ids follow merge_datasets.py's category order: categories matched
+by name, 0-based in first-seen order (coco_index.match_categories), so a
+merged B1-8 COCO file and its YOLO labels use the same numbers.
+
+    python coco_yolo.py to-yolo annotations.json dataset/labels --image_dir dataset/images --cache labels.npz
+    python coco_yolo.py to-coco dataset/images dataset/labels annotations.json
+"""
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from coco_index import CocoIndex, _lookup, match_categories
+from coco_stream import CocoStreamWriter
+from image_index import IMAGE_EXTENSIONS, fill_coco_dimensions, scan_directory
+
+# --- CONFIGURATION ---
+LABEL_WORKERS = 16          # Threads reading/writing label files
+CLASS_NAMES = None          # to-coco: class names by id; None = read classes.txt next to the labels dir
+WRITE_TXT = True            # to-yolo: write one .txt per image (False: only the --cache file)
+# ---------------------
+
+
+def _write_text(item):
+    path, text = item
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _read_text(path):
+    try:
+        with open(path) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def write_label_cache(path, files, shapes, offsets, classes, boxes):
+    """
+    Saves all labels in one .npz: file names, (w, h) per image, per-image
+    offsets into the classes (n,) and normalized cx, cy, w, h boxes (n, 4).
+    """
+    np.savez(path, files=np.asarray(files, dtype=str), shapes=np.asarray(shapes, dtype=np.int32),
+             offsets=offsets, classes=classes.astype(np.int32), boxes=boxes.astype(np.float32))
+
+
+def label_file_names(files):
+    """
+    The YOLO label file name of every image (<stem>.txt). Raises ValueError
+    if images share a stem (a.jpg and a.png, or one name in several folders).
+    """
+    names = [Path(name).stem + '.txt' for name in files]
+    by_label = {}
+    for image, label in zip(files, names):
+        by_label.setdefault(label, []).append(image)
+    shared = {label: images for label, images in by_label.items() if len(images) > 1}
+    if shared:
+        examples = '; '.join(f"{label}: {images}" for label, images in list(shared.items())[:5])
+        raise ValueError(f"{len(shared)} label files would be shared by several images, e.g. {examples}")
+    return names
+
+
+def load_label_cache(path):
+    """The arrays saved by write_label_cache(), as a dict."""
+    with np.load(path) as cache:
+        return {key: cache[key] for key in cache.files}
+
+
+# --- COCO -> YOLO ---
+
+def yolo_boxes(index, widths, heights):
+    """
+    Vectorized COCO -> YOLO boxes for every annotation of the index.
+    Returns (keep mask, normalized cx, cy, w, h (n, 4)); boxes that are
+    missing, belong to no listed image or have no area inside it are dropped.
+    """
+    rows = np.maximum(index.ann_image_rows, 0)
+    w_img = widths[rows].astype(np.float64)
+    h_img = heights[rows].astype(np.float64)
+
+    x, y, w, h = index.ann_bboxes.T
+    x0, x1 = np.clip(x, 0, w_img), np.clip(x + w, 0, w_img)
+    y0, y1 = np.clip(y, 0, h_img), np.clip(y + h, 0, h_img)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        boxes = np.stack([(x0 + x1) / 2 / w_img, (y0 + y1) / 2 / h_img,
+                          (x1 - x0) / w_img, (y1 - y0) / h_img], axis=1)
+        keep = (index.ann_image_rows >= 0) & (w_img > 0) & (h_img > 0) & (x1 > x0) & (y1 > y0)
+    return keep, boxes
+
+
+def coco_to_yolo(json_path, labels_dir, image_dir=None, cache_path=None, write_txt=WRITE_TXT,
+                 workers=LABEL_WORKERS):
+    """
+    Writes a YOLO label file per image (empty for images without boxes) and
+    classes.txt next to labels_dir. Image sizes missing from the JSON are
+    read from the image headers in image_dir. Returns the class names.
+    Raises ValueError, before writing, if two images would share a label file.
+    """
+    print(f"Loading annotations from: {json_path}")
+    index = CocoIndex.load(json_path)
+    # Checked before anything is written
+    label_names = label_file_names([img['file_name'] for img in index.images]) if write_txt else None
+
+    categories = []
+    mapping = match_categories(index.categories, categories)
+    class_names = [cat['name'] for cat in categories]
+    classes = _lookup(np.fromiter(mapping.keys(), dtype=np.int64), np.fromiter(mapping.values(), dtype=np.int64),
+                      index.ann_category_ids)
+
+    if image_dir and any(not img.get('width') or not img.get('height') for img in index.images):
+        unreadable = fill_coco_dimensions(index.images, image_dir)
+        if unreadable:
+            print(f"WARNING: no size for {len(unreadable)} images, their boxes are skipped")
+    widths = np.fromiter((img.get('width') or 0 for img in index.images), dtype=np.int64, count=index.num_images)
+    heights = np.fromiter((img.get('height') or 0 for img in index.images), dtype=np.int64, count=index.num_images)
+
+    keep, boxes = yolo_boxes(index, widths, heights)
+    keep &= classes >= 0
+    dropped = index.num_annotations - int(np.count_nonzero(keep))
+    if dropped:
+        print(f"Skipping {dropped} annotations without a usable box")
+
+    # Kept annotations grouped by image
+    order = index.ann_order[keep[index.ann_order]]
+    counts = np.bincount(index.ann_image_rows[order], minlength=index.num_images)
+    offsets = np.zeros(index.num_images + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    classes, boxes = classes[order], boxes[order]
+
+    files = [os.path.basename(img['file_name']) for img in index.images]
+    if write_txt:
+        lines = [f"{c} {cx:.6f} {cy:.6f} {w:.6f} {h:.6f}\n"
+                 for c, cx, cy, w, h in zip(classes.tolist(), *boxes.T.tolist())]
+        os.makedirs(labels_dir, exist_ok=True)
+        items = ((os.path.join(labels_dir, label), ''.join(lines[offsets[r]:offsets[r + 1]]))
+                 for r, label in enumerate(label_names))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(_write_text, items, chunksize=256):
+                pass
+        print(f"Wrote {len(files)} label files to: {labels_dir}")
+
+    if cache_path:
+        write_label_cache(cache_path, files, np.stack([widths, heights], axis=1), offsets, classes, boxes)
+        print(f"Saved label cache to: {cache_path}")
+
+    classes_path = os.path.join(os.path.dirname(os.path.abspath(labels_dir)), 'classes.txt')
+    with open(classes_path, 'w') as f:
+        f.write(''.join(f"{name}\n" for name in class_names))
+    print(f"Classes ({classes_path}): {class_names}")
+    return class_names
+
+
+# --- YOLO -> COCO ---
+
+def parse_labels(text):
+    """(class ids, normalized cx, cy, w, h (n, 4)) of a YOLO label file; polygons become their bounding box."""
+    lines = [line.split() for line in text.splitlines() if line.strip()] if text else []
+    if all(len(parts) == 5 for parts in lines):
+        values = np.array(lines, dtype=np.float64).reshape(-1, 5)
+        return values[:, 0].astype(np.int64), values[:, 1:]
+
+    classes, boxes = [], []
+    for parts in lines:
+        classes.append(int(parts[0]))
+        if len(parts) == 5:
+            boxes.append([float(v) for v in parts[1:]])
+            continue
+        points = np.array(parts[1:], dtype=np.float64).reshape(-1, 2)
+        (x0, y0), (x1, y1) = points.min(axis=0), points.max(axis=0)
+        boxes.append([(x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0])
+    return np.array(classes, dtype=np.int64), np.array(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def read_yolo_labels(files, labels_dir, workers=LABEL_WORKERS):
+    """
+    Reads the label files of the given image names on a thread pool. Returns
+    (offsets, classes, boxes); raises ValueError if two images share a label file.
+    """
+    paths = [os.path.join(labels_dir, label) for label in label_file_names(files)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parsed = list(pool.map(lambda path: parse_labels(_read_text(path)), paths, chunksize=256))
+
+    offsets = np.zeros(len(files) + 1, dtype=np.int64)
+    np.cumsum([len(c) for c, _ in parsed], out=offsets[1:])
+    classes = np.concatenate([c for c, _ in parsed]) if parsed else np.zeros(0, dtype=np.int64)
+    boxes = np.concatenate([b for _, b in parsed]) if parsed else np.zeros((0, 4))
+    return offsets, classes, boxes
+
+
+def yolo_class_names(labels_dir, num_classes, class_names=CLASS_NAMES):
+    """Class names from the argument, else classes.txt next to labels_dir, padded with the ids as names."""
+    if class_names is None:
+        classes_path = os.path.join(os.path.dirname(os.path.abspath(labels_dir)), 'classes.txt')
+        if os.path.exists(classes_path):
+            with open(classes_path) as f:
+                class_names = [line.strip() for line in f if line.strip()]
+    names = list(class_names or [])
+    return names + [str(i) for i in range(len(names), num_classes)]
+
+
+def yolo_to_coco(image_dir, labels_dir, output_json, class_names=CLASS_NAMES, cache_path=None,
+                 workers=LABEL_WORKERS):
+    """
+    Writes a COCO file (Label Studio style fields) for the images in
+    image_dir and their YOLO labels, or the labels in cache_path if given.
+    Image sizes come from the header index (image_index.py).
+    """
+    if cache_path:
+        cache = load_label_cache(cache_path)
+        files = cache['files'].tolist()
+        shapes = cache['shapes'].astype(np.int64)
+        offsets, classes, boxes = cache['offsets'], cache['classes'].astype(np.int64), cache['boxes'].astype(np.float64)
+    else:
+        infos = scan_directory(image_dir)
+        files = sorted(name for name, info in infos.items() if info.ok and name.lower().endswith(IMAGE_EXTENSIONS))
+        skipped = sum(1 for info in infos.values() if not info.ok)
+        if skipped:
+            print(f"WARNING: skipping {skipped} unreadable images")
+        shapes = np.array([(infos[name].width, infos[name].height) for name in files], dtype=np.int64).reshape(-1, 2)
+        offsets, classes, boxes = read_yolo_labels(files, labels_dir, workers)
+    print(f"Read {len(classes)} boxes for {len(files)} images")
+
+    # Vectorized YOLO -> COCO boxes
+    image_rows = np.repeat(np.arange(len(files)), np.diff(offsets))
+    w_img, h_img = shapes[image_rows, 0], shapes[image_rows, 1]
+    w, h = boxes[:, 2] * w_img, boxes[:, 3] * h_img
+    x, y = boxes[:, 0] * w_img - w / 2, boxes[:, 1] * h_img - h / 2
+    names = yolo_class_names(labels_dir, int(classes.max()) + 1 if len(classes) else 0, class_names)
+
+    with CocoStreamWriter(output_json) as out:
+        out.write_section("categories", [{"id": i, "name": name} for i, name in enumerate(names)])
+        out.begin_array("images")
+        for image_id, (name, (width, height)) in enumerate(zip(files, shapes.tolist())):
+            out.write_item({"width": width, "height": height, "id": image_id, "file_name": f"images/{name}"})
+        out.begin_array("annotations")
+        for ann_id, (image_id, category_id, bx, by, bw, bh) in enumerate(
+                zip(image_rows.tolist(), classes.tolist(), x.tolist(), y.tolist(), w.tolist(), h.tolist())):
+            out.write_item({"id": ann_id, "image_id": image_id, "category_id": category_id, "segmentation": [],
+                            "bbox": [bx, by, bw, bh], "ignore": 0, "iscrowd": 0, "area": bw * bh})
+    print(f"Saved COCO annotations to: {output_json}")
+    return output_json
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert between COCO JSON and YOLO labels.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    to_yolo = sub.add_parser('to-yolo', help="COCO JSON -> YOLO label files")
+    to_yolo.add_argument('json_path')
+    to_yolo.add_argument('labels_dir')
+    to_yolo.add_argument('--image_dir', help="Read missing image sizes from these images' headers")
+    to_yolo.add_argument('--cache', help="Also write all labels to this .npz file")
+    to_yolo.add_argument('--no_txt', action='store_true', help="Only write the --cache file")
+    to_coco = sub.add_parser('to-coco', help="YOLO label files -> COCO JSON")
+    to_coco.add_argument('image_dir')
+    to_coco.add_argument('labels_dir')
+    to_coco.add_argument('output_json')
+    to_coco.add_argument('--names', nargs='+', default=CLASS_NAMES, help="Class names (default: classes.txt)")
+    to_coco.add_argument('--cache', help="Read the labels from this .npz file instead of the .txt files")
+    for p in (to_yolo, to_coco):
+        p.add_argument('--workers', type=int, default=LABEL_WORKERS)
+    args = parser.parse_args()
+
+    if args.command == 'to-yolo':
+        if args.no_txt and not args.cache:
+            parser.error("--no_txt needs --cache")
+        coco_to_yolo(args.json_path, args.labels_dir, args.image_dir, args.cache, not args.no_txt, args.workers)
+    else:
+        yolo_to_coco(args.image_dir, args.labels_dir, args.output_json, args.names, args.cache, args.workers)
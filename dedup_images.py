@@ -0,0 +1,271 @@
+"""
+Finds exact and near-duplicate images (repeated frames, blank padded tiles)
+across one or more image directories.
+
+Every image gets a 64-bit perceptual hash (pHash: the signs of the 8x8
+lowest DCT frequencies of a 32x32 grayscale thumbnail) computed in a process
+pool; JPEGs are decoded at 1/2-1/8 scale straight from their DCT data. The
+hashes are kept in a table of each directory's image index (image_index.py),
+keyed by name, size and mtime, so re-runs only hash new or changed files.
+
+Near-duplicates are pairs within MAX_DISTANCE bits (Hamming distance). They
+are found with a multi-index search instead of comparing all pairs (see
+near_duplicate_pairs()), so only hashes that share most of one block are
+ever compared.
+Pairs are joined into groups (connected components), and groups whose files
+are byte-for-byte identical are marked as such.
+
+    python dedup_images.py find B1-8-COCO/images --output duplicates.json
+    python splitting.py coco annotations.json --duplicates duplicates.json
+    python dedup_images.py filter annotations.json duplicates.json annotations-dedup.json
+"""
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from coco_index import CocoIndex
+from coco_io import dump_json, load_json
+from image_index import ImageIndex, file_sha256
+from splitting import connected_components
+
+# --- CONFIGURATION ---
+MAX_DISTANCE = 6          # Hashes at most this many bits apart are near-duplicates (of 64)
+HASH_WORKERS = os.cpu_count()
+OUTPUT_JSON = 'duplicates.json'
+# ---------------------
+
+TABLE_BITS = 24           # Hash blocks up to this wide are looked up in a direct table, wider ones by binary search
+
+# cv2 flags that decode a JPEG at 1/8, 1/4 or 1/2 scale (other formats are resized after decoding)
+REDUCED_READS = ((8, cv2.IMREAD_REDUCED_GRAYSCALE_8), (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+                 (2, cv2.IMREAD_REDUCED_GRAYSCALE_2), (1, cv2.IMREAD_GRAYSCALE))
+
+
+# --- Hashing ---
+
+def phash(gray):
+    """64-bit perceptual hash of a grayscale image, as a Python int."""
+    thumb = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(thumb)[:8, :8].ravel()
+    # The DC term only says how bright the image is, leave it out of the median
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def image_phash(job):
+    """(path, width, height) -> pHash, or None if the image can't be read. Runs in a worker process."""
+    path, width, height = job
+    # Decode as small as possible while keeping the thumbnail's detail
+    flag = next(flag for scale, flag in REDUCED_READS if min(width or 0, height or 0) >= 64 * scale or scale == 1)
+    gray = cv2.imread(path, flag)
+    if gray is None:
+        return None
+    return phash(gray)
+
+
+def _to_signed(value):
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def hash_directory(directory, workers=HASH_WORKERS):
+    """
+    Brings the pHashes of a directory's readable images up to date and returns
+    {file name: pHash}. The listing comes from the image index (see
+    image_index.py); only new or changed files are decoded.
+    """
+    directory = os.path.abspath(directory)
+    index = ImageIndex.for_directory(directory)
+    infos = {name: info for name, info in index.scan(directory).items() if info.ok}
+
+    db = index.db
+    db.execute("""CREATE TABLE IF NOT EXISTS phashes (
+                      dir TEXT NOT NULL, name TEXT NOT NULL, size INTEGER, mtime_ns INTEGER, phash INTEGER,
+                      PRIMARY KEY (dir, name))""")
+    known = {row[0]: row[1:] for row in db.execute(
+        "SELECT name, size, mtime_ns, phash FROM phashes WHERE dir = ?", (directory,))}
+
+    stale = [name for name, info in infos.items() if known.get(name, (None, None))[:2] != (info.size, info.mtime_ns)]
+    jobs = [(os.path.join(directory, name), infos[name].width, infos[name].height) for name in stale]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        hashes = list(pool.map(image_phash, jobs, chunksize=64))
+
+    with db:
+        db.executemany("DELETE FROM phashes WHERE dir = ? AND name = ?",
+                       [(directory, name) for name in known.keys() - infos.keys()])
+        db.executemany("INSERT OR REPLACE INTO phashes VALUES (?, ?, ?, ?, ?)",
+                       [(directory, name, infos[name].size, infos[name].mtime_ns, _to_signed(h))
+                        for name, h in zip(stale, hashes) if h is not None])
+    index.close()
+
+    result = {name: known[name][2] % (1 << 64) for name in infos if name in known and name not in stale}
+    result.update((name, h) for name, h in zip(stale, hashes) if h is not None)
+    unreadable = sum(h is None for h in hashes)
+    print(f"{directory}: {len(infos)} images, {len(stale)} hashed" + (f", {unreadable} unreadable" if unreadable else ""))
+    return result
+
+
+# --- Search ---
+
+def _ball(width, radius):
+    """XOR masks flipping at most `radius` of `width` bits (the 0 mask first)."""
+    masks = [0]
+    for k in range(1, radius + 1):
+        masks += [sum(1 << bit for bit in bits) for bits in itertools.combinations(range(width), k)]
+    return np.array(masks, dtype=np.uint64)
+
+
+def near_duplicate_pairs(hashes, max_distance=MAX_DISTANCE):
+    """
+    (a, b) index arrays of the hash pairs at most max_distance bits apart
+    (a < b, each pair once).
+
+    Multi-index hashing (Norouzi et al., 2012): the 64 bits are cut into m
+    blocks of about log2(n) bits, so only a few hashes share a block value.
+    Two hashes at most max_distance apart differ in at most max_distance // m
+    bits of one of the blocks, so every hash only looks up the block values
+    within that radius of its own, and only those candidates are compared.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    blocks = max(1, min(max_distance + 1, 64 // max(8, n.bit_length())))
+    radius = max_distance // blocks
+    rows = np.arange(n)
+    found = []
+
+    shift = 0
+    for width in [64 // blocks + (i < 64 % blocks) for i in range(blocks)]:
+        keys = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        shift += width
+        order = np.argsort(keys, kind='stable')
+        if width <= TABLE_BITS:
+            # Direct table: bucket start and size for every possible block value
+            keys_int = keys.astype(np.int64)
+            counts = np.bincount(keys_int, minlength=1 << width)
+            starts = np.cumsum(counts) - counts
+        else:
+            sorted_keys = keys[order]
+
+        for mask in _ball(width, radius):
+            if width <= TABLE_BITS:
+                probe = keys_int ^ int(mask)
+                hits = counts[probe]
+                found_rows = np.flatnonzero(hits)
+                lo, hits = starts[probe[found_rows]], hits[found_rows]
+            else:
+                probe = keys ^ mask
+                lo = np.searchsorted(sorted_keys, probe, 'left')
+                hits = np.searchsorted(sorted_keys, probe, 'right') - lo
+                found_rows = rows
+
+            # One (query, candidate) row per hit
+            query = np.repeat(found_rows, hits)
+            candidate = order[np.repeat(lo - (np.cumsum(hits) - hits), hits) + np.arange(len(query))]
+            keep = (query < candidate) & (np.bitwise_count(hashes[query] ^ hashes[candidate]) <= max_distance)
+            found.append(query[keep] * n + candidate[keep])
+
+    # A pair close in several blocks was found once per block
+    pairs = np.unique(np.concatenate(found)) if found else np.empty(0, np.int64)
+    return pairs // max(n, 1), pairs % max(n, 1)
+
+
+def duplicate_groups(names, hashes, max_distance=MAX_DISTANCE):
+    """Lists of image names (2 or more) that are near-duplicates of each other, largest first."""
+    # Identical hashes are grouped directly; only distinct ones need the search
+    distinct, inverse = np.unique(np.asarray(hashes, dtype=np.uint64), return_inverse=True)
+    a, b = near_duplicate_pairs(distinct, max_distance)
+    components = connected_components(len(distinct), a, b)[inverse]
+
+    order = np.argsort(components, kind='stable')
+    split_at = np.cumsum(np.bincount(components))[:-1]
+    groups = [sorted(group.tolist()) for group in np.split(np.asarray(names, dtype=object)[order], split_at)
+              if len(group) > 1]
+    return sorted(groups, key=lambda group: (-len(group), group[0]))
+
+
+def find_duplicates(directories, output_json=OUTPUT_JSON, max_distance=MAX_DISTANCE, workers=HASH_WORKERS):
+    """Hashes the directories, groups their near-duplicates and writes them to output_json."""
+    start = time.perf_counter()
+    paths = {}
+    for directory in directories:
+        for name, h in hash_directory(directory, workers).items():
+            if name in paths:
+                print(f"  Warning: {name} is in {os.path.dirname(paths[name][0])} and {directory}, "
+                      f"only the first is used")
+                continue
+            paths[name] = (os.path.join(directory, name), h)
+
+    names = list(paths)
+    groups = duplicate_groups(names, [h for _, h in paths.values()], max_distance)
+
+    # Exact duplicates: only the files of found groups need their bytes hashed
+    grouped = [name for group in groups for name in group]
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        sha = dict(zip(grouped, pool.map(lambda name: file_sha256(paths[name][0]), grouped)))
+    entries = [{'images': group, 'identical': len({sha[name] for name in group}) == 1} for group in groups]
+
+    dump_json({'max_distance': max_distance, 'directories': [os.path.abspath(d) for d in directories],
+               'groups': entries}, output_json)
+
+    identical = sum(entry['identical'] for entry in entries)
+    print(f"\n{len(names)} images: {len(groups)} duplicate groups with {len(grouped)} images "
+          f"({identical} groups of identical files), {len(grouped) - len(groups)} images are redundant")
+    for group in groups[:5]:
+        print(f"  {len(group)} x {group[0]}, ...")
+    print(f"Saved to: {output_json} ({time.perf_counter() - start:.1f}s)")
+    return entries
+
+
+# --- Filtering ---
+
+def filter_coco(json_path, duplicates_json, output_json):
+    """
+    Writes a copy of a COCO file with one image per duplicate group: the one
+    with the most annotations (ties: first by name). Returns the dropped names.
+    """
+    index = CocoIndex.load(json_path)
+    row = {os.path.basename(img['file_name']): r for r, img in enumerate(index.images)}
+    counts = index.annotation_counts()
+
+    keep = np.ones(index.num_images, dtype=bool)
+    dropped = []
+    for group in load_json(duplicates_json)['groups']:
+        rows = [row[name] for name in group['images'] if name in row]
+        if len(rows) < 2:
+            continue
+        best = max(rows, key=lambda r: counts[r])
+        for r in rows:
+            if r != best:
+                keep[r] = False
+                dropped.append(os.path.basename(index.images[r]['file_name']))
+
+    dump_json(index.subset(keep).to_coco(), output_json)
+    print(f"Dropped {len(dropped)} duplicate images of {index.num_images}, saved to: {output_json}")
+    return dropped
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find exact and near-duplicate images with perceptual hashes.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    find = sub.add_parser('find', help="Hash image directories and group their duplicates")
+    find.add_argument('directories', nargs='+')
+    find.add_argument('--output', default=OUTPUT_JSON)
+    find.add_argument('--max_distance', type=int, default=MAX_DISTANCE, help="Hamming distance in bits (0-63)")
+    find.add_argument('--workers', type=int, default=HASH_WORKERS)
+    keep = sub.add_parser('filter', help="Keep one image per duplicate group in a COCO file")
+    keep.add_argument('json_path')
+    keep.add_argument('duplicates_json')
+    keep.add_argument('output_json')
+    args = parser.parse_args()
+
+    if args.command == 'find':
+        if not 0 <= args.max_distance < 64:
+            parser.error("--max_distance must be between 0 and 63")
+        find_duplicates(args.directories, args.output, args.max_distance, args.workers)
+    else:
+        filter_coco(args.json_path, args.duplicates_json, args.output_json)
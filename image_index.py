@@ -0,0 +1,302 @@
+"""
+Image dimensions and integrity from file headers, kept in a persistent index.
+
+Width/height are read from the JPEG SOF / PNG IHDR header without decoding any
+pixels, and a file counts as complete if the JPEG EOI marker / PNG IEND
+chunk is near its end (cameras and editors may append trailers after it).
+This is only a heuristic, decode a file before treating it as broken.
+
+Results go into an SQLite file per scanned directory under INDEX_DIR
+(nothing is written into the image directories), keyed by path and checked
+against size + mtime, so later scans only re-read files that changed. If
+INDEX_DIR isn't writable the index is kept in memory for the run. If the directory's own mtime hasn't moved
+since the last scan (no files added, removed or renamed) the directory isn't
+even listed again.
+
+    python image_index.py B1-8-COCO/images            # scan, print problems
+    python image_index.py B1-8-COCO/images --hash     # also store sha256 of every file
+"""
+import argparse
+import hashlib
+import os
+import sqlite3
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+# --- CONFIGURATION ---
+# One index file per image directory, named after a hash of its absolute path
+INDEX_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+                         'dataset_tools', 'image_index')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+SCAN_WORKERS = 16
+# ---------------------
+
+# JPEG start-of-frame markers (all except DHT 0xC4, JPG 0xC8 and DAC 0xCC)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TAIL_BYTES = 64 * 1024   # How far from the end of a file the EOI marker / IEND chunk is looked for
+
+
+@dataclass
+class ImageInfo:
+    name: str
+    size: int
+    mtime_ns: int
+    format: Optional[str] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    complete: bool = False
+    error: Optional[str] = None
+    sha256: Optional[str] = None
+
+    @property
+    def ok(self):
+        """Header parsed and the file isn't truncated."""
+        return self.error is None and self.complete
+
+
+def _jpeg_size(f):
+    """Walks the JPEG marker segments up to the first SOF. Returns (width, height)."""
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if byte != b'\xff':
+            raise ValueError("corrupt JPEG marker stream")
+        marker = f.read(1)
+        while marker == b'\xff':  # fill bytes
+            marker = f.read(1)
+        if not marker:
+            raise ValueError("no SOF marker")
+        m = marker[0]
+        if m == 0x01 or 0xD0 <= m <= 0xD8:  # markers without a length
+            continue
+        if m in (0xD9, 0xDA):
+            raise ValueError("no SOF marker before image data")
+        length, = struct.unpack('>H', f.read(2))
+        if m in SOF_MARKERS:
+            height, width = struct.unpack('>HH', f.read(5)[1:5])
+            return width, height
+        f.seek(length - 2, 1)
+
+
+def _tail(f):
+    """The last TAIL_BYTES of a file."""
+    f.seek(max(0, f.seek(0, os.SEEK_END) - TAIL_BYTES))
+    return f.read()
+
+
+def read_image_header(path):
+    """
+    Reads (format, width, height, complete) from an image file without
+    decoding it. `complete` is False if the end marker is missing, i.e. the
+    file looks truncated. Raises ValueError for unknown or corrupt headers.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(24)
+        if head.startswith(PNG_SIGNATURE):
+            if head[12:16] != b'IHDR':
+                raise ValueError("PNG without IHDR")
+            width, height = struct.unpack('>II', head[16:24])
+            return 'png', width, height, b'IEND' in _tail(f)
+
+        if head.startswith(b'\xff\xd8'):
+            width, height = _jpeg_size(f)
+            return 'jpeg', width, height, b'\xff\xd9' in _tail(f)
+
+    raise ValueError("not a JPEG or PNG file")
+
+
+def decoded_size(path):
+    """(width, height) if the image decodes completely (with Pillow), else None."""
+    from PIL import Image
+
+    try:
+        with Image.open(path) as img:
+            img.load()
+            return img.size
+    except OSError:
+        return None
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def inspect_image(path, size, mtime_ns, with_hash=False):
+    """Builds an ImageInfo for one file; header errors are recorded, not raised."""
+    info = ImageInfo(os.path.basename(path), size, mtime_ns)
+    try:
+        info.format, info.width, info.height, info.complete = read_image_header(path)
+    except (OSError, ValueError, struct.error) as e:
+        info.error = str(e) or type(e).__name__
+    if with_hash:
+        try:
+            info.sha256 = file_sha256(path)
+        except OSError as e:
+            info.error = info.error or str(e)
+    return info
+
+
+def index_path(directory, index_dir=INDEX_DIR):
+    """The index file of a directory: INDEX_DIR/<hash of its absolute path>.sqlite."""
+    key = hashlib.blake2b(os.path.abspath(directory).encode(), digest_size=8).hexdigest()
+    return os.path.join(index_dir, f"{key}.sqlite")
+
+
+class ImageIndex:
+    """
+    Persistent header index for image directories (an SQLite file).
+
+    One index can hold several directories; ImageIndex.for_directory() opens
+    the one kept for a directory under INDEX_DIR. `db` is the SQLite
+    connection, other tools may add their own tables (see dedup_images.py).
+    Not thread-safe, use one per thread.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = os.fspath(db_path)
+        self.last_scan = None   # {'listed', 'parsed', 'removed'} counts of the last scan()
+        self.db = sqlite3.connect(self.db_path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS images (
+                dir TEXT NOT NULL, name TEXT NOT NULL, size INTEGER, mtime_ns INTEGER,
+                format TEXT, width INTEGER, height INTEGER, complete INTEGER, error TEXT, sha256 TEXT,
+                PRIMARY KEY (dir, name));
+            CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, mtime_ns INTEGER);
+        """)
+
+    @classmethod
+    def for_directory(cls, directory, index_dir=INDEX_DIR):
+        """The index of a directory, in memory if index_dir can't be written to."""
+        try:
+            os.makedirs(index_dir, exist_ok=True)
+            db_path = index_path(directory, index_dir)
+            if os.access(index_dir, os.W_OK) and (not os.path.exists(db_path) or os.access(db_path, os.W_OK)):
+                return cls(db_path)
+        except (OSError, sqlite3.Error):
+            pass
+        print(f"Warning: can't write to {index_dir}, indexing {directory} in memory only")
+        return cls(':memory:')
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def cached(self, directory):
+        """{file name: ImageInfo} as stored for a directory, without touching the disk."""
+        rows = self.db.execute(
+            "SELECT name, size, mtime_ns, format, width, height, complete, error, sha256 "
+            "FROM images WHERE dir = ?", (os.path.abspath(directory),))
+        return {row[0]: ImageInfo(*row[:6], bool(row[6]), *row[7:]) for row in rows}
+
+    def scan(self, directory, workers=SCAN_WORKERS, with_hash=False, recheck=False):
+        """
+        Brings the index for `directory` up to date and returns {file name: ImageInfo}.
+
+        New files and files whose size/mtime changed are parsed on a thread
+        pool; removed files are dropped. If the directory itself is unchanged
+        since the last scan the stored entries are returned as they are, pass
+        recheck=True to stat every file anyway (catches in-place rewrites).
+        """
+        directory = os.path.abspath(directory)
+        dir_mtime = os.stat(directory).st_mtime_ns
+        known = self.cached(directory)
+        row = self.db.execute("SELECT mtime_ns FROM dirs WHERE dir = ?", (directory,)).fetchone()
+        needs_hash = with_hash and any(info.sha256 is None for info in known.values())
+        if row is not None and row[0] == dir_mtime and not recheck and not needs_hash:
+            self.last_scan = {'listed': 0, 'parsed': 0, 'removed': 0}
+            return known
+
+        entries = {}
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                    st = entry.stat()
+                    entries[entry.name] = (st.st_size, st.st_mtime_ns)
+
+        changed = [
+            name for name, (size, mtime_ns) in entries.items()
+            if name not in known or known[name].size != size or known[name].mtime_ns != mtime_ns
+            or (with_hash and known[name].sha256 is None)
+        ]
+        removed = known.keys() - entries.keys()
+
+        def parse(name):
+            size, mtime_ns = entries[name]
+            return inspect_image(os.path.join(directory, name), size, mtime_ns, with_hash)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(parse, changed))
+
+        with self.db:
+            self.db.executemany("DELETE FROM images WHERE dir = ? AND name = ?",
+                                 [(directory, name) for name in removed])
+            self.db.executemany(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(directory, i.name, i.size, i.mtime_ns, i.format, i.width, i.height,
+                  int(i.complete), i.error, i.sha256) for i in parsed])
+            self.db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (directory, dir_mtime))
+
+        for name in removed:
+            del known[name]
+        known.update((info.name, info) for info in parsed)
+        self.last_scan = {'listed': len(entries), 'parsed': len(parsed), 'removed': len(removed)}
+        return known
+
+
+def scan_directory(directory, **kwargs):
+    """Scans a directory with its index under INDEX_DIR. Returns {file name: ImageInfo}."""
+    with ImageIndex.for_directory(directory) as index:
+        return index.scan(directory, **kwargs)
+
+
+def fill_coco_dimensions(images, image_dir, infos=None):
+    """
+    Sets width/height of COCO image entries from the header index of
+    `image_dir` (matched by file name). Returns the file names that had no
+    readable image.
+    """
+    if infos is None:
+        infos = scan_directory(image_dir)
+    unreadable = []
+    for img in images:
+        info = infos.get(os.path.basename(img['file_name']))
+        if info is None or info.width is None:
+            unreadable.append(os.path.basename(img['file_name']))
+            continue
+        img['width'] = info.width
+        img['height'] = info.height
+    return unreadable
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index image dimensions/integrity of directories from file headers.")
+    parser.add_argument('directories', nargs='+')
+    parser.add_argument('--hash', action='store_true', help="Also store the sha256 of every file")
+    parser.add_argument('--recheck', action='store_true', help="Stat every file even if the directory is unchanged")
+    parser.add_argument('--workers', type=int, default=SCAN_WORKERS)
+    args = parser.parse_args()
+
+    for directory in args.directories:
+        start = time.perf_counter()
+        with ImageIndex.for_directory(directory) as index:
+            infos = index.scan(directory, workers=args.workers, with_hash=args.hash, recheck=args.recheck)
+            stats = index.last_scan
+        problems = [info for info in infos.values() if not info.ok]
+        for info in sorted(problems, key=lambda i: i.name):
+            print(f"[{'CORRUPT' if info.error else 'TRUNCATED'}] {os.path.join(directory, info.name)}"
+                  f"{f': {info.error}' if info.error else ''}")
+        print(f"{directory}: {len(infos)} images, {stats['parsed']} (re)read, {stats['removed']} removed, "
+              f"{len(problems)} problems ({time.perf_counter() - start:.2f}s)")
@@ -0,0 +1,255 @@
+"""
+Content-hash build cache for merge_datasets.py and split_coco.py, like make
+but keyed on what the inputs contain rather than on timestamps.
+
+Every stage declares its inputs (files and image directories), the config
+values that change its output and its output files. After a successful run
+their fingerprints are kept in CACHE_DIR/state.json; the next run skips the
+stage if none of them changed. JSON files and scripts are hashed with
+blake2b (memoized on size + mtime, so unchanged files aren't read again);
+image directories are fingerprinted from the sha256 of every image, which
+image_index.py keeps in the directory's index and only computes for new or
+changed files.
+
+The merge is redone partially: every dataset load_dataset() prepared is
+stored as a binary store (coco_binary.py) with the list of its placed images,
+so after touching one bottle only that bottle is parsed and has its images
+placed; the others come from their stores and the merged JSON (and, with
+IMAGE_STRATEGY = 'manifest', the image manifest) is rebuilt.
+
+    python label_studio/build_cache.py merge split --explain
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Shared COCO helpers live in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import split_coco
+from coco_binary import CocoBinary, write_binary
+from coco_io import dump_json, load_json
+from image_index import scan_directory
+
+# merge_datasets.py lives next to this script
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import merge_datasets
+
+# --- CONFIGURATION ---
+CACHE_DIR = '.build_cache'   # Relative to where the scripts are run, like their paths
+HASH_IMAGES = True           # False: fingerprint images by name, size and mtime only
+HASH_WORKERS = 8             # Threads hashing input files
+# ---------------------
+
+
+# --- Fingerprints ---
+
+def file_digest(path, memo):
+    """blake2b of a file's contents; memo maps paths to [size, mtime_ns, digest]."""
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    known = memo.get(key)
+    if known is not None and known[:2] == [st.st_size, st.st_mtime_ns]:
+        return known[2]
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    memo[key] = [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+    return memo[key][2]
+
+
+def dir_digest(directory, with_hash=HASH_IMAGES):
+    """
+    Fingerprint of the images in a directory (from its image index). Every
+    file is stat'ed: rewriting an image in place doesn't move the directory's mtime.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    infos = scan_directory(directory, with_hash=with_hash, recheck=True)
+    for name in sorted(infos):
+        info = infos[name]
+        content = info.sha256 if with_hash else f"{info.size}:{info.mtime_ns}"
+        digest.update(f"{name}\0{content}\n".encode())
+    return digest.hexdigest()
+
+
+def fingerprint(path, memo, with_hash=HASH_IMAGES):
+    """A file's or image directory's fingerprint, None if it doesn't exist."""
+    if os.path.isdir(path):
+        return dir_digest(path, with_hash)
+    if os.path.isfile(path):
+        return file_digest(path, memo)
+    return None
+
+
+# --- Cache ---
+
+class BuildCache:
+    """The fingerprints of every stage's last successful run (CACHE_DIR/state.json)."""
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = Path(cache_dir)
+        self.state_path = self.cache_dir / 'state.json'
+        state = load_json(self.state_path) if self.state_path.exists() else {}
+        self.memo = state.get('files', {})
+        self.stages = state.get('stages', {})
+
+    def fingerprints(self, paths, with_hash=HASH_IMAGES):
+        """{path: fingerprint}, hashed on a thread pool."""
+        paths = [str(path) for path in paths]
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as pool:
+            return dict(zip(paths, pool.map(lambda path: fingerprint(path, self.memo, with_hash), paths)))
+
+    def record(self, inputs, config, outputs):
+        """The current fingerprint record of a stage. Outputs are checked by size/mtime only."""
+        return {'inputs': self.fingerprints(inputs), 'config': config,
+                'outputs': self.fingerprints(outputs, with_hash=False)}
+
+    def changes(self, stage, current):
+        """Why `stage` has to run again (empty if it's up to date)."""
+        previous = self.stages.get(stage)
+        if previous is None:
+            return ["no previous run recorded"]
+
+        reasons = []
+        for key in sorted(current['config'].keys() | previous['config'].keys()):
+            old, new = previous['config'].get(key), current['config'].get(key)
+            if old != new:
+                reasons.append(f"config {key} changed: {old!r} -> {new!r}")
+        for kind in ('inputs', 'outputs'):
+            for path in sorted(current[kind].keys() | previous[kind].keys()):
+                old, new = previous[kind].get(path), current[kind].get(path)
+                if path not in previous[kind]:
+                    reasons.append(f"new {kind[:-1]} {path}")
+                elif path not in current[kind]:
+                    reasons.append(f"{kind[:-1]} {path} no longer used")
+                elif new is None:
+                    reasons.append(f"{kind[:-1]} {path} is missing")
+                elif old != new:
+                    reasons.append(f"{kind[:-1]} {path} changed")
+        return reasons
+
+    def save(self, stage, current):
+        self.stages[stage] = current
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        dump_json({'files': self.memo, 'stages': self.stages}, self.state_path, indent=2)
+
+
+def run_stage(cache, stage, inputs, config, outputs, build, explain=False, dry_run=False, force=False):
+    """
+    Runs build(previous record) unless the stage is up to date, then records
+    its fingerprints. Returns True if the stage ran (or would have, with dry_run).
+    """
+    reasons = ["forced"] if force else cache.changes(stage, cache.record(inputs, config, outputs))
+    if not reasons:
+        print(f"{stage}: up to date, skipped")
+        return False
+
+    print(f"{stage}: running ({len(reasons)} change{'s' if len(reasons) != 1 else ''})")
+    if explain:
+        for reason in reasons:
+            print(f"  - {reason}")
+    if dry_run:
+        return True
+
+    build(None if force else cache.stages.get(stage))
+    # Fingerprint again: the stage may have renamed or rewritten inputs' index files
+    cache.save(stage, cache.record(inputs, config, outputs))
+    return True
+
+
+# --- Stages ---
+
+def merge_stage():
+    """Inputs, config and outputs of merge_datasets.py."""
+    inputs = [Path(__file__).with_name('merge_datasets.py')]
+    for folder in merge_datasets.INPUT_DATASETS:
+        json_file = merge_datasets.find_dataset_json(Path(folder))
+        inputs += [json_file or Path(folder) / 'result.json', Path(folder) / 'images']
+    config = {'INPUT_DATASETS': merge_datasets.INPUT_DATASETS, 'TARGET_JSON_NAME': merge_datasets.TARGET_JSON_NAME,
+              'IMAGE_STRATEGY': merge_datasets.IMAGE_STRATEGY, 'OUTPUT_DIR': merge_datasets.OUTPUT_DIR}
+    output_path = Path(merge_datasets.OUTPUT_DIR)
+    outputs = [output_path / 'result.json', output_path / 'images']
+    if merge_datasets.IMAGE_STRATEGY == 'manifest':
+        outputs[1] = output_path / 'images_manifest.csv'
+    return inputs, config, outputs
+
+
+def build_merge(cache, previous):
+    """
+    merge_datasets() that reuses the stored datasets whose JSON and images are
+    unchanged, as long as the config and the output images are too.
+    """
+    store_dir = cache.cache_dir / 'merge'
+    inputs, config, outputs = merge_stage()
+    current = cache.fingerprints(inputs)
+
+    reuse = {}
+    placed = str(outputs[1])
+    outputs_intact = (previous is not None and previous['config'] == config
+                      and cache.fingerprints([placed], with_hash=False)[placed] == previous['outputs'].get(placed))
+    if outputs_intact:
+        for folder in merge_datasets.INPUT_DATASETS:
+            store = store_dir / f"{folder}.cocobin"
+            placed_list = store_dir / f"{folder}.images.json"
+            keys = [key for key in current if Path(key).parent == Path(folder)]
+            if (store.exists() and placed_list.exists()
+                    and all(previous['inputs'].get(key) == current[key] for key in keys)):
+                try:
+                    reuse[folder] = (CocoBinary(store).to_index(), load_json(placed_list))
+                except ValueError:
+                    pass   # A store of an older format version, the dataset is loaded again
+    elif store_dir.exists():
+        shutil.rmtree(store_dir)
+
+    def on_prepared(folder, index, image_paths):
+        store_dir.mkdir(parents=True, exist_ok=True)
+        write_binary(index, store_dir / f"{folder}.cocobin")
+        dump_json([os.fspath(path) for path in image_paths], store_dir / f"{folder}.images.json")
+
+    merge_datasets.merge_datasets(incremental=False, reuse=reuse, on_prepared=on_prepared)
+
+
+def split_stage():
+    """Inputs, config and outputs of split_coco.py."""
+    inputs = [Path(split_coco.__file__), split_coco.original_json_path, split_coco.images_dir]
+    if split_coco.duplicates_json:
+        inputs.append(split_coco.duplicates_json)
+    config = {name: getattr(split_coco, name) for name in (
+        'original_json_name', 'images_dir_name', 'split_ratio', 'group_by', 'split_method', 'split_seed',
+        'duplicates_json', 'k_folds', 'export_binary')}
+    return inputs, config, split_coco.output_paths()
+
+
+STAGES = {
+    'merge': (merge_stage, build_merge),
+    'split': (split_stage, lambda cache, previous: split_coco.split_dataset()),
+}
+
+
+def build(stages, explain=False, dry_run=False, force=False, cache_dir=CACHE_DIR):
+    """Runs the given stages through the cache. Returns the names of the stages that ran."""
+    cache = BuildCache(cache_dir)
+    ran = []
+    for stage in stages:
+        describe, build_stage = STAGES[stage]
+        inputs, config, outputs = describe()
+        if run_stage(cache, stage, inputs, config, outputs, lambda previous: build_stage(cache, previous),
+                     explain=explain, dry_run=dry_run, force=force):
+            ran.append(stage)
+    return ran
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run merge_datasets.py / split_coco.py only when their inputs changed.")
+    parser.add_argument('stages', nargs='+', choices=list(STAGES))
+    parser.add_argument('--explain', action='store_true', help="Print why each stage runs")
+    parser.add_argument('--dry_run', action='store_true', help="Only report what would run")
+    parser.add_argument('--force', action='store_true', help="Run the stages even if they are up to date")
+    parser.add_argument('--cache_dir', default=CACHE_DIR)
+    args = parser.parse_args()
+    build(args.stages, args.explain, args.dry_run, args.force, args.cache_dir)
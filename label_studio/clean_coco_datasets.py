@@ -1,8 +1,28 @@
+"""
+Renames the images of Label Studio COCO exports from "<task>_<hash>-<name>"
+to "<prefix>-<name>" (e.g. B1-00000_25112025.jpg) and updates result.json.
+
+Every dataset is planned before anything is touched: the target names are
+worked out, the images directory is listed once, and collisions (two Label
+Studio ids that map to the same new name, a target that already exists or
+that another image entry already uses) are reported and left alone. The plan is written to a journal in the dataset
+folder, the renames of all datasets then run together on a thread pool, and
+result.json is replaced atomically once a dataset's renames are done.
+
+After an interruption a rerun picks up the journal and only retries its
+renames (no directory listing); datasets whose result.json hasn't changed
+since they were last cleaned are skipped without loading them.
+"""
 import os
-import json
-import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
+# Shared COCO helpers live in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from coco_index import CocoIndex
+from coco_io import dump_json, load_json
+
 # --- CONFIGURATION ---
 # List the directories you want to process and their new prefixes
 # Format: { "Folder_Name": "New_Prefix" }
@@ -16,88 +36,235 @@ DATASETS_TO_PROCESS = {
     "B7-COCO": "B7",
     "B8-COCO": "B8",
 }
+
+PLAN_WORKERS = 8        # Processes loading and planning datasets
+RENAME_WORKERS = 16     # Threads renaming files, shared by all datasets
+
+# Kept in each dataset folder
+JOURNAL_NAME = '.clean_journal.json'   # The plan of a run that hasn't been committed yet
+STATE_NAME = '.clean_state.json'       # result.json's size/mtime after the last clean
 # ---------------------
 
-def process_dataset(folder_name, new_prefix):
+
+def new_image_name(original_filename, new_prefix):
+    """The cleaned file name, or None if the name doesn't have the expected structure."""
+    # We split by the first hyphen '-' to separate LabelStudio ID from original name
+    # Input: 1257_4664fbd6-00000_25112025.jpg
+    parts = original_filename.split('-', 1)
+    if len(parts) < 2:
+        return None
+
+    # parts[0] is "1257_4664fbd6"
+    # parts[1] is "00000_25112025.jpg"
+    # New name: "B1-00000_25112025.jpg"
+    return f"{new_prefix}-{parts[1]}"
+
+
+def file_fingerprint(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def names_in_use(index, renames):
+    """File names of the index's images that none of the renames moves away."""
+    return {os.path.basename(img['file_name']) for img in index.images} - {old for old, _ in renames}
+
+
+def plan_renames(index, new_prefix, present):
+    """
+    Works out the renames for one dataset against the set of file names in
+    its images directory. Returns (renames [(old, new)], conflicts, missing,
+    skipped); renames also lists images already renamed on disk whose JSON
+    entry still has the old name (unless another entry uses that name).
+    """
+    candidates, skipped = [], []
+    for image_entry in index.images:
+        # current path in JSON (e.g., "images/1257_hash-000_25.jpg"), we only need the filename
+        original_filename = os.path.basename(image_entry['file_name'])
+        new_filename = new_image_name(original_filename, new_prefix)
+        if new_filename is None:
+            skipped.append(original_filename)
+        elif image_entry['file_name'] != f"images/{new_filename}":
+            candidates.append((original_filename, new_filename))
+
+    # Collisions: several images want the same name, or the name is taken by another entry or file
+    targets = {}
+    for old, new in candidates:
+        targets.setdefault(new, []).append(old)
+    kept = names_in_use(index, candidates)
+    renames, conflicts, missing = [], [], []
+    for old, new in candidates:
+        sources = targets[new]
+        if len(sources) > 1:
+            conflicts.append((old, new, f"{len(sources)} images map to {new}: {sorted(sources)}"))
+        elif new in kept:
+            conflicts.append((old, new, f"{new} belongs to another image entry"))
+        elif old != new and old in present and new in present:
+            conflicts.append((old, new, f"{new} already exists"))
+        elif old not in present and new not in present:
+            missing.append(old)
+        else:
+            renames.append((old, new))
+    return renames, conflicts, missing, skipped
+
+
+def plan_dataset(folder_name, new_prefix):
+    """
+    Loads and plans one dataset. Runs in a worker process. Returns a dict with
+    'status': 'not_found', 'up_to_date', 'resume' (plan read from the journal)
+    or 'planned', plus the index and plan for the last two.
+    """
     root_path = Path(folder_name)
     json_path = root_path / 'result.json'
-    images_dir = root_path / 'images'
-
+    journal_path = root_path / JOURNAL_NAME
+    state_path = root_path / STATE_NAME
     if not json_path.exists():
-        print(f"Skipping {folder_name}: result.json not found.")
-        return
-
-    print(f"--- Processing {folder_name} (Prefix: {new_prefix}) ---")
-
-    # 1. Load the COCO JSON
-    with open(json_path, 'r') as f:
-        coco_data = json.load(f)
-
-    # 2. Iterate through images to rename them
-    renamed_count = 0
-    
-    for image_entry in coco_data['images']:
-        # current path in JSON (e.g., "images/1257_hash-000_25.jpg" or absolute path)
-        original_json_path = image_entry['file_name']
-        
-        # Get just the filename (e.g., "1257_hash-000_25.jpg")
-        original_filename = os.path.basename(original_json_path)
-        
-        # --- NAMING LOGIC ---
-        # We split by the first hyphen '-' to separate LabelStudio ID from original name
-        # Input: 1257_4664fbd6-00000_25112025.jpg
-        parts = original_filename.split('-', 1)
-        
-        if len(parts) < 2:
-            print(f"Warning: Filename structure unexpected, skipping: {original_filename}")
-            continue
-            
-        # parts[0] is "1257_4664fbd6"
-        # parts[1] is "00000_25112025.jpg"
-        suffix = parts[1]
-        
-        # Construct new name: "B1-00000_25112025.jpg"
-        new_filename = f"{new_prefix}-{suffix}"
-        
-        # --------------------
-
-        # Define full physical paths
-        old_file_path = images_dir / original_filename
-        new_file_path = images_dir / new_filename
-
-        # A. Rename the physical file
-        if old_file_path.exists():
-            # If we've already run this script, checking existence prevents errors
-            if old_file_path != new_file_path:
-                os.rename(old_file_path, new_file_path)
-        elif new_file_path.exists():
-             # File already renamed, just update JSON
-             pass
+        return {'folder': folder_name, 'status': 'not_found'}
+
+    fingerprint = file_fingerprint(json_path)
+    journal = load_json(journal_path) if journal_path.exists() else None
+    if journal is None and state_path.exists():
+        state = load_json(state_path)
+        if state.get('json') == fingerprint and state.get('prefix') == new_prefix:
+            return {'folder': folder_name, 'status': 'up_to_date'}
+
+    # Load the COCO JSON (annotations are kept columnar, only images are dicts)
+    index = CocoIndex.load(json_path)
+    plan = {'folder': folder_name, 'prefix': new_prefix, 'index': index, 'json': fingerprint}
+
+    if journal is not None and journal.get('json') == fingerprint and journal.get('prefix') == new_prefix:
+        # Interrupted run: only its renames need another look (a journal may predate the entry check)
+        renames = [tuple(r) for r in journal['renames']]
+        kept = names_in_use(index, renames)
+        conflicts = [tuple(c) for c in journal['conflicts']]
+        conflicts += [(old, new, f"{new} belongs to another image entry") for old, new in renames if new in kept]
+        plan.update(status='resume', renames=[(old, new) for old, new in renames if new not in kept],
+                    conflicts=conflicts, missing=journal['missing'], skipped=[])
+        return plan
+
+    # Fresh plan (a stale journal from an older result.json is replaced)
+    plan.update(plan_index(folder_name, new_prefix, index))
+    return plan
+
+
+def plan_index(folder_name, new_prefix, index):
+    """A fresh rename plan for an already loaded dataset; lists its images directory once."""
+    images_dir = Path(folder_name) / 'images'
+    present = {entry.name for entry in os.scandir(images_dir)} if images_dir.is_dir() else set()
+    renames, conflicts, missing, skipped = plan_renames(index, new_prefix, present)
+    return {'folder': folder_name, 'prefix': new_prefix, 'index': index, 'status': 'planned',
+            'renames': renames, 'conflicts': conflicts, 'missing': missing, 'skipped': skipped}
+
+
+def rename_image(images_dir, old, new):
+    """
+    Renames one image unless it already has been. Returns 'renamed', 'done'
+    (already renamed), 'missing' or 'conflict' (both names exist). The plan
+    must not hold names another image entry uses: an existing `new` without
+    `old` counts as this image's.
+    """
+    old_path, new_path = os.path.join(images_dir, old), os.path.join(images_dir, new)
+    if old == new:
+        return 'done'
+    if os.path.exists(new_path):
+        return 'conflict' if os.path.exists(old_path) else 'done'
+    try:
+        os.rename(old_path, new_path)
+    except FileNotFoundError:
+        return 'missing'
+    return 'renamed'
+
+
+def update_file_names(plan, outcomes):
+    """Points the index's image entries of the finished renames at the new names."""
+    new_names = {old: new for (old, new), outcome in zip(plan['renames'], outcomes) if outcome in ('renamed', 'done')}
+    for image_entry in plan['index'].images:
+        new_filename = new_names.get(os.path.basename(image_entry['file_name']))
+        if new_filename is not None:
+            # We assume you want the relative path "images/filename.jpg" in the JSON
+            image_entry['file_name'] = f"images/{new_filename}"
+    return new_names
+
+
+def rename_planned(plans, pool):
+    """Submits the renames of all plans to a thread pool. Returns one list of futures per plan."""
+    return [[pool.submit(rename_image, os.path.join(plan['folder'], 'images'), old, new)
+             for old, new in plan['renames']] for plan in plans]
+
+
+def write_journal(plan):
+    """Saves a fresh plan to the dataset's journal, before any of its files are touched."""
+    dump_json({'prefix': plan['prefix'], 'json': plan['json'], 'renames': plan['renames'],
+               'conflicts': plan['conflicts'], 'missing': plan['missing']},
+              Path(plan['folder']) / JOURNAL_NAME)
+
+
+def commit_dataset(plan, outcomes, json_name='result.json'):
+    """Updates the image entries (update_file_names) and replaces the dataset's JSON."""
+    root_path = Path(plan['folder'])
+    new_names = update_file_names(plan, outcomes)
+
+    json_path = root_path / json_name
+    dump_json(plan['index'].to_coco(), json_path)
+    dump_json({'prefix': plan['prefix'], 'json': file_fingerprint(json_path)}, root_path / STATE_NAME)
+    (root_path / JOURNAL_NAME).unlink(missing_ok=True)
+    return new_names
+
+
+def report(plan, outcomes):
+    folder = plan['folder']
+    counts = {outcome: outcomes.count(outcome) for outcome in ('renamed', 'done', 'missing', 'conflict')}
+    print(f"--- {folder} (Prefix: {plan['prefix']}, {plan['status']}) ---")
+    for name in plan['skipped']:
+        print(f"Warning: Filename structure unexpected, skipping: {name}")
+    for name in plan['missing']:
+        print(f"Error: Image file not found on disk: {name}")
+    for (old, new), outcome in zip(plan['renames'], outcomes):
+        if outcome == 'missing':
+            print(f"Error: Image file not found on disk: {old}")
+        elif outcome == 'conflict':
+            print(f"Error: {old} -> {new}: {new} already exists, left as is")
+    for old, new, reason in plan['conflicts']:
+        print(f"Error: {old} -> {new}: {reason}, left as is")
+    print(f"Success! Renamed {counts['renamed']} images ({counts['done']} were already renamed), "
+          f"updated {counts['renamed'] + counts['done']} JSON entries in {folder}/result.json.")
+
+
+def clean_datasets(datasets=DATASETS_TO_PROCESS, plan_workers=PLAN_WORKERS, rename_workers=RENAME_WORKERS):
+    """Plans, journals, renames and commits all datasets. Returns {folder: status}."""
+    # 1. Plan every dataset in parallel
+    folders = [folder for folder in datasets if os.path.exists(folder)]
+    for folder in datasets:
+        if folder not in folders:
+            print(f"Directory not found: {folder}")
+    with ProcessPoolExecutor(max_workers=max(1, min(plan_workers, len(folders)))) as pool:
+        plans = list(pool.map(plan_dataset, folders, [datasets[f] for f in folders]))
+
+    statuses = {}
+    active = []
+    for plan in plans:
+        statuses[plan['folder']] = plan['status']
+        if plan['status'] == 'not_found':
+            print(f"Skipping {plan['folder']}: result.json not found.")
+        elif plan['status'] == 'up_to_date':
+            print(f"Skipping {plan['folder']}: unchanged since it was last cleaned.")
         else:
-            print(f"Error: Image file not found on disk: {original_filename}")
-            continue
-
-        # B. Update the JSON entry
-        # We assume you want the relative path "images/filename.jpg" in the JSON
-        image_entry['file_name'] = f"images/{new_filename}"
-        renamed_count += 1
-
-    # 3. Save the updated JSON
-    # We save to a new file first to be safe, then you can rename it if satisfied
-    output_json_path = root_path / 'result_renamed.json'
-    with open(output_json_path, 'w') as f:
-        json.dump(coco_data, f, indent=2)
-
-    print(f"Success! Renamed {renamed_count} images.")
-    print(f"Saved updated annotations to: {output_json_path}")
-    
-    # Optional: Overwrite original result.json automatically
-    shutil.move(output_json_path, json_path)
-    print("Overwrote original result.json")
+            active.append(plan)
+
+    # 2. Journal the plans before touching any file
+    for plan in active:
+        if plan['status'] == 'planned':
+            write_journal(plan)
+
+    # 3. Rename across all datasets at once, 4. commit each dataset as soon as its renames are done
+    with ThreadPoolExecutor(max_workers=rename_workers) as pool:
+        futures = rename_planned(active, pool)
+        for plan, dataset_futures in zip(active, futures):
+            outcomes = [future.result() for future in dataset_futures]
+            commit_dataset(plan, outcomes)
+            report(plan, outcomes)
+    return statuses
+
 
 if __name__ == "__main__":
-    for folder, prefix in DATASETS_TO_PROCESS.items():
-        if os.path.exists(folder):
-            process_dataset(folder, prefix)
-        else:
-            print(f"Directory not found: {folder}")
\ No newline at end of file
+    clean_datasets()
@@ -1,6 +1,15 @@
-import json
+import argparse
 import copy
 import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Shared JSON helpers live in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from coco_io import DECODE_ERRORS, dump_json, dumps, load_json, open_atomic
 
 # --- CONFIGURATION ---
 # Change these values to match your filenames and IDs
@@ -8,57 +17,204 @@ INPUT_FILENAME = 'B1_JSON_export.json'              # Take and enter the file na
 OUTPUT_FILENAME = 'B1_JSON_export-copied.json'      # The new file to create
 SOURCE_ID_TO_COPY = 1100                            # The ID you want to copy FROM in the input file
 
-def distribute_annotations(input_file, output_file, source_id):
+# Fast path: encode the source annotations once and splice the bytes into every
+# task while streaming the output, instead of a deepcopy per task. Annotation
+# ids, task ids and timestamps are still written fresh for every copy.
+FAST_PATH = True
+# ---------------------
+
+# Annotation fields that belong to one task and are regenerated for every copy
+PER_TASK_KEYS = ('id', 'task', 'created_at', 'updated_at')
+
+
+def encode_annotation_templates(annotations):
+    """
+    Pre-encodes the source annotations. Returns one (per_task_keys, body) pair
+    per annotation: the per-task keys to fill in, and every other field
+    already serialized (a JSON object body without the braces).
+    """
+    templates = []
+    for ann in annotations:
+        rest = {key: value for key, value in ann.items() if key not in PER_TASK_KEYS}
+        keys = [key for key in PER_TASK_KEYS if key in ann or key == 'id']
+        templates.append((keys, dumps(rest)[1:-1]))
+    return templates
+
+
+def encode_annotations(templates, task_id, next_id, timestamp):
+    """
+    The encoded annotation list for one task: the pre-encoded bodies with a
+    fresh id, this task's id and the given timestamp spliced in.
+    Returns (bytes, next free annotation id).
+    """
+    encoded = []
+    for keys, body in templates:
+        fields = []
+        for key in keys:
+            if key == 'id':
+                fields.append(b'"id":%d' % next_id)
+                next_id += 1
+            elif key == 'task':
+                fields.append(b'"task":' + dumps(task_id))
+            else:
+                fields.append(b'"' + key.encode() + b'":' + timestamp)
+        if body:
+            fields.append(body)
+        encoded.append(b'{' + b','.join(fields) + b'}')
+    return b'[' + b','.join(encoded) + b']', next_id
+
+
+def write_with_shared_annotations(data, source_id, source_annotations, output_file, next_id, timestamp):
+    """
+    Streams the tasks to output_file, giving every task except the source a
+    copy of the source annotations spliced in from pre-encoded bytes.
+    Returns the number of tasks that got annotations.
+    """
+    templates = encode_annotation_templates(source_annotations)
+    timestamp = dumps(timestamp)
+
+    count = 0
+    with open_atomic(output_file) as out:
+        out.write(b'[')
+        for i, task in enumerate(data):
+            out.write(b'\n' if i == 0 else b',\n')
+            if task.get('id') == source_id:
+                out.write(dumps(task))
+                continue
+
+            annotations, next_id = encode_annotations(templates, task.get('id'), next_id, timestamp)
+            head = dumps({key: value for key, value in task.items() if key != 'annotations'})[:-1]
+            out.write(head + (b',' if len(head) > 1 else b'') + b'"annotations":' + annotations + b'}')
+            count += 1
+        out.write(b'\n]\n')
+    return count
+
+
+def copy_with_deepcopy(data, source_id, source_annotations, next_id, timestamp):
+    """
+    The original approach: an independent deepcopy of the annotations per
+    task, with the same fresh per-task fields as the fast path.
+    """
+    count = 0
+    for task in data:
+        # Skip the source ID (though its harmless to overwrite)
+        if task.get('id') == source_id: continue
+
+        # deepcopy again so every task gets its own independent list object
+        annotations = copy.deepcopy(source_annotations)
+        for ann in annotations:
+            ann['id'] = next_id
+            next_id += 1
+            if 'task' in ann:
+                ann['task'] = task.get('id')
+            for key in ('created_at', 'updated_at'):
+                if key in ann:
+                    ann[key] = timestamp
+        task['annotations'] = annotations
+        count += 1
+    return count
+
+
+def distribute_annotations(input_file, output_file, source_id, fast=FAST_PATH, timestamp=None):
     """
     Copies annotations from a specific ID to all other tasks in the JSON file.
+    The copies get new ids after the file's highest annotation id and
+    `timestamp` (default: now) as created_at/updated_at.
     """
-    
+
     # 1. Load the JSON data
     if not os.path.exists(input_file):
         print(f"Error: The file '{input_file}' was not found.")
         return
 
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-    except json.JSONDecodeError:
+        data = load_json(input_file)
+    except DECODE_ERRORS:
         print("Error: Failed to decode JSON. Please check the file format.")
         return
 
     # 2. Find the source annotations
     source_annotations = None
-    
+
     for task in data:
         if task.get('id') == source_id:
             # We use deepcopy to ensure we get a clean snapshot of the data
             source_annotations = copy.deepcopy(task.get('annotations', []))
             print(f"Found source ID {source_id}. Annotations extracted.")
             break
-            
+
     if source_annotations is None:
         print(f"Error: ID {source_id} was not found in the file.")
         return
 
-    # 3. Apply annotations to all tasks
-    count = 0
-    for task in data:
-        # Skip the source ID (though its harmless to overwrite)
-        if task.get('id') == source_id: continue
-        
-        # deepcopy again so every task gets its own independent list object
-        task['annotations'] = copy.deepcopy(source_annotations)
-        count += 1
+    next_id = max((ann.get('id') or 0 for task in data for ann in task.get('annotations', [])), default=0) + 1
+    if timestamp is None:
+        timestamp = datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
 
-    # 4. Save the modified data
+    # 3. Apply annotations to all tasks and 4. save the modified data
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4)
+        if fast:
+            count = write_with_shared_annotations(data, source_id, source_annotations, output_file, next_id, timestamp)
+        else:
+            count = copy_with_deepcopy(data, source_id, source_annotations, next_id, timestamp)
+            dump_json(data, output_file)
         print(f"Success! Copied annotations to {count} tasks.")
         print(f"Saved to: {output_file}")
     except Exception as e:
         print(f"Error saving file: {e}")
 
 
+# --- Benchmark ---
+
+def generate_export(num_tasks=5000, regions=50, source_id=1):
+    """A synthetic Label Studio JSON export where only task `source_id` is annotated."""
+    result = [
+        {"id": f"r{i}", "type": "rectanglelabels", "from_name": "label", "to_name": "image",
+         "original_width": 4056, "original_height": 3040, "image_rotation": 0,
+         "value": {"x": i % 90, "y": i % 80, "width": 1.5, "height": 1.2, "rotation": 0,
+                   "rectanglelabels": ["PCN_Cyst"]}}
+        for i in range(regions)
+    ]
+    tasks = []
+    for task_id in range(1, num_tasks + 1):
+        tasks.append({
+            "id": task_id, "data": {"image": f"/data/upload/1/B1-{task_id:05d}_25112025.jpg"},
+            "annotations": [], "predictions": [], "meta": {}, "project": 1,
+            "created_at": "2025-11-25T10:00:00.000000Z", "updated_at": "2025-11-25T10:00:00.000000Z",
+        })
+    tasks[source_id - 1]["annotations"] = [{
+        "id": 1, "completed_by": 1, "result": result, "was_cancelled": False, "ground_truth": False,
+        "created_at": "2025-11-25T10:00:00.000000Z", "updated_at": "2025-11-25T10:00:00.000000Z",
+        "lead_time": 12.5, "task": source_id, "project": 1,
+    }]
+    return tasks
+
+
+def benchmark(num_tasks=5000, regions=50):
+    with tempfile.TemporaryDirectory() as workdir:
+        input_file = os.path.join(workdir, 'export.json')
+        dump_json(generate_export(num_tasks, regions), input_file)
+        print(f"{num_tasks} tasks, {regions} regions in the source annotation\n")
+        print(f"{'approach':<12}{'seconds':>10}{'output MB':>12}")
+        outputs = []
+        for label, fast in (('deepcopy', False), ('fast path', True)):
+            output_file = os.path.join(workdir, f'out-{label}.json')
+            start = time.perf_counter()
+            distribute_annotations(input_file, output_file, 1, fast=fast, timestamp="2025-11-26T09:00:00.000000Z")
+            seconds = time.perf_counter() - start
+            print(f"{label:<12}{seconds:>10.2f}{os.path.getsize(output_file) / 1e6:>12.1f}")
+            outputs.append(load_json(output_file))
+        assert outputs[0] == outputs[1], "the deepcopy and fast path outputs differ"
+
+
 # Run the function
 if __name__ == "__main__":
-    distribute_annotations(INPUT_FILENAME, OUTPUT_FILENAME, SOURCE_ID_TO_COPY)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Copy one task's annotations to all other tasks.")
+    parser.add_argument('--benchmark', action='store_true', help="Compare deepcopy with the fast path")
+    parser.add_argument('--tasks', type=int, default=5000, help="Tasks in the benchmark export")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.tasks)
+    else:
+        distribute_annotations(INPUT_FILENAME, OUTPUT_FILENAME, SOURCE_ID_TO_COPY)
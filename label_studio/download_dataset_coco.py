@@ -1,10 +1,21 @@
 import os
-import json
-import requests
+import sys
+import time
+import argparse
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from label_studio_sdk import Client
 from label_studio_converter import Converter
 
+# Shared JSON helpers live in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from coco_io import dump_json, load_json
+from image_index import decoded_size, fill_coco_dimensions, scan_directory
+
+from image_cache import ImageCache
+from image_fetcher import fetch_images
+
 # --- CONFIGURATION ---
 LABEL_STUDIO_URL = 'http://192.168.1.176:80'  # Your Label Studio URL
 # If the variable isn't found, this returns None (or you can set a default)
@@ -12,34 +23,44 @@ API_KEY = os.getenv('LABEL_STUDIO_TOKEN')   # Your API Key
 PROJECT_ID = 1                              # The Project ID you want to export
 BOTTLE_ID = 1                               # Specific to my needs and folder generation when batch processing
 OUTPUT_DIR = f'B{BOTTLE_ID}-COCO'          # Where to save the data
+DOWNLOAD_WORKERS = 8                        # Concurrent image downloads
+DOWNLOAD_RETRIES = 3                        # Retries per image (with exponential backoff)
+
+# Content-addressed image cache shared by all exports (None to disable).
+# Output images are reflinked/hardlinked from it, so re-exports don't duplicate JPEGs.
+IMAGE_CACHE_DIR = None                      # e.g. '/root/zfs-crow-compute/datasets/PCN/.image-cache'
+IMAGE_CACHE_MAX_GB = 200                    # Least recently used images are evicted beyond this
+
+# Batch export: Label Studio project ID -> bottle ID (output goes to B{bottle}-COCO)
+PROJECT_TO_BOTTLE = {28 + i: 9 - i for i in range(1, 9)}   # projects 29-36 -> bottles 8-1
+EXPORT_WORKERS = 4                          # Projects exported at the same time
 # ---------------------
 
-if not API_KEY:
-    raise ValueError("Error: LABEL_STUDIO_TOKEN environment variable is not set.")
 
-def export_coco_with_images():
-    # 1. Setup & Connection
-    ls = Client(url=LABEL_STUDIO_URL, api_key=API_KEY)
-    project = ls.get_project(PROJECT_ID)
-    
-    # Create output directories
-    output_path = Path(OUTPUT_DIR)
-    images_dir = output_path / 'images'
-    images_dir.mkdir(parents=True, exist_ok=True)
-    
-    print(f"Fetching data for Project {PROJECT_ID}...")
+def _require_api_key():
+    if not API_KEY:
+        raise ValueError("Error: LABEL_STUDIO_TOKEN environment variable is not set.")
 
-    # 2. Create a NEW Snapshot, then Download it
-    # We split this into two steps to avoid the TypeError
-    
-    # Step A: Create the snapshot
+
+def open_image_cache():
+    """The shared ImageCache from the configuration, or None if disabled."""
+    if IMAGE_CACHE_DIR is None:
+        return None
+    return ImageCache(IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_GB * 1024**3)
+
+
+def create_snapshot(project, log=print):
+    """Creates a new export snapshot and returns its ID."""
     snapshot = project.export_snapshot_create(
         title='Auto Export COCO'
     )
     export_id = snapshot['id']
-    print(f"Snapshot created with ID: {export_id}")
+    log(f"Snapshot created with ID: {export_id}")
+    return export_id
 
-    # Step B: Download it using the ID
+
+def download_snapshot(project, export_id, output_path):
+    """Downloads a snapshot as Label Studio JSON and returns the loaded tasks."""
     # Note: We assume the file creates a file named after the project/time
     # The SDK downloads it to the 'path' directory.
     downloaded_filename = project.export_snapshot_download(
@@ -47,28 +68,32 @@ def export_coco_with_images():
         export_type='JSON',
         path=str(output_path)
     )
-    
+
     # Verify if SDK returned a tuple (success, filename) or just filename
     if isinstance(downloaded_filename, tuple):
-        downloaded_filename = downloaded_filename[1] 
+        downloaded_filename = downloaded_filename[1]
 
-    # --- THE FIX IS HERE ---
     # Combine the directory (output_path) with the filename
     full_json_path = output_path / downloaded_filename
 
-    with open(full_json_path, 'r') as f:
-        tasks = json.load(f)
+    return load_json(full_json_path)
 
-    print(f"Downloaded {len(tasks)} tasks. Downloading images...")
 
-    # 3. Download Images & Update Paths
-    # We must download images so the Converter can read their dimensions (required for COCO)
+def fetch_task_images(tasks, images_dir, log_prefix='', cache=None):
+    """
+    Downloads every task's image into images_dir and points the task at the
+    local copy. We must download images so the Converter can read their
+    dimensions (required for COCO).
+    """
     headers = {'Authorization': f'Token {API_KEY}'}
-    
+
+    # Work out where every image goes first, then fetch them all in parallel
+    jobs = []
+    task_paths = []
     for task in tasks:
         # Extract image URL (supports different data key names usually 'image' or 'url')
         image_url = task['data'].get('image') or task['data'].get('url')
-        
+
         if not image_url:
             continue
 
@@ -80,38 +105,39 @@ def export_coco_with_images():
 
         # Generate a safe local filename
         # We use the ID to ensure uniqueness if filenames are duplicate
-        file_name = os.path.basename(image_url.split('?')[0]) 
+        file_name = os.path.basename(image_url.split('?')[0])
         local_filename = f"{task['id']}_{file_name}"
         local_path = images_dir / local_filename
 
-        # Download the image if it doesn't exist
+        jobs.append((full_url, local_path))
+        task_paths.append((task, local_path))
+
+    # Download the images that don't exist yet
+    report = fetch_images(jobs, headers=headers, workers=DOWNLOAD_WORKERS, retries=DOWNLOAD_RETRIES,
+                          prefix=log_prefix, cache=cache)
+
+    for task, local_path in task_paths:
         if not local_path.exists():
-            try:
-                r = requests.get(full_url, headers=headers, stream=True)
-                r.raise_for_status()
-                with open(local_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        f.write(chunk)
-            except Exception as e:
-                print(f"Failed to download {full_url}: {e}")
-                continue
+            # Download failed, leave the task pointing at the remote image
+            continue
 
         # CRITICAL: Update the task data to point to the local file
         # The converter needs this to read image width/height
         task['data']['image'] = str(local_path.absolute())
 
+    return report
+
+
+def convert_tasks_to_coco(project, tasks, output_path, images_dir):
+    """Converts Label Studio tasks with local image paths to output_path/result.json."""
     # Save the updated JSON with local paths (temporary file)
     temp_json_path = output_path / 'temp_local_tasks.json'
-    with open(temp_json_path, 'w') as f:
-        json.dump(tasks, f)
+    dump_json(tasks, temp_json_path)
 
-    # 4. Convert to COCO
-    print("Converting to COCO format...")
-    
     try:
         project_config = project.get_params()['label_config']
         converter = Converter(config=project_config, project_dir=None)
-        
+
         # FIX: Pass paths as positional arguments (without "input_data=" or "output_file=")
         converter.convert_to_coco(
             str(temp_json_path),                 # Arg 1: Input file path
@@ -119,23 +145,179 @@ def export_coco_with_images():
             output_image_dir=str(images_dir),    # Arg 3: Image directory (keyword ok)
             is_dir=False
         )
-        print(f"SUCCESS: Project {PROJECT_ID} saved to {output_path}/result.json")
-    except Exception as e:
-        print(f"Conversion failed for {PROJECT_ID}: {e}")
-        # Optional: print full traceback to debug deep errors
-        import traceback
-        traceback.print_exc()
+    finally:
+        # Cleanup temp file
+        if os.path.exists(temp_json_path):
+            os.remove(temp_json_path)
+
+    return output_path / 'result.json'
+
+
+def check_images(images, images_dir, log=print):
+    """
+    Checks the exported images against their headers (image_index.py) and
+    takes COCO width/height from there, so images the converter couldn't open
+    still get dimensions. Images whose header looks wrong are decoded, and
+    only those that fail to decode are deleted so the next export fetches
+    them again. Returns the number of bad images.
+    """
+    infos = scan_directory(images_dir)
+    suspects = [name for name, info in infos.items() if not info.ok]
+    bad = [name for name in suspects if decoded_size(images_dir / name) is None]
+    for name in bad:
+        log(f"Warning: {name} is truncated or corrupt, deleting it so it is downloaded again.")
+        os.remove(images_dir / name)
+
+    unreadable = fill_coco_dimensions(images, images_dir, infos)
+    if unreadable:
+        log(f"Warning: no readable image for {len(unreadable)} COCO entries")
+    return len(bad)
+
+
+def check_coco_images(result_path, images_dir, log=print):
+    """check_images() for the COCO file at result_path, which is rewritten with the dimensions."""
+    coco = load_json(result_path)
+    bad = check_images(coco['images'], images_dir, log)
+    dump_json(coco, result_path)
+    return bad
+
+
+def export_coco_with_images(project_id=None, bottle_id=None, output_dir=None, status=None, cache=None, check=True):
+    """
+    Exports one project: snapshot-create, download, image-fetch and convert.
 
-    # Cleanup temp file
-    if os.path.exists(temp_json_path):
-        os.remove(temp_json_path)
+    Defaults come from PROJECT_ID / BOTTLE_ID / OUTPUT_DIR. If a `status` dict
+    is passed, status[project_id] is updated with the current phase. Images go
+    through `cache` (an ImageCache) if given. With check=False the images are
+    not checked and result.json is left as the converter wrote it (the
+    pipeline runs check_images() on its in-memory copy instead).
+    Raises on failure; returns the path of the written result.json.
+    """
+    _require_api_key()
+    if output_dir is None:
+        output_dir = OUTPUT_DIR if bottle_id is None else f'B{bottle_id}-COCO'
+    project_id = PROJECT_ID if project_id is None else project_id
+    bottle_id = BOTTLE_ID if bottle_id is None else bottle_id
+
+    prefix = f"[Project {project_id} / B{bottle_id}] "
+
+    def log(message):
+        print(f"{prefix}{message}")
+
+    def phase(name):
+        if status is not None:
+            status[project_id] = name
+        log(f"-> {name}")
+
+    # 1. Setup & Connection
+    ls = Client(url=LABEL_STUDIO_URL, api_key=API_KEY)
+    project = ls.get_project(project_id)
+
+    # Create output directories
+    output_path = Path(output_dir)
+    images_dir = output_path / 'images'
+    images_dir.mkdir(parents=True, exist_ok=True)
+
+    # 2. Create a NEW Snapshot, then Download it
+    # We split this into two steps to avoid the TypeError
+    phase('snapshot-create')
+    export_id = create_snapshot(project, log)
+
+    phase('download')
+    tasks = download_snapshot(project, export_id, output_path)
+    log(f"Downloaded {len(tasks)} tasks.")
+
+    # 3. Download Images & Update Paths
+    phase('image-fetch')
+    fetch_task_images(tasks, images_dir, log_prefix=prefix, cache=cache)
+
+    # 4. Convert to COCO
+    phase('convert')
+    result_path = convert_tasks_to_coco(project, tasks, output_path, images_dir)
+    if check:
+        check_coco_images(result_path, images_dir, log)
+
+    phase('done')
+    log(f"SUCCESS: Export saved to {result_path}")
+    return result_path
+
+
+def export_projects(project_to_bottle, workers=EXPORT_WORKERS, check=True):
+    """
+    Exports several projects at once with a bounded thread pool.
+
+    Each project runs its phases independently; a failing project is reported
+    and doesn't stop the others. Returns {project_id: result} where result is
+    a dict with 'status', 'seconds' and either 'result_path' or 'error'.
+    `check` is passed on to export_coco_with_images().
+    """
+    _require_api_key()
+    status = {project_id: 'queued' for project_id in project_to_bottle}
+    results = {}
+    cache = open_image_cache()
+
+    def run(project_id, bottle_id):
+        start = time.monotonic()
+        result_path = export_coco_with_images(project_id, bottle_id, status=status, cache=cache, check=check)
+        return result_path, time.monotonic() - start
+
+    print(f"Exporting {len(project_to_bottle)} projects with {workers} workers...")
+    start = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(run, project_id, bottle_id): project_id
+            for project_id, bottle_id in project_to_bottle.items()
+        }
+        for future in as_completed(futures):
+            project_id = futures[future]
+            try:
+                result_path, seconds = future.result()
+                results[project_id] = {'status': 'ok', 'seconds': seconds, 'result_path': str(result_path)}
+            except Exception as e:
+                failed_phase = status[project_id]
+                status[project_id] = 'failed'
+                results[project_id] = {'status': 'failed', 'phase': failed_phase, 'error': str(e)}
+                print(f"[Project {project_id}] FAILED during {failed_phase}: {e}")
+                traceback.print_exc()
+
+    if cache is not None:
+        cache.close()
+
+    print(f"\n============ Export summary ({time.monotonic() - start:.1f}s) ============")
+    for project_id, bottle_id in project_to_bottle.items():
+        result = results[project_id]
+        if result['status'] == 'ok':
+            print(f"  Project {project_id} -> B{bottle_id}-COCO: ok ({result['seconds']:.1f}s)")
+        else:
+            print(f"  Project {project_id} -> B{bottle_id}-COCO: FAILED in {result['phase']}: {result['error']}")
+
+    return results
+
+
+def parse_project_map(pairs):
+    """Parses ['29:8', '30:7'] into {29: 8, 30: 7}."""
+    mapping = {}
+    for pair in pairs:
+        project_id, _, bottle_id = pair.partition(':')
+        if not bottle_id:
+            raise ValueError(f"Expected PROJECT:BOTTLE, got '{pair}'")
+        mapping[int(project_id)] = int(bottle_id)
+    return mapping
 
-    print(f"SUCCESS: Export saved to {output_path}/result.json")
 
 if __name__ == "__main__":
-    for i in range(1, 9):
-        PROJECT_ID = i + 28
-        BOTTLE_ID = 9 - i
-        OUTPUT_DIR = f'B{BOTTLE_ID}-COCO'          # Where to save the data
-        export_coco_with_images()
-        print("\n============\n")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Export Label Studio projects as COCO datasets with images.")
+    parser.add_argument('--map', nargs='+', metavar='PROJECT:BOTTLE',
+                        help="Projects to export and their bottle IDs (default: PROJECT_TO_BOTTLE)")
+    parser.add_argument('--workers', type=int, default=EXPORT_WORKERS,
+                        help="Projects exported at the same time")
+    args = parser.parse_args()
+
+    try:
+        project_map = parse_project_map(args.map) if args.map else PROJECT_TO_BOTTLE
+    except ValueError as e:
+        parser.error(str(e))
+    results = export_projects(project_map, workers=args.workers)
+    if any(result['status'] != 'ok' for result in results.values()):
+        exit(1)
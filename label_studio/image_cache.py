@@ -0,0 +1,173 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from image_fetcher import is_retryable
+
+# Shared file helpers live in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from materialize import link_or_copy
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS urls (
+    url           TEXT PRIMARY KEY,
+    etag          TEXT,
+    last_modified TEXT,
+    sha256        TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS objects (
+    sha256    TEXT PRIMARY KEY,
+    size      INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_last_used ON objects (last_used);
+"""
+
+
+class ImageCache:
+    """
+    Content-addressed image cache shared between exports.
+
+    Layout of the cache directory:
+
+        objects/ab/ab12...ef       image bytes, named by their SHA-256
+        index.sqlite               url -> ETag/Last-Modified/sha256, object sizes and last use
+
+    A URL already in the cache is revalidated with a conditional GET
+    (If-None-Match / If-Modified-Since); on 304 nothing is downloaded. Two URLs
+    serving the same bytes share one object. Output files are reflinked or
+    hardlinked to the object (see materialize.link_or_copy), so re-exporting
+    the same upload into another project or directory costs no extra disk.
+    When the objects exceed `max_bytes` the least recently used are evicted;
+    already linked outputs are unaffected.
+    """
+
+    def __init__(self, root, max_bytes=100 * 1024**3, revalidate=True):
+        self.root = Path(root)
+        self.objects_dir = self.root / 'objects'
+        self.tmp_dir = self.root / 'tmp'
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.revalidate = revalidate
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.root / 'index.sqlite', check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def object_path(self, sha256):
+        return self.objects_dir / sha256[:2] / sha256
+
+    def _lookup(self, url):
+        with self._lock:
+            return self._db.execute(
+                "SELECT u.etag, u.last_modified, u.sha256 FROM urls u "
+                "JOIN objects o ON o.sha256 = u.sha256 WHERE u.url = ?", (url,)
+            ).fetchone()
+
+    def _touch(self, sha256):
+        with self._lock:
+            self._db.execute("UPDATE objects SET last_used = ? WHERE sha256 = ?", (time.time(), sha256))
+            self._db.commit()
+
+    def _store(self, url, response):
+        """Streams a response body into the cache and returns (sha256, size)."""
+        digest = hashlib.sha256()
+        size = 0
+        tmp_path = self.tmp_dir / f"{uuid.uuid4().hex}.part"
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            sha256 = digest.hexdigest()
+            path = self.object_path(sha256)
+            path.parent.mkdir(exist_ok=True)
+            if path.exists():
+                tmp_path.unlink()   # Same bytes already cached under another URL
+            else:
+                os.replace(tmp_path, path)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+        with self._lock:
+            existing = self._db.execute("SELECT 1 FROM objects WHERE sha256 = ?", (sha256,)).fetchone()
+            if existing is None:
+                self._total_bytes += size
+            self._db.execute(
+                "INSERT INTO objects (sha256, size, last_used) VALUES (?, ?, ?) "
+                "ON CONFLICT(sha256) DO UPDATE SET last_used = excluded.last_used",
+                (sha256, size, time.time()))
+            self._db.execute(
+                "INSERT OR REPLACE INTO urls (url, etag, last_modified, sha256) VALUES (?, ?, ?, ?)",
+                (url, response.headers.get('ETag'), response.headers.get('Last-Modified'), sha256))
+            self._db.commit()
+        return sha256, size
+
+    def fetch(self, session, url, dest_path, retries=3, backoff=0.5, timeout=30):
+        """
+        Puts the image at `url` at `dest_path`, downloading only if the cache
+        doesn't have a current copy. Returns (bytes_downloaded, cache_hit).
+        """
+        for attempt in range(retries + 1):
+            try:
+                cached = self._lookup(url)
+                headers = {}
+                if cached is not None:
+                    etag, last_modified, sha256 = cached
+                    path = self.object_path(sha256)
+                    if not path.exists():
+                        cached = None
+                    elif not self.revalidate:
+                        self._touch(sha256)
+                        link_or_copy(path, dest_path)
+                        return 0, True
+                    else:
+                        if etag:
+                            headers['If-None-Match'] = etag
+                        if last_modified:
+                            headers['If-Modified-Since'] = last_modified
+
+                with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+                    if r.status_code == 304 and cached is not None:
+                        self._touch(sha256)
+                        link_or_copy(path, dest_path)
+                        return 0, True
+                    r.raise_for_status()
+                    sha256, size = self._store(url, r)
+
+                link_or_copy(self.object_path(sha256), dest_path)
+                self.evict()
+                return size, False
+            except Exception as e:
+                if attempt == retries or not is_retryable(e):
+                    raise
+                time.sleep(backoff * (2 ** attempt))
+
+    def evict(self):
+        """Deletes least recently used objects until the cache fits max_bytes."""
+        if self._total_bytes <= self.max_bytes:
+            return
+        with self._lock:
+            # Evict down to 90% so we don't evict again on the next insert
+            target = self.max_bytes * 0.9
+            rows = self._db.execute("SELECT sha256, size FROM objects ORDER BY last_used").fetchall()
+            for sha256, size in rows:
+                if self._total_bytes <= target:
+                    break
+                self.object_path(sha256).unlink(missing_ok=True)
+                self._db.execute("DELETE FROM urls WHERE sha256 = ?", (sha256,))
+                self._db.execute("DELETE FROM objects WHERE sha256 = ?", (sha256,))
+                self._total_bytes -= size
+            self._db.commit()
@@ -0,0 +1,151 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# HTTP statuses worth retrying; any other 4xx fails straight away
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+@dataclass
+class FetchReport:
+    """Outcome of a fetch_images() run."""
+    downloaded: int = 0
+    cached: int = 0
+    skipped: int = 0
+    failed: dict = field(default_factory=dict)   # url -> error message
+    bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def mb_per_second(self):
+        return self.bytes / 1e6 / self.seconds if self.seconds else 0.0
+
+
+def make_session(headers=None, pool_size=8):
+    """A requests.Session whose connection pool can serve `pool_size` threads."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+def is_retryable(error):
+    """True for errors a retry might fix: timeouts, dropped connections, 5xx/429."""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRY_STATUSES
+    # Not OSError: every requests exception is one, and so are local disk errors
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+
+def download_file(session, url, dest_path, retries=3, backoff=0.5, timeout=30, chunk_size=1 << 16):
+    """
+    Downloads `url` to `dest_path` and returns the number of bytes received.
+
+    Data goes to a `.part` file next to the destination which is renamed into
+    place only once complete, so an interrupted run never leaves a truncated
+    image behind. A leftover `.part` file is resumed with a Range request if
+    the server supports it.
+    """
+    dest_path = Path(dest_path)
+    tmp_path = dest_path.with_name(f".{dest_path.name}.part")
+
+    for attempt in range(retries + 1):
+        try:
+            offset = tmp_path.stat().st_size if tmp_path.exists() else 0
+            headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as r:
+                r.raise_for_status()
+                # 206 = server honoured the Range, anything else is the whole file
+                mode = 'ab' if r.status_code == 206 else 'wb'
+                received = 0
+                with open(tmp_path, mode) as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        received += len(chunk)
+
+            os.replace(tmp_path, dest_path)
+            return received
+        except Exception as e:
+            stale_part = isinstance(e, requests.HTTPError) and e.response is not None \
+                and e.response.status_code == 416
+            if stale_part:
+                # The .part file no longer matches the remote file, start over
+                tmp_path.unlink(missing_ok=True)
+            if attempt == retries or not (stale_part or is_retryable(e)):
+                tmp_path.unlink(missing_ok=True)
+                raise
+            time.sleep(backoff * (2 ** attempt))
+
+
+def fetch_images(jobs, headers=None, workers=8, retries=3, backoff=0.5, timeout=30, report_every=5.0, prefix='',
+                 cache=None):
+    """
+    Downloads many files concurrently over one pooled session.
+
+    `jobs` is an iterable of (url, dest_path). Destinations that already exist
+    are skipped. Progress and throughput are printed every `report_every`
+    seconds, each line starting with `prefix`. If an ImageCache is given,
+    images come from / go through it instead of straight to disk.
+    Returns a FetchReport; failures are collected, not raised.
+    """
+    jobs = list(jobs)
+    report = FetchReport()
+    pending = []
+    for url, dest_path in jobs:
+        if Path(dest_path).exists():
+            report.skipped += 1
+        else:
+            pending.append((url, dest_path))
+
+    print(f"{prefix}Fetching {len(pending)} images with {workers} workers ({report.skipped} already present)...")
+    if not pending:
+        return report
+
+    session = make_session(headers, pool_size=workers)
+    if cache is not None:
+        fetch_one = cache.fetch
+    else:
+        def fetch_one(*args):
+            return download_file(*args), False
+    start = time.monotonic()
+    last_report = start
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(fetch_one, session, url, dest_path, retries, backoff, timeout): url
+            for url, dest_path in pending
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            url = futures[future]
+            try:
+                size, hit = future.result()
+                if hit:
+                    report.cached += 1
+                else:
+                    report.downloaded += 1
+                report.bytes += size
+            except Exception as e:
+                report.failed[url] = str(e)
+                print(f"{prefix}Failed to download {url}: {e}")
+
+            now = time.monotonic()
+            if now - last_report >= report_every or done == len(pending):
+                elapsed = now - start
+                rate = report.bytes / 1e6 / elapsed if elapsed else 0.0
+                print(f"{prefix}  [{done}/{len(pending)}] {report.bytes / 1e6:.1f} MB, {rate:.1f} MB/s")
+                last_report = now
+
+    session.close()
+    report.seconds = time.monotonic() - start
+    print(f"{prefix}Downloaded {report.downloaded} images ({report.bytes / 1e6:.1f} MB) in {report.seconds:.1f}s "
+          f"at {report.mb_per_second:.1f} MB/s, {report.cached} from cache, {len(report.failed)} failed.")
+    return report
@@ -1,12 +1,23 @@
-import json
 import os
-import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import ijson
+import numpy as np
+from ijson.common import ObjectBuilder
+
+# Shared COCO helpers live in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from coco_index import CocoIndex, match_categories
+from coco_io import open_binary
+from coco_stream import CocoStreamWriter, iter_coco
+from materialize import Materializer, read_manifest
+
 # --- CONFIGURATION ---
 # List of input folders (the ones you just cleaned)
 INPUT_DATASETS = [
-    "B1-COCO", "B2-COCO", "B3-COCO", "B4-COCO", 
+    "B1-COCO", "B2-COCO", "B3-COCO", "B4-COCO",
     "B5-COCO", "B6-COCO", "B7-COCO", "B8-COCO"
 ]
 
@@ -14,132 +25,294 @@ OUTPUT_DIR = "B1-8-COCO"
 
 # Which JSON file to look for in the input folders?
 # If you ran the previous script but didn't rename the result file, use 'result_renamed.json'
-TARGET_JSON_NAME = "result_renamed.json" 
+TARGET_JSON_NAME = "result_renamed.json"
+
+# How images get into OUTPUT_DIR/images:
+#   'copy'     - real copies (old behaviour)
+#   'reflink'  - copy-on-write clones, no extra disk until modified (falls back to copy)
+#   'hardlink' - same inode as the input image (falls back to reflink, then copy)
+#   'symlink'  - links pointing back at the input folders
+#   'manifest' - write no images, only OUTPUT_DIR/images_manifest.csv (split_coco.py reads it)
+IMAGE_STRATEGY = 'reflink'
+COPY_WORKERS = 8        # Parallel copies when a real copy is needed
+LOAD_WORKERS = 8        # Processes parsing/validating input datasets
+
+# Incremental mode: if OUTPUT_DIR/result.json exists, only datasets not already
+# merged into it (see info.merged_datasets) are added, e.g. append B9-COCO
+# without rebuilding B1-8.
+INCREMENTAL = False
 # ---------------------
 
-def merge_datasets():
+
+def find_dataset_json(dataset_path):
+    """The dataset's COCO JSON: TARGET_JSON_NAME, falling back to result.json."""
+    json_file = dataset_path / TARGET_JSON_NAME
+
+    # Fallback to result.json if renamed version doesn't exist
+    if not json_file.exists():
+        json_file = dataset_path / 'result.json'
+
+    return json_file if json_file.exists() else None
+
+
+def load_dataset(dataset_folder):
+    """
+    Parses and validates one input dataset. Runs in a worker process.
+
+    Returns None if the folder has no JSON, otherwise (index, image_paths,
+    warnings): a CocoIndex of the images that exist on disk (file_name set to
+    "images/<name>", ids still local to this dataset) and their source paths.
+    Raises ValueError if the dataset can't be merged.
+    """
+    json_file = find_dataset_json(Path(dataset_folder))
+    if json_file is None:
+        return None
+    return prepare_dataset(dataset_folder, CocoIndex.load(json_file))
+
+
+def prepare_dataset(dataset_folder, index):
+    """load_dataset() for an index that is already in memory (see pipeline.py)."""
+    dataset_path = Path(dataset_folder)
+    warnings = []
+
+    if len(np.unique(index.image_ids)) != index.num_images:
+        raise ValueError(f"{dataset_folder}: duplicate image ids")
+
+    category_ids = {cat['id'] for cat in index.categories}
+    undefined = set(np.unique(index.ann_category_ids).tolist()) - category_ids
+    if undefined:
+        raise ValueError(f"{dataset_folder}: annotations use undefined category ids {sorted(undefined)}")
+
+    orphans = int(np.count_nonzero(index.ann_image_rows < 0))
+    if orphans:
+        warnings.append(f"{orphans} annotations reference unknown image ids, dropping them")
+
+    # Keep only the image rows whose file exists
+    present_rows = []
+    image_paths = []
+    for row, img in enumerate(index.images):
+        filename = os.path.basename(img['file_name'])
+        src_image_path = dataset_path / 'images' / filename
+        if not src_image_path.exists():
+            warnings.append(f"Image missing {src_image_path}")
+            continue
+
+        # Ensure path is standard relative path
+        img['file_name'] = f"images/{filename}"
+        present_rows.append(row)
+        image_paths.append(str(src_image_path))
+
+    # Drops annotations of skipped images along with them
+    return index.subset(present_rows), image_paths, warnings
+
+
+def assign_global_ids(datasets, categories, next_image_id, next_ann_id):
+    """
+    Single deterministic pass that gives every dataset global ids.
+
+    `datasets` are CocoIndex objects in merge order. Categories are matched by
+    name: Dataset 1 might have "Bottle"=0 and Dataset 2 "Bottle"=5, so each
+    dataset gets a local->global map, and unseen names are appended to
+    `categories` (in place). Returns the next free (image_id, annotation_id).
+    """
+    for index in datasets:
+        # Map the local category ids to the global ones by name
+        local_cat_id_to_global = match_categories(index.categories, categories)
+
+        # Remap IDs (vectorized over the whole dataset)
+        index.renumber_images(next_image_id)
+        index.renumber_annotations(next_ann_id)
+        index.remap_categories(local_cat_id_to_global)
+        next_image_id += index.num_images
+        next_ann_id += index.num_annotations
+
+    return next_image_id, next_ann_id
+
+
+def materialize_datasets(datasets, output_images_dir, materializer, workers=COPY_WORKERS):
+    """
+    Puts the images of (folder, index, image_paths) datasets into
+    output_images_dir in one parallel batch. Images that couldn't be placed
+    are dropped from their dataset's index and image paths. Returns the datasets.
+    """
+    image_pairs = [
+        (src, output_images_dir / os.path.basename(src))
+        for _, _, image_paths in datasets for src in image_paths
+    ]
+    failed = materializer.materialize_many(image_pairs, workers=workers)
+    for src_image_path, error in failed.items():
+        print(f"  Warning: Could not materialize {src_image_path}: {error}")
+    if failed:
+        datasets = [
+            (dataset_folder,
+             index.subset(np.fromiter((src not in failed for src in image_paths), dtype=bool, count=len(image_paths))),
+             [src for src in image_paths if src not in failed])
+            for dataset_folder, index, image_paths in datasets
+        ]
+    return datasets
+
+
+def read_merged_summary(merged_json):
+    """
+    The small sections (info, licenses, categories) of an existing merged
+    file and its highest image and annotation ids, in one pass of the
+    iterative parser without building any image or annotation.
+    """
+    sections = {}
+    max_ids = {'images.item.id': 0, 'annotations.item.id': 0}
+    builder = None
+    with open_binary(merged_json, 'rb') as f:
+        for prefix, event, value in ijson.parse(f, use_float=True):
+            if prefix in max_ids:
+                max_ids[prefix] = max(max_ids[prefix], int(value))
+            elif builder is not None:
+                builder.event(event, value)
+                # The section ends where its own brackets close
+                if prefix in ('info', 'licenses', 'categories') and event in ('end_map', 'end_array'):
+                    sections[prefix] = builder.value
+                    builder = None
+            elif prefix in ('info', 'licenses', 'categories'):
+                builder = ObjectBuilder()
+                builder.event(event, value)
+                if event not in ('start_map', 'start_array'):
+                    sections[prefix] = builder.value
+                    builder = None
+    return sections, max_ids['images.item.id'], max_ids['annotations.item.id']
+
+
+def write_merged_json(output_json, info, licenses, categories, indexes, previous=None):
+    """
+    Streams the indexes into one COCO file (replaced atomically). With
+    `previous` (an earlier output of this function) its images and
+    annotations are passed through first, without loading the file.
+    Returns the item counts.
+    """
+    def write_new(key):
+        for index in indexes:
+            for item in (index.images if key == 'images' else index.iter_annotations()):
+                out.write_item(item)
+
+    with CocoStreamWriter(output_json) as out:
+        out.write_section("info", info)
+        out.write_section("licenses", licenses)
+        out.write_section("categories", categories)
+        out.begin_array("images")
+        if previous is not None:
+            # Written by this function, so its images come before its annotations
+            for key, item in iter_coco(previous, only=('images', 'annotations')):
+                if key == 'annotations' and 'annotations' not in out.counts:
+                    write_new('images')
+                    out.begin_array("annotations")
+                elif key == 'images' and 'annotations' in out.counts:
+                    raise ValueError(f"{previous} has images after its annotations, merge without INCREMENTAL")
+                out.write_item(item)
+        if 'annotations' not in out.counts:
+            write_new('images')
+            out.begin_array("annotations")
+        write_new('annotations')
+    return out.counts
+
+
+def merge_datasets(incremental=INCREMENTAL, reuse=None, on_prepared=None):
+    """
+    Merges INPUT_DATASETS into OUTPUT_DIR. `reuse` maps input folders to the
+    (CocoIndex, image paths) load_dataset() already produced whose images are
+    already in OUTPUT_DIR/images; those aren't loaded or placed again (see
+    build_cache.py), in 'manifest' mode their rows are written again.
+    on_prepared(folder, index, image_paths) is called for every dataset that
+    was loaded, with the images that were placed, before its ids are changed.
+    """
+    reuse = reuse or {}
     output_path = Path(OUTPUT_DIR)
     output_images_dir = output_path / 'images'
     output_images_dir.mkdir(parents=True, exist_ok=True)
+    output_json = output_path / 'result.json'
+
+    # Initialize the Master JSON structure, or pick up the existing one
+    existing = None
+    info = {"description": "Merged Dataset B1-8", "merged_datasets": []}
+    licenses = []
+    categories = []
+    next_image_id = 1
+    next_ann_id = 1
 
-    # Initialize the Master JSON structure
-    master_coco = {
-        "images": [],
-        "annotations": [],
-        "categories": [],
-        "info": {"description": "Merged Dataset B1-8"},
-        "licenses": []
-    }
-
-    # Tracking Global IDs to prevent collisions
-    global_image_id = 1
-    global_ann_id = 1
-    
-    # Map Category Names to Global IDs to ensure consistency
-    # e.g. {"bottle": 1, "cap": 2}
-    category_name_to_id = {}
-    next_category_id = 0
-
-    print(f"Starting merge of {len(INPUT_DATASETS)} datasets into {OUTPUT_DIR}...")
-
-    for dataset_folder in INPUT_DATASETS:
-        dataset_path = Path(dataset_folder)
-        json_file = dataset_path / TARGET_JSON_NAME
-        
-        # Fallback to result.json if renamed version doesn't exist
-        if not json_file.exists():
-            json_file = dataset_path / 'result.json'
-            
-        if not json_file.exists():
+    if incremental and output_json.exists():
+        # Only the small sections and the highest ids, the images and annotations are streamed through below
+        sections, max_image_id, max_ann_id = read_merged_summary(output_json)
+        if 'merged_datasets' not in sections.get('info', {}):
+            print(f"{output_json} doesn't record which datasets it contains, rebuilding it.")
+        else:
+            existing = output_json
+            info = dict(sections['info'])
+            licenses = sections.get('licenses', [])
+            categories = list(sections.get('categories', []))
+            next_image_id = max_image_id + 1
+            next_ann_id = max_ann_id + 1
+            print(f"Incremental merge: {output_json} already has {info['merged_datasets']}")
+
+    pending = [d for d in INPUT_DATASETS if d not in info['merged_datasets']]
+    if not pending:
+        print("Nothing to merge, all datasets are already in the output.")
+        return
+
+    print(f"Starting merge of {len(pending)} datasets into {OUTPUT_DIR}...")
+
+    # 1. Parse and validate the inputs in parallel, they are independent
+    to_load = [d for d in pending if d not in reuse]
+    with ProcessPoolExecutor(max_workers=max(1, min(LOAD_WORKERS, len(to_load)))) as pool:
+        loaded = dict(zip(to_load, pool.map(load_dataset, to_load)))
+
+    # 2. Put the images in place (one parallel batch for all datasets)
+    materializer = Materializer(IMAGE_STRATEGY)
+    datasets = []
+    reused = []
+    for dataset_folder in pending:
+        if dataset_folder in reuse:
+            index, image_paths = reuse[dataset_folder]
+            print(f"Reusing {dataset_folder}: {index.num_images} images, {index.num_annotations} annotations")
+            reused.append((dataset_folder, index, image_paths))
+            continue
+
+        result = loaded[dataset_folder]
+        if result is None:
             print(f"Skipping {dataset_folder}: No JSON found.")
             continue
 
-        print(f"Processing {dataset_folder}...")
-
-        with open(json_file, 'r') as f:
-            data = json.load(f)
-
-        # 1. Map Categories for this specific dataset
-        # We need a local map because Dataset 1 might have "Bottle"=0 
-        # and Dataset 2 might have "Bottle"=5. We need to standardize.
-        local_cat_id_to_global = {}
-        
-        for cat in data.get('categories', []):
-            cat_name = cat['name']
-            
-            # If we haven't seen this category name before, add it to master
-            if cat_name not in category_name_to_id:
-                category_name_to_id[cat_name] = next_category_id
-                master_coco['categories'].append({
-                    "id": next_category_id,
-                    "name": cat_name
-                })
-                next_category_id += 1
-            
-            # Map the local ID to the global ID
-            global_id = category_name_to_id[cat_name]
-            local_cat_id_to_global[cat['id']] = global_id
-
-        # 2. Process Images
-        # Map local image IDs to new global IDs
-        local_img_id_to_global = {}
-
-        for img in data['images']:
-            # Setup Paths
-            filename = os.path.basename(img['file_name'])
-            src_image_path = dataset_path / 'images' / filename
-            dst_image_path = output_images_dir / filename
-
-            # Copy image file
-            if src_image_path.exists():
-                shutil.copy2(src_image_path, dst_image_path)
-            else:
-                print(f"  Warning: Image missing {src_image_path}")
-                continue
-
-            # Update Image Metadata
-            new_img = img.copy()
-            new_img['id'] = global_image_id
-            # Ensure path is standard relative path
-            new_img['file_name'] = f"images/{filename}" 
-            
-            master_coco['images'].append(new_img)
-            
-            # Map old ID to new ID
-            local_img_id_to_global[img['id']] = global_image_id
-            global_image_id += 1
-
-        # 3. Process Annotations
-        for ann in data['annotations']:
-            new_ann = ann.copy()
-            
-            # Update IDs
-            new_ann['id'] = global_ann_id
-            
-            # Link to the new Image ID
-            old_img_id = ann['image_id']
-            if old_img_id not in local_img_id_to_global:
-                # This happens if the image was missing and we skipped it
-                continue
-            new_ann['image_id'] = local_img_id_to_global[old_img_id]
-
-            # Link to the new Category ID
-            old_cat_id = ann['category_id']
-            new_ann['category_id'] = local_cat_id_to_global[old_cat_id]
-
-            master_coco['annotations'].append(new_ann)
-            global_ann_id += 1
-
-    # Save Master JSON
-    output_json = output_path / 'result.json'
-    with open(output_json, 'w') as f:
-        json.dump(master_coco, f, indent=2)
+        index, image_paths, warnings = result
+        print(f"Processing {dataset_folder}: {index.num_images} images, {index.num_annotations} annotations")
+        for warning in warnings:
+            print(f"  Warning: {warning}")
+        datasets.append((dataset_folder, index, image_paths))
+
+    datasets = materialize_datasets(datasets, output_images_dir, materializer)
+    if on_prepared is not None:
+        for dataset_folder, index, image_paths in datasets:
+            on_prepared(dataset_folder, index, image_paths)
+    datasets = sorted(datasets + reused, key=lambda dataset: pending.index(dataset[0]))
+
+    # 3. Assign global image/annotation/category ids in one cheap pass
+    merged = [index for _, index, _ in datasets]
+    assign_global_ids(merged, categories, next_image_id, next_ann_id)
+    info['merged_datasets'] = info['merged_datasets'] + [dataset_folder for dataset_folder, _, _ in datasets]
+
+    # 4. Save Master JSON (existing entries first, then the new datasets)
+    counts = write_merged_json(output_json, info, licenses, categories, merged, previous=existing)
+
+    if IMAGE_STRATEGY == 'manifest':
+        manifest_path = output_path / 'images_manifest.csv'
+        # Reused datasets weren't placed again, but the manifest is rewritten as a whole
+        materializer.manifest.extend((src, os.fspath(output_images_dir / os.path.basename(src)))
+                                     for _, _, image_paths in reused for src in image_paths)
+        if existing is not None and manifest_path.exists():
+            materializer.manifest[:0] = read_manifest(manifest_path)
+        materializer.write_manifest(manifest_path)
 
     print(f"--- Merge Complete ---")
-    print(f"Total Images: {len(master_coco['images'])}")
-    print(f"Total Annotations: {len(master_coco['annotations'])}")
-    print(f"Categories Found: {list(category_name_to_id.keys())}")
+    print(f"Images placed by: {dict(materializer.methods_used)}")
+    print(f"Total Images: {counts['images']}")
+    print(f"Total Annotations: {counts['annotations']}")
+    print(f"Categories Found: {[cat['name'] for cat in categories]}")
     print(f"Saved to: {output_json}")
 
 if __name__ == "__main__":
-    merge_datasets()
\ No newline at end of file
+    merge_datasets()
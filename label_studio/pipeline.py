@@ -0,0 +1,248 @@
+"""
+Runs export -> clean -> merge -> split in one process.
+
+download_dataset_coco.py, clean_coco_datasets.py, merge_datasets.py and
+split_coco.py each parse and rewrite the whole dataset as JSON. Here the
+stages pass the same in-memory CocoIndex objects along instead: every
+B*-COCO/result.json is parsed once and the merge only changes the indexes.
+The clean stage journals and renames like clean_coco_datasets.py and writes
+back the JSON (and clean state) of the datasets whose images it renamed;
+the other files written are the final ones (OUTPUT_DIR/result.json and the
+train/val split).
+
+The stages use the settings of their scripts (PROJECT_TO_BOTTLE, the clean
+prefixes, IMAGE_STRATEGY, split_ratio, group_by, ...). With CHECKPOINT_DIR set
+the datasets are saved as binary stores (coco_binary.py) after every stage,
+and `--resume_after clean` starts again from the clean checkpoint.
+"""
+import argparse
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+# Shared COCO helpers live in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import split_coco
+from coco_binary import CocoBinary, write_binary
+from coco_index import CocoIndex
+from coco_io import dump_json, load_json
+from materialize import Materializer
+
+# The other Label Studio scripts live next to this one
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import merge_datasets
+from clean_coco_datasets import (DATASETS_TO_PROCESS, RENAME_WORKERS, commit_dataset, file_fingerprint, plan_index,
+                                 rename_planned, report, write_journal)
+
+# --- CONFIGURATION ---
+STAGE_ORDER = ('export', 'clean', 'merge', 'split')
+STAGES = ['clean', 'merge', 'split']   # Add 'export' to pull fresh exports from Label Studio first
+
+# Final artifacts: the merged dataset goes to merge_datasets.OUTPUT_DIR,
+# the split to <OUTPUT_DIR>/<SPLIT_NAME>-train.json and -val.json
+WRITE_MERGED_JSON = True
+SPLIT_NAME = 'result'
+
+# Save every stage's datasets here (None: no checkpoints)
+CHECKPOINT_DIR = None                  # e.g. 'pipeline-checkpoints'
+# ---------------------
+
+
+@dataclass
+class Dataset:
+    """One dataset as it moves through the stages (after the merge there is only one)."""
+    folder: str
+    prefix: str
+    index: CocoIndex
+    json_name: str = 'result.json'   # The file in `folder` the index was loaded from
+
+
+def load_indexes(json_paths):
+    """Parses COCO files in parallel."""
+    with ProcessPoolExecutor(max_workers=max(1, min(merge_datasets.LOAD_WORKERS, len(json_paths)))) as pool:
+        return list(pool.map(CocoIndex.load, json_paths))
+
+
+def load_datasets():
+    """The input datasets in merge order (merge_datasets.INPUT_DATASETS), read from disk."""
+    folders, json_paths = [], []
+    for folder in merge_datasets.INPUT_DATASETS:
+        json_file = merge_datasets.find_dataset_json(Path(folder))
+        if json_file is None:
+            print(f"Skipping {folder}: No JSON found.")
+            continue
+        folders.append(folder)
+        json_paths.append(json_file)
+
+    print(f"Loading {len(folders)} datasets...")
+    return [Dataset(folder, DATASETS_TO_PROCESS.get(folder, folder.split('-')[0]), index, json_path.name)
+            for folder, json_path, index in zip(folders, json_paths, load_indexes(json_paths))]
+
+
+def run_export(datasets):
+    """Exports PROJECT_TO_BOTTLE and checks the images against the parsed result.json."""
+    # Needs label_studio_sdk, so only imported when exporting
+    from download_dataset_coco import PROJECT_TO_BOTTLE, check_images, export_projects
+
+    results = export_projects(PROJECT_TO_BOTTLE, check=False)
+    exported = sorted((bottle_id, results[project_id]['result_path'])
+                      for project_id, bottle_id in PROJECT_TO_BOTTLE.items()
+                      if results[project_id]['status'] == 'ok')
+
+    datasets = []
+    for (bottle_id, result_path), index in zip(exported, load_indexes([path for _, path in exported])):
+        folder = str(Path(result_path).parent)
+        check_images(index.images, Path(folder) / 'images', log=lambda message: print(f"[B{bottle_id}] {message}"))
+        datasets.append(Dataset(folder, f"B{bottle_id}", index, Path(result_path).name))
+    return datasets
+
+
+def run_clean(datasets):
+    """
+    Renames the images of all datasets (clean_coco_datasets.py), updates their
+    indexes and writes the JSON of every dataset that had renames back.
+    """
+    plans = []
+    for dataset in datasets:
+        plan = plan_index(dataset.folder, dataset.prefix, dataset.index)
+        plan['json'] = file_fingerprint(Path(dataset.folder) / dataset.json_name)
+        plans.append(plan)
+
+    # 1. Journal the plans before touching any file (clean_coco_datasets.py resumes from them)
+    for plan in plans:
+        if plan['renames']:
+            write_journal(plan)
+
+    # 2. Rename across all datasets at once, 3. commit each dataset as soon as its renames are done
+    with ThreadPoolExecutor(max_workers=RENAME_WORKERS) as pool:
+        futures = rename_planned(plans, pool)
+        for dataset, plan, dataset_futures in zip(datasets, plans, futures):
+            outcomes = [future.result() for future in dataset_futures]
+            if plan['renames']:
+                commit_dataset(plan, outcomes, dataset.json_name)
+            report(plan, outcomes)
+    return datasets
+
+
+def run_merge(datasets):
+    """Merges the datasets like merge_datasets.py (no incremental mode) into one."""
+    output_path = Path(merge_datasets.OUTPUT_DIR)
+    output_images_dir = output_path / 'images'
+    output_images_dir.mkdir(parents=True, exist_ok=True)
+
+    # Validation and the existence checks are stat calls, threads are enough
+    with ThreadPoolExecutor(max_workers=merge_datasets.LOAD_WORKERS) as pool:
+        prepared = list(pool.map(merge_datasets.prepare_dataset,
+                                 [dataset.folder for dataset in datasets], [dataset.index for dataset in datasets]))
+
+    merged = []
+    for dataset, (index, image_paths, warnings) in zip(datasets, prepared):
+        print(f"Processing {dataset.folder}: {index.num_images} images, {index.num_annotations} annotations")
+        for warning in warnings:
+            print(f"  Warning: {warning}")
+        merged.append((dataset.folder, index, image_paths))
+
+    materializer = Materializer(merge_datasets.IMAGE_STRATEGY)
+    merged = merge_datasets.materialize_datasets(merged, output_images_dir, materializer)
+
+    categories = []
+    indexes = [index for _, index, _ in merged]
+    merge_datasets.assign_global_ids(indexes, categories, 1, 1)
+    info = {"description": "Merged Dataset B1-8", "merged_datasets": [folder for folder, _, _ in merged]}
+    index = CocoIndex.concat(indexes, {"info": info, "licenses": [], "categories": categories})
+
+    if WRITE_MERGED_JSON:
+        output_json = output_path / 'result.json'
+        merge_datasets.write_merged_json(output_json, info, [], categories, [index])
+        print(f"Saved to: {output_json}")
+    if merge_datasets.IMAGE_STRATEGY == 'manifest':
+        materializer.write_manifest(output_path / 'images_manifest.csv')
+
+    print(f"Images placed by: {dict(materializer.methods_used)}")
+    print(f"Total Images: {index.num_images}")
+    print(f"Total Annotations: {index.num_annotations}")
+    print(f"Categories Found: {[cat['name'] for cat in categories]}")
+    return [Dataset(str(output_path), None, index)]
+
+
+def run_split(datasets):
+    """Splits the merged dataset with split_coco.py's settings."""
+    (dataset,) = datasets
+    output_path = Path(dataset.folder)
+    split_coco.split_index(dataset.index, str(output_path / 'images'),
+                           str(output_path / f"{SPLIT_NAME}-train.json"), str(output_path / f"{SPLIT_NAME}-val.json"))
+    return datasets
+
+
+STAGE_FUNCTIONS = {'export': run_export, 'clean': run_clean, 'merge': run_merge, 'split': run_split}
+
+
+def save_checkpoint(checkpoint_dir, stage, datasets):
+    stage_dir = Path(checkpoint_dir) / stage
+    stage_dir.mkdir(parents=True, exist_ok=True)
+    entries = []
+    for dataset in datasets:
+        store = write_binary(dataset.index, stage_dir / f"{Path(dataset.folder).name}.cocobin")
+        entries.append({'folder': dataset.folder, 'prefix': dataset.prefix, 'json_name': dataset.json_name,
+                        'store': str(store)})
+    dump_json({'stage': stage, 'datasets': entries}, stage_dir / 'datasets.json')
+
+
+def load_checkpoint(checkpoint_dir, stage):
+    state_path = Path(checkpoint_dir) / stage / 'datasets.json'
+    if not state_path.exists():
+        raise FileNotFoundError(f"No checkpoint after '{stage}' in {checkpoint_dir}")
+    return [Dataset(entry['folder'], entry['prefix'], CocoBinary(entry['store']).to_index(), entry['json_name'])
+            for entry in load_json(state_path)['datasets']]
+
+
+def run_pipeline(stages=STAGES, resume_after=None, checkpoint_dir=CHECKPOINT_DIR):
+    """Runs the given stages (always in STAGE_ORDER). Returns {step: seconds}."""
+    stages = [stage for stage in STAGE_ORDER if stage in stages]
+    timings = {}
+    start = time.monotonic()
+
+    # 1. Get the input of the first stage
+    if resume_after is not None:
+        print(f"Resuming from the checkpoint after '{resume_after}'")
+        datasets = load_checkpoint(checkpoint_dir, resume_after)
+        stages = [stage for stage in stages if STAGE_ORDER.index(stage) > STAGE_ORDER.index(resume_after)]
+    elif stages and stages[0] == 'export':
+        datasets = None
+    elif stages and stages[0] == 'split':
+        output_json = Path(merge_datasets.OUTPUT_DIR) / 'result.json'
+        print(f"Loading {output_json}...")
+        datasets = [Dataset(merge_datasets.OUTPUT_DIR, None, CocoIndex.load(output_json))]
+    else:
+        datasets = load_datasets()
+    timings['load'] = time.monotonic() - start
+
+    # 2. Run the stages over the same dataset objects
+    for stage in stages:
+        print(f"\n============ {stage} ============")
+        stage_start = time.monotonic()
+        datasets = STAGE_FUNCTIONS[stage](datasets)
+        if checkpoint_dir is not None:
+            save_checkpoint(checkpoint_dir, stage, datasets)
+        timings[stage] = time.monotonic() - stage_start
+
+    print(f"\n============ Pipeline summary ({time.monotonic() - start:.1f}s) ============")
+    for step, seconds in timings.items():
+        print(f"  {step}: {seconds:.1f}s")
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run export -> clean -> merge -> split without intermediate JSON files.")
+    parser.add_argument('--stages', nargs='+', choices=STAGE_ORDER, default=STAGES,
+                        help="Stages to run (default: STAGES)")
+    parser.add_argument('--resume_after', choices=STAGE_ORDER,
+                        help="Start from the checkpoint written after this stage")
+    parser.add_argument('--checkpoint_dir', default=CHECKPOINT_DIR,
+                        help="Save every stage's datasets as binary stores here")
+    args = parser.parse_args()
+    if args.resume_after and not args.checkpoint_dir:
+        parser.error("--resume_after needs --checkpoint_dir (or CHECKPOINT_DIR)")
+    run_pipeline(args.stages, args.resume_after, args.checkpoint_dir)
@@ -0,0 +1,175 @@
+"""
+Copies annotations from several source tasks to chosen subsets of a Label
+Studio JSON export, streamed (never loaded whole).
+
+Each rule names a source task and which tasks receive its annotations, by
+any combination of (all given criteria must match):
+    pattern   glob on the image file name, e.g. "B2-*_25112025.jpg"
+    bottles   bottle prefixes, e.g. ["B1", "B3"]
+    sequence  inclusive range of the image number, e.g. (0, 499) for
+              B1-00000_... to B1-00499_...
+The first matching rule wins. Source tasks are never overwritten.
+
+The export is read with an iterative parser (no json.load), twice: the first
+pass picks up the source tasks' annotations and the highest annotation id,
+the second streams every task to the output in its original order, with the
+source annotations pre-encoded once (see copy_annotations). Propagated
+annotations get ids above the export's own, like copy_annotations.py.
+"""
+import fnmatch
+import os
+import re
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import ijson
+
+# Shared JSON helpers live in the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from coco_io import dumps, load_json, open_atomic, open_binary
+
+from copy_annotations import encode_annotation_templates, encode_annotations
+
+# --- CONFIGURATION ---
+INPUT_FILENAME = 'B1_JSON_export.json'
+OUTPUT_FILENAME = 'B1_JSON_export-propagated.json'
+
+RULES = [
+    {"source_id": 1100, "bottles": ["B1"], "sequence": (0, 499)},
+    {"source_id": 1600, "bottles": ["B1"], "sequence": (500, 999)},
+    {"source_id": 2100, "pattern": "B2-*_25112025.jpg"},
+]
+
+OVERWRITE_EXISTING = True       # False: tasks that already have annotations are left alone
+STREAM = True                   # False: json.load the export (faster for small files)
+# ---------------------
+
+# Label Studio prefixes uploaded files with 8 hex characters, e.g. "1a2b3c4d-B1-00000_25112025.jpg"
+UPLOAD_PREFIX = re.compile(r'^[0-9a-f]{8}-')
+# "B1-00000_25112025.jpg" -> bottle 1, sequence 0 (the bottle prefix is optional)
+IMAGE_NAME = re.compile(r'(?:B(?P<bottle>\d+)-)?(?P<sequence>\d+)_(?P<date>\d{8})')
+
+
+def task_image_name(task):
+    """The task's image file name without Label Studio's upload prefix."""
+    data = task.get('data', {})
+    url = data.get('image') or data.get('url') or ''
+    return UPLOAD_PREFIX.sub('', os.path.basename(url.split('?')[0]))
+
+
+def rule_matches(rule, name):
+    """True if the image file name satisfies every criterion of the rule."""
+    if 'pattern' in rule and not fnmatch.fnmatch(name, rule['pattern']):
+        return False
+
+    if 'bottles' in rule or 'sequence' in rule:
+        match = IMAGE_NAME.search(name)
+        if match is None:
+            return False
+        if 'bottles' in rule:
+            bottles = {str(b).upper().lstrip('B') for b in rule['bottles']}
+            if match['bottle'] not in bottles:
+                return False
+        if 'sequence' in rule:
+            low, high = rule['sequence']
+            if not low <= int(match['sequence']) <= high:
+                return False
+    return True
+
+
+def match_rule(rules, name):
+    """Index of the first rule matching the file name, or None."""
+    for i, rule in enumerate(rules):
+        if rule_matches(rule, name):
+            return i
+    return None
+
+
+def iter_tasks(input_file, stream=STREAM):
+    """Tasks of a Label Studio JSON export, parsed incrementally if `stream`."""
+    if not stream:
+        yield from load_json(input_file)
+        return
+    with open_binary(input_file, 'rb') as f:
+        yield from ijson.items(f, 'item', use_float=True)
+
+
+def _task_head(task):
+    """The task encoded without annotations and without its closing brace."""
+    head = dumps({key: value for key, value in task.items() if key != 'annotations'})[:-1]
+    return head + (b',' if len(head) > 1 else b'')
+
+
+def collect_sources(tasks, rules):
+    """
+    First pass: {rule index: pre-encoded source annotations} for every rule
+    whose source task is in `tasks` (several rules may share a source), and
+    the highest annotation id in the export.
+    """
+    rules_by_source = {}
+    for i, rule in enumerate(rules):
+        rules_by_source.setdefault(rule['source_id'], []).append(i)
+
+    templates = {}
+    max_id = 0
+    for task in tasks:
+        annotations = task.get('annotations', [])
+        max_id = max(max_id, max((ann.get('id') or 0 for ann in annotations), default=0))
+        if task.get('id') in rules_by_source:
+            encoded = encode_annotation_templates(annotations)
+            for i in rules_by_source[task['id']]:
+                templates[i] = encoded
+    return templates, max_id
+
+
+def propagate(input_file, output_file, rules=RULES, overwrite=OVERWRITE_EXISTING, stream=STREAM):
+    """Applies the rules in two passes over input_file. Returns {rule index: tasks updated}."""
+    if stream:
+        def tasks():
+            return iter_tasks(input_file, stream=True)
+    else:
+        loaded = load_json(input_file)
+
+        def tasks():
+            return iter(loaded)
+
+    # 1. Source annotations and the first free annotation id
+    templates, max_id = collect_sources(tasks(), rules)
+    source_ids = {rule['source_id'] for rule in rules}
+    counts = {i: 0 for i in range(len(rules))}
+    next_id = max_id + 1
+    timestamp = dumps(datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'))
+
+    # 2. Every task in its original position, targets with the copied annotations
+    with open_atomic(output_file) as out:
+        out.write(b'[')
+        first = True
+        for task in tasks():
+            data = dumps(task)
+            if task.get('id') not in source_ids:
+                rule = match_rule(rules, task_image_name(task))
+                if rule in templates and (overwrite or not task.get('annotations')):
+                    annotations, next_id = encode_annotations(templates[rule], task.get('id'), next_id, timestamp)
+                    data = _task_head(task) + b'"annotations":' + annotations + b'}'
+                    counts[rule] += 1
+            out.write((b'\n' if first else b',\n') + data)
+            first = False
+        out.write(b'\n]\n')
+
+    for i, rule in enumerate(rules):
+        if i not in templates:
+            print(f"Warning: source task {rule['source_id']} was not found, its targets were left unchanged.")
+    return counts
+
+
+if __name__ == "__main__":
+    if not os.path.exists(INPUT_FILENAME):
+        print(f"Error: The file '{INPUT_FILENAME}' was not found.")
+        sys.exit(1)
+
+    counts = propagate(INPUT_FILENAME, OUTPUT_FILENAME)
+    for i, rule in enumerate(RULES):
+        criteria = {key: value for key, value in rule.items() if key != 'source_id'}
+        print(f"Source {rule['source_id']} {criteria}: copied to {counts[i]} tasks")
+    print(f"Saved to: {OUTPUT_FILENAME}")
@@ -0,0 +1,201 @@
+import csv
+import errno
+import os
+import shutil
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl request number for FICLONE (linux/fs.h): share the source's extents
+FICLONE = 0x40049409
+
+# Ways of putting a source file at a destination path, and what each strategy
+# falls back to when the filesystem can't do it:
+#   reflink          copy-on-write clone (btrfs, XFS, ZFS block cloning)
+#   copy_file_range  in-kernel copy, no round trip through user space (and may
+#                    clone or copy server-side on filesystems that support it)
+#   hardlink         second directory entry for the same inode (same filesystem only)
+#   symlink          absolute symbolic link to the source
+#   copy             plain shutil.copy2
+#   manifest         write nothing, only record (src, dst) in a manifest
+# 'link' takes whichever zero-copy method works, safest first: writes to a
+# reflinked file never reach the source, writes to a hardlinked one do.
+STRATEGIES = {
+    'copy': ('copy_file_range', 'copy'),
+    'link': ('reflink', 'hardlink', 'copy'),
+    'reflink': ('reflink', 'copy_file_range', 'copy'),
+    'hardlink': ('hardlink', 'reflink', 'copy_file_range', 'copy'),
+    'symlink': ('symlink', 'copy'),
+    'manifest': ('manifest',),
+}
+
+# Errors that mean "this filesystem can't do that", as opposed to a real I/O error
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EPERM, errno.EINVAL,
+                      errno.ENOSYS, errno.ENOTTY, errno.EMLINK}
+
+
+def reflink(src, dst):
+    """
+    Makes dst a copy-on-write clone of src (btrfs, XFS, ZFS block cloning).
+    Raises OSError if the filesystem can't clone.
+    """
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflink is not supported on this platform")
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+
+
+def kernel_copy(src, dst):
+    """
+    Copies src to dst with os.copy_file_range, keeping the data in the kernel.
+    Filesystems that copy nothing instead of failing get the rest copied in
+    user space.
+    """
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        remaining = os.fstat(s.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(s.fileno(), d.fileno(), remaining)
+                if copied == 0:
+                    # Both file positions are where the kernel stopped
+                    shutil.copyfileobj(s, d)
+                    break
+                remaining -= copied
+        except OSError:
+            d.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _apply(method, src, dst):
+    if method == 'reflink':
+        reflink(src, dst)
+    elif method == 'copy_file_range':
+        kernel_copy(src, dst)
+    elif method == 'hardlink':
+        os.link(src, dst)
+    elif method == 'symlink':
+        os.symlink(os.path.abspath(src), dst)
+    elif method == 'copy':
+        shutil.copy2(src, dst)
+    else:
+        raise ValueError(f"Unknown method: {method}")
+
+
+class Materializer:
+    """
+    Puts source files at destination paths using a strategy from STRATEGIES,
+    falling back down the strategy's chain when the filesystem refuses.
+
+    Once a method fails as unsupported between two devices it isn't tried
+    again for that pair, so e.g. a pool without reflink support only pays for
+    one failed ioctl. Files appear at their destination atomically (written to
+    a temp name, then renamed). In 'manifest' mode nothing is written and the
+    pairs are collected in `manifest` instead.
+    """
+
+    def __init__(self, strategy='copy'):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy '{strategy}', choose from {sorted(STRATEGIES)}")
+        self.strategy = strategy
+        self.methods_used = Counter()
+        self.manifest = []
+        self._unsupported = set()   # (method, src_dev, dst_dev)
+        self._lock = threading.Lock()
+
+    def materialize(self, src, dst):
+        """Puts src at dst and returns the method that was used."""
+        src = os.fspath(src)
+        dst = os.fspath(dst)
+        chain = STRATEGIES[self.strategy]
+
+        if chain == ('manifest',):
+            with self._lock:
+                self.manifest.append((src, dst))
+                self.methods_used['manifest'] += 1
+            return 'manifest'
+
+        devices = (os.stat(src).st_dev, os.stat(os.path.dirname(dst) or '.').st_dev)
+        # Unique per call: other threads or processes may be placing the same dst
+        tmp = f"{dst}.{uuid.uuid4().hex[:12]}.tmp"
+        for method in chain:
+            if (method, *devices) in self._unsupported:
+                continue
+            try:
+                if os.path.lexists(tmp):
+                    os.remove(tmp)
+                _apply(method, src, tmp)
+                os.replace(tmp, dst)
+            except OSError as e:
+                if method == chain[-1] or e.errno not in UNSUPPORTED_ERRNOS:
+                    if os.path.lexists(tmp):
+                        os.remove(tmp)
+                    raise
+                with self._lock:
+                    self._unsupported.add((method, *devices))
+                continue
+            with self._lock:
+                self.methods_used[method] += 1
+            return method
+
+    def materialize_many(self, pairs, workers=8):
+        """
+        Materializes many (src, dst) pairs on a thread pool. Copies and links
+        spend their time in the kernel, so threads overlap the I/O well.
+        Returns {src: error message} for the pairs that failed.
+        """
+        failed = {}
+
+        def run(pair):
+            src, dst = pair
+            try:
+                self.materialize(src, dst)
+            except OSError as e:
+                with self._lock:
+                    failed[os.fspath(src)] = str(e)
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(run, pairs))
+        return failed
+
+    def write_manifest(self, path):
+        """Writes the collected manifest as 'destination,source' CSV lines."""
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(("destination", "source"))
+            writer.writerows((dst, src) for src, dst in self.manifest)
+
+
+def read_manifest(path):
+    """The (source, destination) pairs of a manifest written by Materializer.write_manifest()."""
+    with open(path, newline='') as f:
+        rows = csv.reader(f)
+        next(rows, None)
+        return [(src, dst) for dst, src in rows]
+
+
+def link_or_copy(src, dst):
+    """
+    Puts the contents of src at dst without duplicating data where possible:
+    reflink first (safe, later writes to dst don't touch src), then hardlink,
+    then a plain copy. Returns the method that worked.
+    """
+    return _LINKER.materialize(src, dst)
+
+
+# Shared so methods found unsupported are remembered across calls
+_LINKER = Materializer('link')
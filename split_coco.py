@@ -1,12 +1,22 @@
-import json
-import random
+import dataclasses
 import os
 from pathlib import Path
 
+import numpy as np
+
+from coco_binary import binary_path, coco_to_binary, write_binary
+from coco_index import CocoIndex
+from coco_io import dump_json
+from coco_stream import iter_coco, CocoStreamWriter
+from image_index import decoded_size, scan_directory
+from materialize import read_manifest
+from splitting import (DuplicateGroups, assign_image_splits, assign_splits_by_counts, image_label_counts,
+                       print_summary, write_coco_folds)
+
 # --- Configuration ---
 
 # 1. Set the path to the directory containing your annotations
-data_root = "/root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO-2800K-tiled" 
+data_root = "/root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO-2800K-tiled"
 
 # 2. Set the name of your single, combined COCO file
 original_json_name = "annotations_2800K_640_02.json" # This is the default from Label Studio
@@ -21,6 +31,30 @@ split_ratio = 0.8
 # 5. Set the images directory relative to data_root
 images_dir_name = "annotations_2800K_images_640_02"
 
+# 6. Stream the annotation file instead of loading it whole.
+#    Peak memory then depends on the number of images, not annotations,
+#    which is what you want for the big tiled exports.
+streaming = True
+
+# 7. Keep related images in the same split and balance the categories (see splitting.py).
+#    'source_image' keeps all tiles cut from one image together, 'bottle' keeps whole
+#    bottles (B1-..., B8-...) together, 'image' lets tiles of one image be split up.
+#    The split is deterministic: the same inputs and seed always give the same files.
+group_by = 'source_image'
+split_method = 'stratified'  # 'hash': a group keeps its split when images are added later
+split_seed = 0
+# Also keep near-duplicate images together: the output of `python dedup_images.py find` (None: off)
+duplicates_json = None
+
+# 8. K-fold cross-validation: set to e.g. 5 to write <name>-fold<i>-train.json and
+#    <name>-fold<i>-val.json for every fold instead of one train/val split. All folds
+#    are computed in one pass and point at the same images directory (nothing is copied).
+k_folds = None
+
+# 9. Also write each split as a memory-mapped binary store (<name>-train.cocobin/ and
+#    <name>-val.cocobin/, see coco_binary.py) for dataloaders to open without parsing JSON.
+export_binary = False
+
 # --- End Configuration ---
 
 # Construct full paths
@@ -29,140 +63,337 @@ train_json_path = os.path.join(data_root, train_json_name)
 val_json_path = os.path.join(data_root, val_json_name)
 images_dir = os.path.join(data_root, images_dir_name)
 
-print(f"Loading original annotations from: {original_json_path}")
 
-# Load the original COCO JSON
-with open(original_json_path, 'r') as f:
-    coco_data = json.load(f)
+def manifest_image_infos(manifest_path):
+    """
+    {file name: (source path, ImageInfo)} of the images an 'images_manifest.csv'
+    (merge with IMAGE_STRATEGY = 'manifest') lists, read from their source directories.
+    """
+    sources = {}
+    for src, dst in read_manifest(manifest_path):
+        sources.setdefault(os.path.dirname(src), {})[os.path.basename(src)] = os.path.basename(dst)
+
+    infos = {}
+    for directory, names in sources.items():
+        scanned = scan_directory(directory) if os.path.isdir(directory) else {}
+        infos.update((dst_name, (os.path.join(directory, src_name), scanned[src_name]))
+                     for src_name, dst_name in names.items() if src_name in scanned)
+    return infos
+
+
+def list_image_files(images_dir):
+    """
+    Returns {file name: ImageInfo} for the readable images in the images
+    directory. Comes from the directory's header index (see image_index.py),
+    so unchanged directories aren't listed again. Files whose header looks
+    truncated or corrupt are decoded, and only count as missing if that fails.
+    If a merge left an images_manifest.csv next to the directory instead of
+    placing the images, they are read from there.
+    """
+    print(f"Checking images directory: {images_dir}")
+    manifest_path = os.path.join(os.path.dirname(os.path.normpath(images_dir)), 'images_manifest.csv')
+    has_manifest = os.path.exists(manifest_path)
+    if not os.path.exists(images_dir) and not has_manifest:
+        print(f"WARNING: Images directory not found: {images_dir}")
+        return {}
 
-# Get list of actual images in the directory
-print(f"Checking images directory: {images_dir}")
-if os.path.exists(images_dir):
-    actual_image_files = set(os.listdir(images_dir))
+    infos = scan_directory(images_dir) if os.path.exists(images_dir) else {}
+    located = {name: (os.path.join(images_dir, name), info) for name, info in infos.items()}
+    if has_manifest:
+        print(f"Images not in the directory are read through {manifest_path}")
+        located = {**manifest_image_infos(manifest_path), **located}
+
+    # The end marker check is a heuristic: decode the suspects before dropping them
+    actual_image_files = {}
+    for name, (path, info) in located.items():
+        if not info.ok:
+            size = decoded_size(path)
+            if size is None:
+                continue
+            info = dataclasses.replace(info, width=info.width or size[0], height=info.height or size[1])
+        actual_image_files[name] = info
     print(f"Found {len(actual_image_files)} image files in directory")
-else:
-    print(f"WARNING: Images directory not found: {images_dir}")
-    actual_image_files = set()
-
-# Create a mapping of image_id to annotation count
-print("Checking annotations...")
-image_annotation_count = {}
-for ann in coco_data['annotations']:
-    image_id = ann['image_id']
-    image_annotation_count[image_id] = image_annotation_count.get(image_id, 0) + 1
-
-# Fix image paths and filter out missing images and images without annotations
-print("Fixing image paths and filtering images...")
-valid_images = []
-missing_images = []
-unannotated_images = []
-
-for img in coco_data['images']:
-    old_path = img['file_name']
-    # Extract just the filename from the Label Studio path
-    filename = Path(old_path).name
-    image_id = img['id']
-    
-    # Check if the image has annotations
-    if image_id not in image_annotation_count or image_annotation_count[image_id] == 0:
-        unannotated_images.append(filename)
-        print(f"  Skipping unannotated image: {filename} (id: {image_id})")
-        continue
-    
-    # Check if the image actually exists
-    if filename in actual_image_files:
-        # Update to just the filename (relative to images_dir)
-        img['file_name'] = filename
-        valid_images.append(img)
+    if len(actual_image_files) < len(located):
+        print(f"WARNING: {len(located) - len(actual_image_files)} image files are truncated or unreadable, "
+              f"run `python image_index.py {images_dir}` to list them")
+    return actual_image_files
+
+
+def filter_images(images, image_annotation_count, actual_image_files):
+    """
+    Fixes image paths and drops images that are missing on disk or have no
+    annotations. Returns the list of valid image entries.
+    """
+    print("Fixing image paths and filtering images...")
+    valid_images = []
+    missing_images = []
+    unannotated_images = []
+
+    for img in images:
+        old_path = img['file_name']
+        # Extract just the filename from the Label Studio path
+        filename = Path(old_path).name
+        image_id = img['id']
+
+        # Check if the image has annotations
+        if image_id not in image_annotation_count or image_annotation_count[image_id] == 0:
+            unannotated_images.append(filename)
+            print(f"  Skipping unannotated image: {filename} (id: {image_id})")
+            continue
+
+        # Check if the image actually exists
+        if filename in actual_image_files:
+            # Update to just the filename (relative to images_dir)
+            img['file_name'] = filename
+            if not img.get('width') or not img.get('height'):
+                img['width'] = actual_image_files[filename].width
+                img['height'] = actual_image_files[filename].height
+            valid_images.append(img)
+        else:
+            missing_images.append(filename)
+            print(f"  Skipping missing image: {filename}")
+
+    print(f"\nFiltering summary:")
+    print(f"  Total images in original JSON: {len(images)}")
+    print(f"  Images without annotations: {len(unannotated_images)}")
+    print(f"  Missing image files: {len(missing_images)}")
+    print(f"  Valid images (with annotations): {len(valid_images)}")
+
+    if len(valid_images) == 0:
+        print("\nERROR: No valid images found! Check your dataset.")
+        exit(1)
+
+    return valid_images
+
+
+def split_groups():
+    """The group_by for splitting.py, with duplicates_json if it is set."""
+    return DuplicateGroups(duplicates_json, group_by) if duplicates_json else group_by
+
+
+def split_images(valid_images, image_counts):
+    """
+    Splits the valid images at split_ratio, keeping groups together and
+    stratifying by their per-category annotation counts (an images x
+    categories matrix, see splitting.py).
+    """
+    assignment = assign_splits_by_counts([img['file_name'] for img in valid_images], image_counts,
+                                         ratios=(split_ratio, 1 - split_ratio), group_by=split_groups(),
+                                         method=split_method, seed=split_seed)
+
+    train_images = [img for img, split in zip(valid_images, assignment.tolist()) if split == 0]
+    val_images = [img for img, split in zip(valid_images, assignment.tolist()) if split == 1]
+
+    print(f"\nDataset split (by {split_groups()}, {split_method}, seed {split_seed}):")
+    print(f"  Total valid images: {len(valid_images)}")
+    print(f"  Training images: {len(train_images)}")
+    print(f"  Validation images: {len(val_images)}")
+
+    return train_images, val_images
+
+
+def split_in_memory():
+    print(f"Loading original annotations from: {original_json_path}")
+
+    # Load the original COCO JSON into a columnar index
+    index = CocoIndex.load(original_json_path)
+    split_index(index, images_dir, train_json_path, val_json_path)
+
+
+def split_index(index, images_dir, train_json_path, val_json_path):
+    """
+    Splits an already loaded CocoIndex and writes the train/val files (the
+    body of split_in_memory(), also used by label_studio/pipeline.py).
+    """
+    # Get list of actual images in the directory
+    actual_image_files = list_image_files(images_dir)
+
+    # Create a mapping of image_id to annotation count
+    print("Checking annotations...")
+    image_annotation_count = dict(zip(index.image_ids.tolist(), index.annotation_counts().tolist()))
+
+    valid_images = filter_images(index.images, image_annotation_count, actual_image_files)
+    train_images, val_images = split_images(
+        valid_images, image_label_counts(valid_images, index.ann_image_ids, index.ann_category_ids))
+
+    # Select each split's images and their annotations
+    print("\nSplitting annotations...")
+    train = index.subset_ids(img['id'] for img in train_images)
+    val = index.subset_ids(img['id'] for img in val_images)
+
+    print(f"  Training annotations: {train.num_annotations}")
+    print(f"  Validation annotations: {val.num_annotations}")
+
+    # Verify all images have annotations
+    train_img_with_ann = int(np.count_nonzero(train.annotation_counts()))
+    val_img_with_ann = int(np.count_nonzero(val.annotation_counts()))
+    print(f"\nVerification:")
+    print(f"  Train images with annotations: {train_img_with_ann}/{train.num_images}")
+    print(f"  Val images with annotations: {val_img_with_ann}/{val.num_images}")
+
+    if train_img_with_ann != train.num_images:
+        print("  WARNING: Some train images don't have annotations!")
+    if val_img_with_ann != val.num_images:
+        print("  WARNING: Some val images don't have annotations!")
+
+    # Create the new COCO JSON structures
+    train_coco = {
+        "info": index.sections.get("info", {}),
+        "licenses": index.sections.get("licenses", []),
+        "categories": index.categories,
+        "images": train.images,
+        "annotations": list(train.iter_annotations())
+    }
+
+    val_coco = {
+        "info": index.sections.get("info", {}),
+        "licenses": index.sections.get("licenses", []),
+        "categories": index.categories,
+        "images": val.images,
+        "annotations": list(val.iter_annotations())
+    }
+
+    # Save the new JSON files
+    print(f"\nSaving training annotations to: {train_json_path}")
+    dump_json(train_coco, train_json_path)
+
+    print(f"Saving validation annotations to: {val_json_path}")
+    dump_json(val_coco, val_json_path)
+
+    if export_binary:
+        train_store = write_binary(CocoIndex.from_coco(train_coco), binary_path(train_json_path))
+        val_store = write_binary(CocoIndex.from_coco(val_coco), binary_path(val_json_path))
+        print(f"Saving binary stores to: {train_store}, {val_store}")
+
+    print("\n✓ Split complete!")
+    print(f"\nFinal dataset:")
+    print(f"  Train: {train.num_images} images, {train.num_annotations} annotations")
+    print(f"  Val: {val.num_images} images, {val.num_annotations} annotations")
+    print(f"  Categories: {len(index.categories)}")
+
+
+def split_streaming():
+    """
+    Same split as split_in_memory(), but the annotation file is read twice with
+    an iterative parser instead of being loaded. Only the image entries and a
+    per-image histogram of annotation categories are held in memory;
+    annotations are written to the train/val files as they are read.
+    """
+    print(f"Streaming original annotations from: {original_json_path}")
+
+    # Pass 1: small sections, image entries and per-image category counts
+    print("Checking annotations...")
+    sections = {}
+    all_images = []
+    image_categories = {}   # image id -> {category id: annotations}
+    for key, value in iter_coco(original_json_path):
+        if key == 'images':
+            all_images.append(value)
+        elif key == 'annotations':
+            counts = image_categories.setdefault(value['image_id'], {})
+            counts[value['category_id']] = counts.get(value['category_id'], 0) + 1
+        else:
+            sections[key] = value
+
+    actual_image_files = list_image_files(images_dir)
+    image_annotation_count = {image_id: sum(counts.values()) for image_id, counts in image_categories.items()}
+    valid_images = filter_images(all_images, image_annotation_count, actual_image_files)
+    del all_images, image_annotation_count
+
+    # Columns: every category any annotation uses, in id order (as for the in-memory split)
+    columns = {cat: i for i, cat in enumerate(sorted({cat for counts in image_categories.values() for cat in counts}))}
+    image_counts = np.zeros((len(valid_images), len(columns)), dtype=np.int64)
+    for row, img in enumerate(valid_images):
+        for cat, count in image_categories[img['id']].items():
+            image_counts[row, columns[cat]] = count
+    del image_categories
+    train_images, val_images = split_images(valid_images, image_counts)
+
+    # Per image id decision: True = train, False = val
+    is_train = {img['id']: True for img in train_images}
+    is_train.update({img['id']: False for img in val_images})
+
+    print(f"\nSaving training annotations to: {train_json_path}")
+    print(f"Saving validation annotations to: {val_json_path}")
+
+    with CocoStreamWriter(train_json_path) as train_out, \
+            CocoStreamWriter(val_json_path) as val_out:
+        for out, entries in ((train_out, train_images), (val_out, val_images)):
+            out.write_section("info", sections.get("info", {}))
+            out.write_section("licenses", sections.get("licenses", []))
+            out.write_section("categories", sections['categories'])
+            out.begin_array("images")
+            for img in entries:
+                out.write_item(img)
+            out.begin_array("annotations")
+
+        # Pass 2: route every annotation to its image's split
+        print("\nSplitting annotations...")
+        for _, ann in iter_coco(original_json_path, only=('annotations',)):
+            split = is_train.get(ann['image_id'])
+            if split is True:
+                train_out.write_item(ann)
+            elif split is False:
+                val_out.write_item(ann)
+
+    if export_binary:
+        print(f"Saving binary stores to: {coco_to_binary(train_json_path)}, {coco_to_binary(val_json_path)}")
+
+    train_annotations = train_out.counts["annotations"]
+    val_annotations = val_out.counts["annotations"]
+    print(f"  Training annotations: {train_annotations}")
+    print(f"  Validation annotations: {val_annotations}")
+
+    print("\n✓ Split complete!")
+    print(f"\nFinal dataset:")
+    print(f"  Train: {len(train_images)} images, {train_annotations} annotations")
+    print(f"  Val: {len(val_images)} images, {val_annotations} annotations")
+    print(f"  Categories: {len(sections['categories'])}")
+
+
+def split_kfold(k):
+    """
+    Writes k cross-validation folds of the valid images (see k_folds). Each
+    fold's val file holds one fold, its train file the other k - 1.
+    """
+    print(f"Loading original annotations from: {original_json_path}")
+    index = CocoIndex.load(original_json_path)
+    actual_image_files = list_image_files(images_dir)
+
+    print("Checking annotations...")
+    image_annotation_count = dict(zip(index.image_ids.tolist(), index.annotation_counts().tolist()))
+    valid_images = filter_images(index.images, image_annotation_count, actual_image_files)
+    valid = index.subset_ids(img['id'] for img in valid_images)
+
+    folds = assign_image_splits(valid.images, valid.ann_image_ids, valid.ann_category_ids,
+                                ratios=np.ones(k), group_by=split_groups(), method=split_method, seed=split_seed)
+    print(f"\n{k} folds (by {split_groups()}, {split_method}, seed {split_seed}):")
+    print_summary(folds, valid.ann_image_rows, valid.ann_category_ids, [f"fold{i}" for i in range(k)])
+
+    print()
+    write_coco_folds(valid, folds, k, data_root, original_json_name[:-5])
+    print("\n✓ Split complete!")
+
+
+def output_paths():
+    """The files a run with the current configuration writes."""
+    if k_folds:
+        stem = os.path.join(data_root, original_json_name[:-5])
+        return [f"{stem}-fold{i}-{part}.json" for i in range(k_folds) for part in ('train', 'val')]
+    paths = [train_json_path, val_json_path]
+    if export_binary:
+        paths += [os.path.join(binary_path(path), 'meta.json') for path in paths]
+    return paths
+
+
+def split_dataset():
+    if k_folds:
+        split_kfold(k_folds)
+    elif streaming:
+        split_streaming()
     else:
-        missing_images.append(filename)
-        print(f"  Skipping missing image: {filename}")
-
-print(f"\nFiltering summary:")
-print(f"  Total images in original JSON: {len(coco_data['images'])}")
-print(f"  Images without annotations: {len(unannotated_images)}")
-print(f"  Missing image files: {len(missing_images)}")
-print(f"  Valid images (with annotations): {len(valid_images)}")
-
-if len(valid_images) == 0:
-    print("\nERROR: No valid images found! Check your dataset.")
-    exit(1)
-
-# Use only valid images for splitting
-images = valid_images
-random.shuffle(images)
-
-# Calculate the split index
-split_index = int(len(images) * split_ratio)
-
-# Split the images
-train_images = images[:split_index]
-val_images = images[split_index:]
-
-# Create sets of image IDs for fast lookup
-train_image_ids = {img['id'] for img in train_images}
-val_image_ids = {img['id'] for img in val_images}
-
-print(f"\nDataset split:")
-print(f"  Total valid images: {len(images)}")
-print(f"  Training images: {len(train_images)}")
-print(f"  Validation images: {len(val_images)}")
-
-# Create new annotation lists (only for valid images)
-train_annotations = []
-val_annotations = []
-
-# Filter annotations based on image IDs
-print("\nSplitting annotations...")
-for ann in coco_data['annotations']:
-    if ann['image_id'] in train_image_ids:
-        train_annotations.append(ann)
-    elif ann['image_id'] in val_image_ids:
-        val_annotations.append(ann)
-
-print(f"  Training annotations: {len(train_annotations)}")
-print(f"  Validation annotations: {len(val_annotations)}")
-
-# Verify all images have annotations
-train_img_with_ann = len(set(ann['image_id'] for ann in train_annotations))
-val_img_with_ann = len(set(ann['image_id'] for ann in val_annotations))
-print(f"\nVerification:")
-print(f"  Train images with annotations: {train_img_with_ann}/{len(train_images)}")
-print(f"  Val images with annotations: {val_img_with_ann}/{len(val_images)}")
-
-if train_img_with_ann != len(train_images):
-    print("  WARNING: Some train images don't have annotations!")
-if val_img_with_ann != len(val_images):
-    print("  WARNING: Some val images don't have annotations!")
-
-# Create the new COCO JSON structures
-train_coco = {
-    "info": coco_data.get("info", {}),
-    "licenses": coco_data.get("licenses", []),
-    "categories": coco_data['categories'],
-    "images": train_images,
-    "annotations": train_annotations
-}
-
-val_coco = {
-    "info": coco_data.get("info", {}),
-    "licenses": coco_data.get("licenses", []),
-    "categories": coco_data['categories'],
-    "images": val_images,
-    "annotations": val_annotations
-}
-
-# Save the new JSON files
-print(f"\nSaving training annotations to: {train_json_path}")
-with open(train_json_path, 'w') as f:
-    json.dump(train_coco, f, indent=4)
-
-print(f"Saving validation annotations to: {val_json_path}")
-with open(val_json_path, 'w') as f:
-    json.dump(val_coco, f, indent=4)
-
-print("\n✓ Split complete!")
-print(f"\nFinal dataset:")
-print(f"  Train: {len(train_images)} images, {len(train_annotations)} annotations")
-print(f"  Val: {len(val_images)} images, {len(val_annotations)} annotations")
-print(f"  Categories: {len(coco_data['categories'])}")
\ No newline at end of file
+        split_in_memory()
+
+
+if __name__ == "__main__":
+    split_dataset()
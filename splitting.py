@@ -0,0 +1,534 @@
+"""
+Deterministic, group-aware and stratified train/val/test splits for COCO and
+YOLO datasets.
+
+Images are put into groups that always land in the same split:
+    image          every image on its own
+    source_image   tiles cut from the same image (tiling.py and sahi name tiles
+                   <stem>_<x0>_<y0>_<x1>_<y1>.jpg), so no image leaks across splits
+    bottle         the bottle prefix of the file name (B1-..., B8-...)
+
+Every group gets a stable 64-bit hash of its key and the seed, so the result
+never depends on file order or on Python's hash randomization.
+    method='hash'         the hash alone picks the split; a group keeps its split
+                          when images are added or removed later
+    method='stratified'   iterative stratification (Sechidis et al., 2011) on the
+                          per-category annotation counts of each group: the
+                          rarest category's groups are handed out first, in
+                          hash order, cut so each split gets what it still
+                          needs of that category. Each step is one NumPy pass
+                          over the groups it assigns, so the whole split is
+                          linear in annotations + groups x categories.
+
+    python splitting.py coco annotations.json --ratios 0.7 0.2 0.1 --group_by bottle
+    python splitting.py yolo dataset/images dataset/labels --output_dir dataset
+
+K-fold: --folds K assigns every group to one of K equal, stratified folds in a
+single pass and writes, per fold, train (the other K-1 folds) and val files.
+Nothing is copied: COCO folds keep the original file_name entries, YOLO folds
+are list files of the shared images, and each fold's entries are encoded once
+and reused for all K output files.
+
+    python splitting.py coco annotations.json --folds 5
+
+--duplicates duplicates.json (from dedup_images.py) also joins the groups of
+near-duplicate images, so repeated frames can't end up on both sides.
+"""
+import argparse
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from coco_index import CocoIndex, _lookup
+from coco_io import dump_json, dumps, load_json
+from coco_stream import CocoStreamWriter
+
+# --- CONFIGURATION ---
+SPLIT_NAMES = ('train', 'val', 'test')
+RATIOS = (0.7, 0.2, 0.1)         # One per split name; they are normalized to sum to 1
+GROUP_BY = 'source_image'        # 'image', 'source_image' or 'bottle'
+METHOD = 'stratified'            # 'stratified' or 'hash'
+SEED = 0                         # Change to get a different (but still reproducible) split
+
+CLASS_NAMES = ['PCN_Cyst']       # YOLO only: written to dataset.yaml
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+LABEL_WORKERS = 16               # Threads reading YOLO label files
+# ---------------------
+
+# "<stem>_<x0>_<y0>_<x1>_<y1>" tile names (tiling.py, sahi)
+TILE_SUFFIX = re.compile(r'_\d+_\d+_\d+_\d+$')
+# "B3-00042_25112025", also behind Label Studio's "1a2b3c4d-" upload prefix
+BOTTLE_PREFIX = re.compile(r'(?:^|[^A-Za-z0-9])B(\d+)-')
+
+
+# --- Groups ---
+
+def group_key(file_name, group_by=GROUP_BY):
+    """The key of the group an image belongs to (see the module docstring)."""
+    name = os.path.basename(file_name)
+    if group_by == 'image':
+        return name
+    stem = TILE_SUFFIX.sub('', os.path.splitext(name)[0])
+    if group_by == 'bottle':
+        match = BOTTLE_PREFIX.search(stem)
+        # Images without a bottle prefix fall back to their source image
+        return f"B{int(match[1])}" if match else stem
+    if group_by == 'source_image':
+        return stem
+    raise ValueError(f"Unknown group_by: {group_by!r}")
+
+
+def factorize(keys):
+    """(code per key, distinct keys in first-seen order), in one pass."""
+    codes = {}
+    inverse = np.fromiter((codes.setdefault(key, len(codes)) for key in keys), dtype=np.int64)
+    return inverse, list(codes)
+
+
+def connected_components(n, a, b):
+    """
+    Component label (0..) of n nodes joined by the edges a[i] - b[i]: min-label
+    propagation with pointer jumping, a few NumPy passes over the edges.
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    labels = np.arange(n, dtype=np.int64)
+    while True:
+        low = np.minimum(labels[a], labels[b])
+        previous = labels.copy()
+        np.minimum.at(labels, a, low)
+        np.minimum.at(labels, b, low)
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return np.unique(labels, return_inverse=True)[1]
+
+
+class DuplicateGroups:
+    """
+    A group_by for assign_splits(): the groups of `base` ('image',
+    'source_image' or 'bottle'), with groups that share near-duplicate images
+    (a dedup_images.py duplicates file) joined into one.
+    """
+
+    def __init__(self, duplicates_path, base=GROUP_BY):
+        self.duplicates_path = duplicates_path
+        self.base = base
+        self.groups = [group['images'] for group in load_json(duplicates_path)['groups']]
+
+    def __str__(self):
+        return f"{self.base} + duplicates in {self.duplicates_path}"
+
+    def __call__(self, file_names):
+        base_keys = [group_key(name, self.base) for name in file_names]
+        image_groups, keys = factorize(base_keys)
+        row = {os.path.basename(name): r for r, name in enumerate(file_names)}
+
+        # Chain the base groups of every duplicate group's images
+        a, b = [], []
+        for images in self.groups:
+            members = [image_groups[row[name]] for name in images if name in row]
+            a += members[:-1]
+            b += members[1:]
+        components = connected_components(len(keys), a, b)
+
+        # Every component is named after its first base key
+        first = {}
+        for key, component in zip(keys, components.tolist()):
+            first.setdefault(component, key)
+        return [first[component] for component in components[image_groups].tolist()]
+
+
+def stable_hashes(keys, seed=SEED):
+    """A 64-bit hash per key that is the same on every machine and run."""
+    prefix = f"{seed}:".encode()
+    return np.fromiter(
+        (int.from_bytes(hashlib.blake2b(prefix + str(key).encode(), digest_size=8).digest(), 'little')
+         for key in keys),
+        dtype=np.uint64, count=len(keys))
+
+
+def category_rows(ann_category_ids):
+    """
+    (row per annotation, category ids) with rows numbering the distinct ids in
+    increasing order. Dense ids are remapped with a bincount instead of a sort.
+    """
+    ids = np.asarray(ann_category_ids, dtype=np.int64)
+    if len(ids) == 0:
+        return ids, ids
+    low, high = int(ids.min()), int(ids.max())
+    if high - low > 1 << 20:
+        category_ids, rows = np.unique(ids, return_inverse=True)
+        return rows, category_ids
+    used = np.bincount(ids - low, minlength=high - low + 1) > 0
+    remap = np.cumsum(used) - 1
+    return remap[ids - low], np.flatnonzero(used) + low
+
+
+def group_label_counts(ann_groups, ann_categories, n_groups, n_categories):
+    """(groups, categories) matrix of annotation counts. Rows of -1 are ignored."""
+    ann_groups = np.asarray(ann_groups)
+    known = ann_groups >= 0
+    flat = ann_groups[known] * n_categories + np.asarray(ann_categories)[known]
+    return np.bincount(flat, minlength=n_groups * n_categories).reshape(n_groups, n_categories)
+
+
+# --- Assignment ---
+
+def _normalized(ratios):
+    ratios = np.asarray(ratios, dtype=np.float64)
+    if len(ratios) == 0 or (ratios < 0).any() or ratios.sum() <= 0:
+        raise ValueError(f"Invalid split ratios: {ratios.tolist()}")
+    return ratios / ratios.sum()
+
+
+def _cut(weights, need):
+    """
+    Split index for each item of an ordered batch: the batch's cumulative
+    weight is cut into consecutive runs proportional to `need`. An item goes
+    to the run its weight's midpoint falls in.
+    """
+    cum = np.cumsum(weights, dtype=np.float64)
+    if cum[-1] <= 0:
+        cum = np.arange(1, len(weights) + 1, dtype=np.float64)
+        weights = np.ones(len(weights))
+    mid = (cum - np.asarray(weights) / 2) / cum[-1]
+    bounds = np.cumsum(need / need.sum())
+    return np.minimum(np.searchsorted(bounds, mid, side='right'), len(need) - 1)
+
+
+def hash_assign(hashes, ratios):
+    """Split per group from its hash alone: the hash is a point in [0, 1) cut at the ratios."""
+    ratios = _normalized(ratios)
+    points = (hashes >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+    return np.minimum(np.searchsorted(np.cumsum(ratios), points, side='right'), len(ratios) - 1)
+
+
+def stratified_assign(counts, ratios, hashes, sizes=None):
+    """
+    Iterative stratification of groups.
+
+    counts  (G, C) annotations per group and category
+    ratios  (S,) share of each split
+    hashes  (G,) order of the groups within a step
+    sizes   (G,) images per group, used to place groups without annotations
+
+    Returns the split index of every group.
+    """
+    ratios = _normalized(ratios)
+    counts = np.asarray(counts)
+    n_groups, n_categories = counts.shape
+    sizes = np.ones(n_groups, dtype=np.int64) if sizes is None else np.asarray(sizes)
+    order = np.argsort(hashes, kind='stable')
+
+    assignment = np.full(n_groups, -1, dtype=np.int64)
+    desired = ratios[:, None] * counts.sum(axis=0)[None, :]     # (S, C) annotations each split still wants
+    present = counts > 0
+    remaining = np.ones(n_groups, dtype=bool)
+    groups_left = present.sum(axis=0)                           # Unassigned groups holding each category
+
+    while groups_left.any():
+        # The category with the fewest unassigned groups goes first
+        active = np.flatnonzero(groups_left)
+        category = active[np.argmin(groups_left[active])]
+        batch = order[(remaining & present[:, category])[order]]
+
+        need = np.clip(desired[:, category], 0, None)
+        if need.sum() <= 0:
+            need = ratios
+        splits = _cut(counts[batch, category], need)
+
+        assignment[batch] = splits
+        remaining[batch] = False
+        batch_counts = counts[batch]
+        for split in range(len(ratios)):
+            desired[split] -= batch_counts[splits == split].sum(axis=0)
+        groups_left -= present[batch].sum(axis=0)
+
+    # Groups without annotations are spread to even out the image counts
+    batch = order[remaining[order]]
+    if len(batch):
+        placed = np.bincount(assignment[~remaining], weights=sizes[~remaining], minlength=len(ratios))
+        need = np.clip(ratios * sizes.sum() - placed, 0, None)
+        assignment[batch] = _cut(sizes[batch], need if need.sum() > 0 else ratios)
+    return assignment
+
+
+def assign_splits(file_names, ann_image_rows, ann_category_ids, ratios=RATIOS, group_by=GROUP_BY,
+                  method=METHOD, seed=SEED):
+    """
+    Split index for every image.
+
+    file_names        image file names, one per image row
+    ann_image_rows    image row of every annotation (-1 = not one of these images)
+    ann_category_ids  category of every annotation
+    """
+    image_counts = None
+    if method == 'stratified':
+        ann_categories, category_ids = category_rows(ann_category_ids)
+        image_counts = group_label_counts(ann_image_rows, ann_categories, len(file_names), len(category_ids))
+    return assign_splits_by_counts(file_names, image_counts, ratios, group_by, method, seed)
+
+
+def assign_splits_by_counts(file_names, image_counts, ratios=RATIOS, group_by=GROUP_BY, method=METHOD, seed=SEED):
+    """
+    assign_splits() from an (images, categories) matrix of annotation counts
+    instead of per-annotation arrays (only the stratified method uses it).
+    """
+    keys = group_by(file_names) if callable(group_by) else [group_key(name, group_by) for name in file_names]
+    image_groups, group_keys = factorize(keys)
+    hashes = stable_hashes(group_keys, seed)
+
+    if method == 'hash':
+        return hash_assign(hashes, ratios)[image_groups]
+    if method != 'stratified':
+        raise ValueError(f"Unknown split method: {method!r}")
+
+    image_counts = np.asarray(image_counts, dtype=np.int64)
+    counts = np.zeros((len(group_keys), image_counts.shape[1]), dtype=np.int64)
+    np.add.at(counts, image_groups, image_counts)
+    sizes = np.bincount(image_groups, minlength=len(group_keys))
+    return stratified_assign(counts, ratios, hashes, sizes)[image_groups]
+
+
+def image_label_counts(images, ann_image_ids, ann_category_ids):
+    """(images, categories) annotation counts for COCO image dicts and annotation image/category id arrays."""
+    image_ids = np.fromiter((img['id'] for img in images), dtype=np.int64, count=len(images))
+    ann_image_rows = _lookup(image_ids, np.arange(len(images)), np.asarray(ann_image_ids, dtype=np.int64))
+    ann_categories, category_ids = category_rows(ann_category_ids)
+    return group_label_counts(ann_image_rows, ann_categories, len(images), len(category_ids))
+
+
+def assign_image_splits(images, ann_image_ids, ann_category_ids, ratios=RATIOS, group_by=GROUP_BY,
+                        method=METHOD, seed=SEED):
+    """assign_splits() for COCO image dicts and annotation image/category id arrays."""
+    return assign_splits_by_counts([img['file_name'] for img in images],
+                                   image_label_counts(images, ann_image_ids, ann_category_ids),
+                                   ratios, group_by, method, seed)
+
+
+def print_summary(assignment, ann_image_rows, ann_category_ids, split_names=SPLIT_NAMES):
+    """Images, annotations and the share of each category per split."""
+    n_splits = len(split_names)
+    ann_image_rows = np.asarray(ann_image_rows)
+    known = ann_image_rows >= 0
+    ann_splits = assignment[ann_image_rows[known]]
+    ann_categories, category_ids = category_rows(np.asarray(ann_category_ids)[known])
+    per_category = group_label_counts(ann_splits, ann_categories, n_splits, len(category_ids))
+    totals = np.maximum(per_category.sum(axis=0), 1)
+
+    images = np.bincount(assignment, minlength=n_splits)
+    for split, name in enumerate(split_names):
+        shares = ', '.join(f"{cat}: {per_category[split, i] / totals[i]:.1%}" for i, cat in enumerate(category_ids))
+        print(f"  {name}: {images[split]} images, {per_category[split].sum()} annotations ({shares})")
+
+
+# --- COCO ---
+
+def split_coco(json_path, output_dir=None, ratios=RATIOS, split_names=SPLIT_NAMES, group_by=GROUP_BY,
+               method=METHOD, seed=SEED):
+    """Writes <stem>-<split>.json per split next to json_path (or in output_dir). Returns the paths."""
+    print(f"Loading annotations from: {json_path}")
+    index = CocoIndex.load(json_path)
+    assignment = assign_splits([img['file_name'] for img in index.images], index.ann_image_rows,
+                               index.ann_category_ids, ratios, group_by, method, seed)
+
+    print(f"\nSplit by {group_by} ({method}, seed {seed}):")
+    print_summary(assignment, index.ann_image_rows, index.ann_category_ids, split_names)
+
+    stem = Path(json_path).name.split('.')[0]
+    output_dir = output_dir or os.path.dirname(json_path)
+    paths = {}
+    for split, name in enumerate(split_names):
+        paths[name] = os.path.join(output_dir, f"{stem}-{name}.json")
+        dump_json(index.subset(assignment == split).to_coco(), paths[name])
+        print(f"Saved {name} annotations to: {paths[name]}")
+    return paths
+
+
+def fold_members(k):
+    """(fold, folds in its train file, folds in its val file) for k-fold cross-validation."""
+    return [(fold, [f for f in range(k) if f != fold], [fold]) for fold in range(k)]
+
+
+def write_coco_folds(index, folds, k, output_dir, stem):
+    """
+    Writes <stem>-fold<i>-train.json and -val.json for every fold. Each fold's
+    images and annotations are encoded once (one pass over the index) and the
+    files are put together from those blocks. Returns {fold: (train, val)}.
+    """
+    ann_folds = np.where(index.ann_image_rows >= 0, folds[np.maximum(index.ann_image_rows, 0)], -1)
+    blocks = []
+    for fold in range(k):
+        images = [dumps(index.images[row]) for row in np.flatnonzero(folds == fold).tolist()]
+        annotations = [dumps(ann) for ann in index.iter_annotations(np.flatnonzero(ann_folds == fold))]
+        blocks.append(((b',\n'.join(images), len(images)), (b',\n'.join(annotations), len(annotations))))
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for fold, train_folds, val_folds in fold_members(k):
+        paths[fold] = []
+        for role, members in (('train', train_folds), ('val', val_folds)):
+            path = os.path.join(output_dir, f"{stem}-fold{fold}-{role}.json")
+            with CocoStreamWriter(path) as out:
+                out.write_section("info", index.sections.get("info", {}))
+                out.write_section("licenses", index.sections.get("licenses", []))
+                out.write_section("categories", index.categories)
+                out.begin_array("images")
+                for f in members:
+                    out.write_encoded(*blocks[f][0])
+                out.begin_array("annotations")
+                for f in members:
+                    out.write_encoded(*blocks[f][1])
+            paths[fold].append(path)
+        print(f"Saved fold {fold}: {paths[fold][0]}, {paths[fold][1]}")
+    return paths
+
+
+def kfold_coco(json_path, k, output_dir=None, group_by=GROUP_BY, method=METHOD, seed=SEED):
+    """K-fold split of a COCO file (see write_coco_folds). Returns {fold: (train, val)}."""
+    print(f"Loading annotations from: {json_path}")
+    index = CocoIndex.load(json_path)
+    folds = assign_splits([img['file_name'] for img in index.images], index.ann_image_rows,
+                          index.ann_category_ids, np.ones(k), group_by, method, seed)
+
+    print(f"\n{k} folds by {group_by} ({method}, seed {seed}):")
+    print_summary(folds, index.ann_image_rows, index.ann_category_ids, [f"fold{i}" for i in range(k)])
+    return write_coco_folds(index, folds, k, output_dir or os.path.dirname(json_path),
+                            Path(json_path).name.split('.')[0])
+
+
+# --- YOLO ---
+
+def read_label_classes(label_path):
+    """Class ids of the boxes in a YOLO label file (empty if there is none)."""
+    try:
+        with open(label_path) as f:
+            return [int(line.split(maxsplit=1)[0]) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def yolo_annotations(images_dir, labels_dir, workers=LABEL_WORKERS):
+    """
+    Image paths of a flat YOLO dataset and its annotations as arrays:
+    (image paths, image row per box, class id per box).
+    """
+    image_paths = sorted(str(p) for p in Path(images_dir).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    label_paths = [os.path.join(labels_dir, Path(p).stem + '.txt') for p in image_paths]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        classes = list(pool.map(read_label_classes, label_paths))
+
+    lengths = np.fromiter((len(c) for c in classes), dtype=np.int64, count=len(classes))
+    ann_image_rows = np.repeat(np.arange(len(image_paths)), lengths)
+    ann_classes = np.fromiter((c for cs in classes for c in cs), dtype=np.int64, count=int(lengths.sum()))
+    return image_paths, ann_image_rows, ann_classes
+
+
+def write_yolo_yaml(path, list_files, class_names):
+    """A dataset.yaml whose splits are image list files (YOLOv5/v8 accept these in place of dirs)."""
+    lines = ["# YOLO dataset configuration file", "# Created by splitting.py", ""]
+    lines += [f"{name}: {os.path.abspath(list_file)}" for name, list_file in list_files.items()]
+    lines += ["", f"nc: {len(class_names)}", f"names: {list(class_names)}", ""]
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
+
+
+def split_yolo(images_dir, labels_dir, output_dir, ratios=RATIOS, split_names=SPLIT_NAMES,
+               group_by=GROUP_BY, method=METHOD, seed=SEED, class_names=CLASS_NAMES):
+    """
+    Splits a flat YOLO dataset by writing <split>.txt image lists and a
+    dataset.yaml into output_dir. Images and labels stay where they are.
+    """
+    image_paths, ann_image_rows, ann_classes = yolo_annotations(images_dir, labels_dir)
+    print(f"Found {len(image_paths)} images with {len(ann_classes)} boxes")
+    assignment = assign_splits(image_paths, ann_image_rows, ann_classes, ratios, group_by, method, seed)
+
+    print(f"\nSplit by {group_by} ({method}, seed {seed}):")
+    print_summary(assignment, ann_image_rows, ann_classes, split_names)
+
+    os.makedirs(output_dir, exist_ok=True)
+    list_files = {}
+    for split, name in enumerate(split_names):
+        list_files[name] = os.path.join(output_dir, f"{name}.txt")
+        with open(list_files[name], 'w') as f:
+            f.writelines(os.path.abspath(image_paths[row]) + '\n' for row in np.flatnonzero(assignment == split))
+
+    yaml_path = os.path.join(output_dir, 'dataset.yaml')
+    write_yolo_yaml(yaml_path, list_files, class_names)
+    print(f"\nSaved {yaml_path}")
+    return list_files
+
+
+def kfold_yolo(images_dir, labels_dir, output_dir, k, group_by=GROUP_BY, method=METHOD, seed=SEED,
+               class_names=CLASS_NAMES):
+    """
+    K-fold split of a flat YOLO dataset: output_dir/fold<i>/ gets train.txt,
+    val.txt and dataset.yaml, all pointing at the images in images_dir.
+    """
+    image_paths, ann_image_rows, ann_classes = yolo_annotations(images_dir, labels_dir)
+    print(f"Found {len(image_paths)} images with {len(ann_classes)} boxes")
+    folds = assign_splits(image_paths, ann_image_rows, ann_classes, np.ones(k), group_by, method, seed)
+
+    print(f"\n{k} folds by {group_by} ({method}, seed {seed}):")
+    print_summary(folds, ann_image_rows, ann_classes, [f"fold{i}" for i in range(k)])
+
+    # Every fold's image list is built once and shared by the k list files it appears in
+    blocks = [''.join(os.path.abspath(image_paths[row]) + '\n' for row in np.flatnonzero(folds == fold))
+              for fold in range(k)]
+    list_files = {}
+    for fold, train_folds, val_folds in fold_members(k):
+        fold_dir = os.path.join(output_dir, f"fold{fold}")
+        os.makedirs(fold_dir, exist_ok=True)
+        list_files[fold] = {}
+        for role, members in (('train', train_folds), ('val', val_folds)):
+            list_files[fold][role] = os.path.join(fold_dir, f"{role}.txt")
+            with open(list_files[fold][role], 'w') as f:
+                f.writelines(blocks[m] for m in members)
+        write_yolo_yaml(os.path.join(fold_dir, 'dataset.yaml'), list_files[fold], class_names)
+        print(f"Saved fold {fold}: {fold_dir}")
+    return list_files
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic group-aware, stratified dataset splits.")
+    sub = parser.add_subparsers(dest='format', required=True)
+    coco = sub.add_parser('coco', help="Split a COCO annotation file")
+    coco.add_argument('json_path')
+    coco.add_argument('--output_dir', help="Defaults to the annotation file's directory")
+    yolo = sub.add_parser('yolo', help="Split a flat YOLO images/labels dataset into list files")
+    yolo.add_argument('images_dir')
+    yolo.add_argument('labels_dir')
+    yolo.add_argument('--output_dir', required=True)
+    yolo.add_argument('--names', nargs='+', default=CLASS_NAMES, help="Class names for dataset.yaml")
+    for p in (coco, yolo):
+        p.add_argument('--ratios', nargs='+', type=float, default=list(RATIOS))
+        p.add_argument('--split_names', nargs='+', default=list(SPLIT_NAMES))
+        p.add_argument('--group_by', choices=['image', 'source_image', 'bottle'], default=GROUP_BY)
+        p.add_argument('--method', choices=['stratified', 'hash'], default=METHOD)
+        p.add_argument('--seed', type=int, default=SEED)
+        p.add_argument('--folds', type=int, help="Write K cross-validation folds instead of --ratios splits")
+        p.add_argument('--duplicates', help="Also keep near-duplicates together (a dedup_images.py output)")
+    args = parser.parse_args()
+    if args.duplicates:
+        args.group_by = DuplicateGroups(args.duplicates, args.group_by)
+
+    if args.folds is not None and args.folds < 2:
+        parser.error("--folds needs at least 2 folds")
+    if args.folds is None and len(args.ratios) != len(args.split_names):
+        parser.error("--ratios needs one value per split name")
+
+    if args.format == 'coco' and args.folds:
+        kfold_coco(args.json_path, args.folds, args.output_dir, args.group_by, args.method, args.seed)
+    elif args.format == 'coco':
+        split_coco(args.json_path, args.output_dir, args.ratios, args.split_names, args.group_by,
+                   args.method, args.seed)
+    elif args.folds:
+        kfold_yolo(args.images_dir, args.labels_dir, args.output_dir, args.folds, args.group_by,
+                   args.method, args.seed, args.names)
+    else:
+        split_yolo(args.images_dir, args.labels_dir, args.output_dir, args.ratios, args.split_names,
+                   args.group_by, args.method, args.seed, args.names)
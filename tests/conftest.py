@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# The scripts import each other as top-level modules (root and label_studio/)
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'label_studio'))
+sys.path.insert(0, str(ROOT))
@@ -0,0 +1,19 @@
+from clean_coco_datasets import plan_renames
+from coco_index import CocoIndex
+
+
+def index_of(*file_names):
+    return CocoIndex.from_coco({'images': [{'id': i, 'width': 10, 'height': 10, 'file_name': f"images/{name}"}
+                                           for i, name in enumerate(file_names)],
+                                'annotations': [], 'categories': []})
+
+
+def test_target_used_by_another_entry():
+    index = index_of('9_zz-00002.jpg', 'B1-00002.jpg', '1_aa-00003.jpg')
+    # 9_zz-00002.jpg looks already renamed: its file is gone and B1-00002.jpg exists
+    present = {'B1-00002.jpg', '1_aa-00003.jpg'}
+
+    renames, conflicts, missing, skipped = plan_renames(index, 'B1', present)
+    assert renames == [('1_aa-00003.jpg', 'B1-00003.jpg')]
+    assert [(old, new) for old, new, _ in conflicts] == [('9_zz-00002.jpg', 'B1-00002.jpg')]
+    assert missing == [] and skipped == []
@@ -0,0 +1,27 @@
+import json
+
+from coco_binary import CocoBinary, write_binary
+from coco_index import CocoIndex
+
+
+def test_integer_boxes_round_trip(tmp_path):
+    annotations = [
+        {'id': 1, 'image_id': 1, 'category_id': 0, 'bbox': [1, 2, 3, 4], 'area': 12, 'iscrowd': 0},
+        {'id': 2, 'image_id': 1, 'category_id': 0, 'bbox': [1.5, 2, 3.25, 4], 'area': 13.0, 'iscrowd': 0},
+        {'id': 3, 'image_id': 2, 'category_id': 0, 'segmentation': []},
+    ]
+    coco = {'images': [{'id': 1, 'width': 10, 'height': 10, 'file_name': 'a.jpg'},
+                       {'id': 2, 'width': 10, 'height': 10, 'file_name': 'b.jpg'}],
+            'annotations': annotations, 'categories': [{'id': 0, 'name': 'a'}]}
+    path = tmp_path / 'coco.json'
+    path.write_text(json.dumps(coco))
+
+    index = CocoIndex.load(path)
+    assert json.dumps(index.to_coco()['annotations']) == json.dumps(annotations)
+    assert json.dumps(list(index.subset([0]).iter_annotations())) == json.dumps(annotations[:2])
+    merged = CocoIndex.concat([index, index], {})
+    assert json.dumps(list(merged.iter_annotations())) == json.dumps(annotations * 2)
+
+    write_binary(index, tmp_path / 'coco.cocobin')
+    restored = CocoBinary(tmp_path / 'coco.cocobin').to_coco()['annotations']
+    assert json.dumps(restored) == json.dumps(annotations)
@@ -0,0 +1,43 @@
+import json
+
+import pytest
+
+from coco_io import dump_json, load_json, temp_path
+from coco_stream import CocoStreamWriter, iter_coco
+
+
+def test_writer_replaces_only_on_success(tmp_path):
+    path = tmp_path / 'out.json'
+    with CocoStreamWriter(path) as out:
+        out.begin_array('images')
+        out.write_item({'id': 1})
+    assert json.loads(path.read_text()) == {'images': [{'id': 1}]}
+
+    with pytest.raises(RuntimeError):
+        with CocoStreamWriter(path) as out:
+            out.begin_array('images')
+            out.write_item({'id': 2})
+            raise RuntimeError("interrupted")
+    # The previous file is untouched and no temporary file is left behind
+    assert json.loads(path.read_text()) == {'images': [{'id': 1}]}
+    assert [p.name for p in tmp_path.iterdir()] == ['out.json']
+
+
+def test_writer_compressed(tmp_path):
+    path = tmp_path / 'out.json.gz'
+    with CocoStreamWriter(path) as out:
+        out.write_section('categories', [{'id': 0, 'name': 'a'}])
+    assert list(iter_coco(path)) == [('categories', [{'id': 0, 'name': 'a'}])]
+
+
+def test_dump_json_temporary_files(tmp_path):
+    path = tmp_path / 'out.json.gz'
+    # Every writer gets its own temporary file, with the suffix that selects the compression
+    names = {temp_path(path) for _ in range(2)}
+    assert len(names) == 2 and all(name.endswith('.tmp.gz') for name in names)
+
+    dump_json({'a': 1}, path)
+    with pytest.raises(TypeError):
+        dump_json({'a': {1, 2}}, path)
+    assert load_json(path) == {'a': 1}
+    assert [p.name for p in tmp_path.iterdir()] == ['out.json.gz']
@@ -0,0 +1,39 @@
+import pytest
+
+from coco_io import dump_json, load_json
+from copy_annotations import distribute_annotations, generate_export, write_with_shared_annotations
+
+
+def test_fast_path_matches_deepcopy(tmp_path):
+    tasks = generate_export(num_tasks=20, regions=3, source_id=2)
+    tasks[5]['annotations'] = [{'id': 7, 'result': [], 'task': 6}]
+    input_file = tmp_path / 'export.json'
+    dump_json(tasks, input_file)
+
+    outputs = []
+    for fast in (False, True):
+        output_file = tmp_path / f"out-{fast}.json"
+        distribute_annotations(str(input_file), str(output_file), 2, fast=fast, timestamp="2025-11-26T09:00:00Z")
+        outputs.append(load_json(output_file))
+
+    assert outputs[0] == outputs[1]
+    copied = outputs[1][0]['annotations'][0]
+    assert (copied['id'], copied['task'], copied['created_at']) == (8, 1, "2025-11-26T09:00:00Z")
+
+
+def test_compressed_output(tmp_path):
+    tasks = generate_export(num_tasks=5, regions=2, source_id=1)
+    input_file = tmp_path / 'export.json'
+    dump_json(tasks, input_file)
+
+    output_file = tmp_path / 'out.json.gz'
+    distribute_annotations(str(input_file), str(output_file), 1, fast=True, timestamp="2025-11-26T09:00:00Z")
+    assert len(load_json(output_file)) == 5
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['export.json', 'out.json.gz']
+
+    # A task that can't be encoded: the previous output stays, no temporary file is left
+    tasks[3]['data']['bad'] = {1, 2}
+    with pytest.raises(TypeError):
+        write_with_shared_annotations(tasks, 1, tasks[0]['annotations'], str(output_file), 100, "now")
+    assert len(load_json(output_file)) == 5
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['export.json', 'out.json.gz']
@@ -0,0 +1,63 @@
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from image_fetcher import download_file, is_retryable, make_session
+
+# path -> statuses of the first requests, then 200
+RESPONSES = {'/flaky.jpg': [503, 500], '/busy.jpg': [429], '/missing.jpg': [404] * 10, '/bad.jpg': [400] * 10}
+
+
+@pytest.fixture
+def server():
+    hits = Counter()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            statuses = RESPONSES[self.path]
+            status = statuses[hits[self.path]] if hits[self.path] < len(statuses) else 200
+            hits[self.path] += 1
+            body = b'image' if status == 200 else b'error'
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}", hits
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_retries_5xx_and_429(server, tmp_path):
+    url, hits = server
+    session = make_session()
+    for name in ('flaky.jpg', 'busy.jpg'):
+        assert download_file(session, f"{url}/{name}", tmp_path / name, retries=3, backoff=0) == 5
+        assert (tmp_path / name).read_bytes() == b'image'
+    assert hits == {'/flaky.jpg': 3, '/busy.jpg': 2}
+
+
+def test_no_retry_on_client_errors(server, tmp_path):
+    url, hits = server
+    session = make_session()
+    for name in ('missing.jpg', 'bad.jpg'):
+        with pytest.raises(requests.HTTPError):
+            download_file(session, f"{url}/{name}", tmp_path / name, retries=3, backoff=0)
+        assert not (tmp_path / name).exists()
+    assert hits == {'/missing.jpg': 1, '/bad.jpg': 1}
+
+
+def test_only_transient_errors_are_retryable():
+    for error in (requests.ConnectionError(), requests.Timeout(), requests.exceptions.ChunkedEncodingError()):
+        assert is_retryable(error)
+    for error in (requests.exceptions.InvalidURL(), requests.exceptions.ContentDecodingError(),
+                  requests.exceptions.TooManyRedirects(), OSError(28, "No space left on device")):
+        assert not is_retryable(error)
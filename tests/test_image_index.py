@@ -0,0 +1,54 @@
+import os
+
+import cv2
+import numpy as np
+
+from image_index import ImageIndex, index_path, read_image_header
+from split_coco import list_image_files
+
+
+def encoded(ext):
+    image = np.random.default_rng(0).integers(0, 256, (120, 160, 3), dtype=np.uint8)
+    return cv2.imencode(ext, image)[1].tobytes()
+
+
+def test_end_marker_before_trailer(tmp_path):
+    for ext in ('.jpg', '.png'):
+        data = encoded(ext)
+        with_trailer, truncated = tmp_path / f"trailer{ext}", tmp_path / f"truncated{ext}"
+        with_trailer.write_bytes(data + b'\0' * 1000)
+        truncated.write_bytes(data[:len(data) // 2])
+
+        assert read_image_header(with_trailer)[1:] == (160, 120, True)
+        assert read_image_header(truncated)[1:] == (160, 120, False)
+
+
+def test_index_outside_the_directory(tmp_path, monkeypatch):
+    images, cache = tmp_path / 'images', tmp_path / 'cache'
+    images.mkdir()
+    (images / 'a.jpg').write_bytes(encoded('.jpg'))
+    images.chmod(0o555)
+    try:
+        with ImageIndex.for_directory(images, cache) as index:
+            assert index.scan(images)['a.jpg'].ok
+        assert [p.name for p in images.iterdir()] == ['a.jpg']
+        assert os.listdir(cache) == [os.path.basename(index_path(images, cache))]
+
+        # No usable cache directory: the scan still works, in memory
+        (tmp_path / 'file').write_bytes(b'')
+        with ImageIndex.for_directory(images, tmp_path / 'file' / 'cache') as index:
+            assert index.db_path == ':memory:' and index.scan(images)['a.jpg'].ok
+    finally:
+        images.chmod(0o755)
+
+
+def test_split_decodes_before_dropping(tmp_path):
+    images = tmp_path / 'images'
+    images.mkdir()
+    # A trailer beyond the 64 KB the end marker is looked for in, and a really truncated file
+    (images / 'trailer.jpg').write_bytes(encoded('.jpg') + b'\0' * 100_000)
+    (images / 'truncated.png').write_bytes(encoded('.png')[:-2000])
+
+    infos = list_image_files(str(images))
+    assert sorted(infos) == ['trailer.jpg']
+    assert (infos['trailer.jpg'].width, infos['trailer.jpg'].height) == (160, 120)
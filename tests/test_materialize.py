@@ -0,0 +1,34 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from materialize import Materializer, kernel_copy
+
+
+def test_same_destination_from_many_threads(tmp_path):
+    src, dst = tmp_path / 'src.jpg', tmp_path / 'out' / 'dst.jpg'
+    src.write_bytes(b'x' * 100_000)
+    dst.parent.mkdir()
+    materializer = Materializer('copy')
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(lambda _: materializer.materialize(src, dst), range(200)))
+
+    assert dst.read_bytes() == src.read_bytes()
+    assert [path.name for path in dst.parent.iterdir()] == ['dst.jpg']
+    assert sum(materializer.methods_used.values()) == 200
+
+
+def test_kernel_copy_that_stops_early(tmp_path, monkeypatch):
+    src, dst = tmp_path / 'src.jpg', tmp_path / 'dst.jpg'
+    data = bytes(range(256)) * 400
+    src.write_bytes(data)
+    copy_file_range = os.copy_file_range
+    calls = []
+
+    # The first call copies part of the file, then the filesystem copies nothing
+    def partial(src_fd, dst_fd, count):
+        calls.append(count)
+        return copy_file_range(src_fd, dst_fd, 1000) if len(calls) == 1 else 0
+
+    monkeypatch.setattr(os, 'copy_file_range', partial)
+    kernel_copy(src, dst)
+    assert dst.read_bytes() == data
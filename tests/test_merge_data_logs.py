@@ -0,0 +1,68 @@
+import pandas as pd
+import pytest
+
+from merge_data_logs import combine_incremental, combine_streaming
+
+
+def combined(output):
+    return pd.read_csv(output)['x'].tolist()
+
+
+def test_last_row_without_newline(tmp_path):
+    log = tmp_path / 'bottle_1' / 'data_log.csv'
+    log.parent.mkdir()
+    log.write_bytes(b"image_path,x\n./data/bottle_1/0.jpg,1\n./data/bottle_1/1.jpg,2")
+    output = str(tmp_path / 'combined.csv')
+
+    # The last row may still be being written, then it didn't change between two runs
+    assert combine_incremental([str(log)], output) == 1
+    assert combine_incremental([str(log)], output) == 2
+    assert combined(output) == [1, 2]
+
+    with open(log, 'ab') as f:
+        f.write(b"\n./data/bottle_1/2.jpg,3\n")
+    assert combine_incremental([str(log)], output) == 3
+    assert combined(output) == [1, 2, 3]
+    assert pd.read_csv(output)['image_path'].tolist()[-1] == './images/B1-2.jpg'
+
+
+def test_final_and_extended_last_row(tmp_path):
+    log = tmp_path / 'bottle_1' / 'data_log.csv'
+    log.parent.mkdir()
+    log.write_bytes(b"image_path,x\n./data/bottle_1/0.jpg,1\n./data/bottle_1/1.jpg,2")
+    output = str(tmp_path / 'combined.csv')
+
+    assert combine_incremental([str(log)], output, final=True) == 2
+
+    # The merged last row turned out to be incomplete: the output is rebuilt
+    with open(log, 'ab') as f:
+        f.write(b"5\n")
+    assert combine_incremental([str(log)], output) == 2
+    assert combined(output) == [1, 25]
+
+
+def test_parquet_column_empty_in_first_chunk(tmp_path):
+    log = tmp_path / 'bottle_1' / 'data_log.csv'
+    log.parent.mkdir()
+    log.write_text("image_path,x,note\n./data/bottle_1/0.jpg,1,\n./data/bottle_1/1.jpg,2,\n"
+                   "./data/bottle_1/2.jpg,3,blurry\n")
+    output = tmp_path / 'combined.parquet'
+
+    assert combine_streaming([str(log)], str(output), chunk_size=2) == 3
+    df = pd.read_parquet(output)
+    assert df['x'].tolist() == ['1', '2', '3']
+    assert df['note'].isna().tolist() == [True, True, False]
+
+
+def test_failed_parquet_output_is_not_published(tmp_path):
+    good = tmp_path / 'bottle_1' / 'data_log.csv'
+    good.parent.mkdir()
+    good.write_text("image_path,x\n./data/bottle_1/0.jpg,1\n")
+    output = tmp_path / 'combined.parquet'
+    combine_streaming([str(good)], str(output))
+    before = output.read_bytes()
+
+    with pytest.raises(FileNotFoundError):
+        combine_streaming([str(good), str(tmp_path / 'missing.csv')], str(output))
+    assert output.read_bytes() == before
+    assert not (tmp_path / 'combined.parquet.tmp').exists()
@@ -0,0 +1,93 @@
+import json
+import os
+
+import build_cache
+import merge_datasets
+from coco_io import load_json
+from coco_index import CocoIndex
+from materialize import Materializer, read_manifest
+
+
+def write_dataset(folder, bottle, num_images):
+    (folder / 'images').mkdir(parents=True)
+    images, annotations = [], []
+    for i in range(num_images):
+        name = f"B{bottle}-{i:05d}_25112025.jpg"
+        (folder / 'images' / name).write_bytes(b'jpeg')
+        images.append({'id': i, 'width': 640, 'height': 480, 'file_name': f"images/{name}"})
+        annotations.append({'id': i, 'image_id': i, 'category_id': bottle % 2, 'bbox': [1.0, 2.0, 3.0, 4.0],
+                            'area': 12.0, 'iscrowd': 0})
+    categories = [{'id': 0, 'name': 'pest'}, {'id': 1, 'name': f"other{bottle}"}]
+    (folder / 'result.json').write_text(json.dumps({'images': images, 'annotations': annotations,
+                                                     'categories': categories}))
+
+
+def test_incremental_merge_matches_full_merge(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for bottle in (1, 2, 3):
+        write_dataset(tmp_path / f"B{bottle},x-COCO", bottle, 3)
+    monkeypatch.setattr(merge_datasets, 'IMAGE_STRATEGY', 'manifest')
+    monkeypatch.setattr(merge_datasets, 'LOAD_WORKERS', 1)
+    datasets = ["B1,x-COCO", "B2,x-COCO", "B3,x-COCO"]
+
+    monkeypatch.setattr(merge_datasets, 'OUTPUT_DIR', 'full')
+    monkeypatch.setattr(merge_datasets, 'INPUT_DATASETS', datasets)
+    merge_datasets.merge_datasets(incremental=False)
+
+    monkeypatch.setattr(merge_datasets, 'OUTPUT_DIR', 'incremental')
+    for count in (1, 3):
+        monkeypatch.setattr(merge_datasets, 'INPUT_DATASETS', datasets[:count])
+        merge_datasets.merge_datasets(incremental=True)
+
+    assert load_json('incremental/result.json') == load_json('full/result.json')
+    manifest = read_manifest('incremental/images_manifest.csv')
+    assert [src for src, _ in manifest] == [src for src, _ in read_manifest('full/images_manifest.csv')]
+    assert len(manifest) == 9 and manifest[0] == ('B1,x-COCO/images/B1-00000_25112025.jpg',
+                                                  'incremental/images/B1-00000_25112025.jpg')
+
+
+def test_build_cache_keeps_reused_datasets_in_the_manifest(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for bottle in (1, 2):
+        write_dataset(tmp_path / f"B{bottle}-COCO", bottle, 3)
+    monkeypatch.setattr(merge_datasets, 'IMAGE_STRATEGY', 'manifest')
+    monkeypatch.setattr(merge_datasets, 'LOAD_WORKERS', 1)
+    monkeypatch.setattr(merge_datasets, 'OUTPUT_DIR', 'merged')
+    monkeypatch.setattr(merge_datasets, 'INPUT_DATASETS', ["B1-COCO", "B2-COCO"])
+
+    assert build_cache.build(['merge'], cache_dir='cache') == ['merge']
+    before = sorted(read_manifest('merged/images_manifest.csv'))
+
+    # Only B2 changed: B1 comes from its store, its rows must stay in the manifest
+    coco = load_json('B2-COCO/result.json')
+    coco['annotations'][0]['bbox'] = [5.0, 6.0, 7.0, 8.0]
+    (tmp_path / 'B2-COCO' / 'result.json').write_text(json.dumps(coco))
+    assert build_cache.build(['merge'], cache_dir='cache') == ['merge']
+
+    assert sorted(read_manifest('merged/images_manifest.csv')) == before
+    assert len(before) == 6
+
+
+def test_dir_digest_sees_images_rewritten_in_place(tmp_path):
+    images = tmp_path / 'images'
+    images.mkdir()
+    (images / 'a.jpg').write_bytes(b'jpeg')
+    before = build_cache.dir_digest(images)
+
+    dir_mtime = images.stat().st_mtime_ns
+    (images / 'a.jpg').write_bytes(b'other jpeg')
+    os.utime(images, ns=(dir_mtime, dir_mtime))
+    assert build_cache.dir_digest(images) != before
+
+
+def test_failed_images_next_to_an_empty_dataset(tmp_path):
+    write_dataset(tmp_path / 'B1-COCO', 1, 2)
+    empty = CocoIndex.from_coco({'images': [], 'annotations': [], 'categories': []})
+    folder = tmp_path / 'B1-COCO'
+    index, image_paths, _ = merge_datasets.prepare_dataset(folder, CocoIndex.load(folder / 'result.json'))
+    os.remove(image_paths[0])
+    (tmp_path / 'out').mkdir()
+
+    datasets = merge_datasets.materialize_datasets([('empty', empty, []), ('B1-COCO', index, image_paths)],
+                                                   tmp_path / 'out', Materializer('copy'))
+    assert [(len(paths), dataset.num_images) for _, dataset, paths in datasets] == [(0, 0), (1, 1)]
@@ -0,0 +1,52 @@
+import json
+
+import cv2
+import numpy as np
+
+import merge_datasets
+from clean_coco_datasets import JOURNAL_NAME, STATE_NAME
+from coco_index import CocoIndex
+from pipeline import Dataset, run_clean, run_merge, run_split
+
+
+def test_clean_writes_renames_back(tmp_path):
+    folder = tmp_path / 'B1-COCO'
+    (folder / 'images').mkdir(parents=True)
+    (folder / 'images' / '1257_4664fbd6-00000_25112025.jpg').write_bytes(b'jpeg')
+    coco = {'images': [{'id': 0, 'width': 10, 'height': 10, 'file_name': 'images/1257_4664fbd6-00000_25112025.jpg'}],
+            'annotations': [], 'categories': [{'id': 0, 'name': 'a'}]}
+    (folder / 'result.json').write_text(json.dumps(coco))
+
+    (dataset,) = run_clean([Dataset(str(folder), 'B1', CocoIndex.load(folder / 'result.json'))])
+
+    assert dataset.index.images[0]['file_name'] == 'images/B1-00000_25112025.jpg'
+    assert (folder / 'images' / 'B1-00000_25112025.jpg').exists()
+    written = json.loads((folder / 'result.json').read_text())
+    assert written['images'][0]['file_name'] == 'images/B1-00000_25112025.jpg'
+    assert (folder / STATE_NAME).exists() and not (folder / JOURNAL_NAME).exists()
+
+
+def test_split_after_manifest_merge(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    image = cv2.imencode('.jpg', np.zeros((10, 10, 3), dtype=np.uint8))[1].tobytes()
+    datasets = []
+    for bottle in (1, 2):
+        folder = tmp_path / f"B{bottle}-COCO"
+        (folder / 'images').mkdir(parents=True)
+        images = []
+        for i in range(3):
+            name = f"B{bottle}-{i:05d}_25112025.jpg"
+            (folder / 'images' / name).write_bytes(image)
+            images.append({'id': i, 'width': 10, 'height': 10, 'file_name': f"images/{name}"})
+        annotations = [{'id': i, 'image_id': i, 'category_id': 0, 'bbox': [1, 1, 2, 2], 'area': 4, 'iscrowd': 0}
+                       for i in range(3)]
+        coco = {'images': images, 'annotations': annotations, 'categories': [{'id': 0, 'name': 'pest'}]}
+        datasets.append(Dataset(folder.name, f"B{bottle}", CocoIndex.from_coco(coco)))
+    monkeypatch.setattr(merge_datasets, 'IMAGE_STRATEGY', 'manifest')
+    monkeypatch.setattr(merge_datasets, 'OUTPUT_DIR', 'merged')
+
+    run_split(run_merge(datasets))
+
+    assert not any((tmp_path / 'merged' / 'images').iterdir())
+    split = [json.loads((tmp_path / 'merged' / f"result-{name}.json").read_text()) for name in ('train', 'val')]
+    assert sum(len(coco['images']) for coco in split) == 6
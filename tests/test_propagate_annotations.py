@@ -0,0 +1,37 @@
+import json
+
+from coco_io import load_json
+from propagate_annotations import propagate
+
+
+def task(task_id, name, annotation_ids=()):
+    return {'id': task_id, 'data': {'image': f"/data/upload/1/1a2b3c4d-{name}"},
+            'annotations': [{'id': ann_id, 'task': task_id, 'result': [{'value': ann_id}]} for ann_id in annotation_ids]}
+
+
+def test_shared_source_order_and_ids(tmp_path):
+    # Targets before their source, two rules with the same source
+    tasks = [task(1, 'B1-00000_25112025.jpg'), task(2, 'B2-00000_25112025.jpg', [7]),
+             task(10, 'B1-00001_25112025.jpg', [40, 41]), task(3, 'B3-00000_25112025.jpg')]
+    rules = [{'source_id': 10, 'bottles': ['B1']}, {'source_id': 10, 'bottles': ['B2']}]
+    input_file, output_file = tmp_path / 'export.json', tmp_path / 'out.json'
+    input_file.write_text(json.dumps(tasks))
+
+    counts = propagate(str(input_file), str(output_file), rules=rules)
+
+    result = json.loads(output_file.read_text())
+    assert counts == {0: 1, 1: 1}
+    assert [t['id'] for t in result] == [1, 2, 10, 3]
+    assert [ann['task'] for ann in result[0]['annotations']] == [1, 1]
+    assert [ann['id'] for ann in result[0]['annotations'] + result[1]['annotations']] == [42, 43, 44, 45]
+    assert result[2] == tasks[2] and result[3] == tasks[3]
+
+
+def test_compressed_output(tmp_path):
+    tasks = [task(1, 'B1-00000_25112025.jpg'), task(10, 'B1-00001_25112025.jpg', [40])]
+    input_file, output_file = tmp_path / 'export.json', tmp_path / 'out.json.gz'
+    input_file.write_text(json.dumps(tasks))
+
+    assert propagate(str(input_file), str(output_file), rules=[{'source_id': 10, 'bottles': ['B1']}]) == {0: 1}
+    assert [t['id'] for t in load_json(output_file)] == [1, 10]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['export.json', 'out.json.gz']
@@ -0,0 +1,17 @@
+import numpy as np
+
+from splitting import assign_splits, assign_splits_by_counts, group_label_counts
+
+
+def test_counts_match_annotation_arrays():
+    rng = np.random.default_rng(0)
+    file_names = [f"B{i % 8 + 1}-{i // 4:05d}_25112025_{i % 4}_0_640_640.jpg" for i in range(400)]
+    ann_image_rows = rng.integers(-1, len(file_names), 3000)
+    ann_category_ids = rng.choice([3, 3, 3, 7, 11], 3000)
+
+    categories = np.searchsorted([3, 7, 11], ann_category_ids)
+    image_counts = group_label_counts(ann_image_rows, categories, len(file_names), 3)
+    for method in ('stratified', 'hash'):
+        np.testing.assert_array_equal(
+            assign_splits_by_counts(file_names, image_counts, method=method),
+            assign_splits(file_names, ann_image_rows, ann_category_ids, method=method))
@@ -0,0 +1,28 @@
+import json
+
+import cv2
+import numpy as np
+
+from tiling import tile_coco
+
+
+def test_file_name_with_subdirectory(tmp_path):
+    # Merged datasets list images as "images/<name>" relative to the dataset root
+    (tmp_path / 'images').mkdir()
+    image = np.random.default_rng(0).integers(0, 255, (700, 900, 3), dtype=np.uint8)
+    cv2.imwrite(str(tmp_path / 'images' / 'B1-00001_25112025.jpg'), image)
+    coco = {
+        'images': [{'id': 1, 'file_name': 'images/B1-00001_25112025.jpg', 'width': 900, 'height': 700}],
+        'annotations': [{'id': 1, 'image_id': 1, 'category_id': 0, 'bbox': [10, 10, 50, 40], 'area': 2000, 'iscrowd': 0}],
+        'categories': [{'id': 0, 'name': 'PCN_Cyst'}],
+    }
+    json_path = tmp_path / 'result.json'
+    json_path.write_text(json.dumps(coco))
+
+    paths = tile_coco(str(tmp_path), [str(json_path)], [str(tmp_path / 'tiled')], slices=[(640, 0.2)],
+                      workers=1, negative_ratio=1, max_pad_fraction=1, min_tile_std=0)
+
+    tiled = json.loads(paths[0]['640_02'].read_text())
+    assert len(tiled['images']) == 4
+    assert len(tiled['annotations']) == 1
+    assert len(list((tmp_path / 'tiled' / 'result_images_640_02').iterdir())) == 4
@@ -0,0 +1,494 @@
+import argparse
+import hashlib
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from coco_index import CocoIndex
+from coco_stream import CocoStreamWriter
+from materialize import link_or_copy
+
+# --- CONFIGURATION ---
+# Source dataset (COCO). For a YOLO source use yolo_sources() instead, see tile_yolo_split().
+IMAGE_DIR = "/root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO"
+# Several annotation files for the same images are tiled together: each image is
+# decoded once and every tile is encoded once, then shared by all of them.
+ANNOTATION_JSONS = [
+    "/root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO/annotations_4200K.json",
+]
+# One output dir per annotation file (or a single one for all of them)
+OUTPUT_DIRS = [
+    "/root/zfs-crow-compute/datasets/PCN/v2/B1-8-COCO-4200K-tiled",
+]
+# Where tile pixels are stored by content hash when there are several annotation
+# files; the per-set image dirs link to it. None = "tile_store" in the output dirs' common parent.
+TILE_STORE = None
+
+# Every (tile size, overlap ratio) to produce. All of them are cut from one decode of each image.
+SLICES = [(640, 0.2)]
+
+# False: edge tiles are shifted back inside the image (like `sahi coco slice`).
+# True: edge tiles start on the regular grid and are padded with black (like archive/tile_dataset.py).
+PAD_EDGES = False
+
+MIN_BOX_SIZE = 1          # Clipped boxes must be wider/taller than this (pixels)
+MIN_AREA_RATIO = 0.1      # ...and keep at least this fraction of their original area
+OUTPUT_FORMATS = ('coco',)  # Any of 'coco', 'yolo'
+
+# Tile pruning, decided before a tile is encoded. Tiles with boxes are always written;
+# a tile without boxes is dropped if it is mostly padding or nearly uniform (blank), and
+# otherwise kept with probability NEGATIVE_RATIO (a hash of its name, so runs agree).
+# NEGATIVE_RATIO = 1, MAX_PAD_FRACTION = 1 and MIN_TILE_STD = 0 write every tile (old behaviour).
+NEGATIVE_RATIO = 0.1      # Share of background tiles to keep
+MAX_PAD_FRACTION = 0.5    # Background tiles with more black padding than this are dropped (PAD_EDGES only)
+MIN_TILE_STD = 4.0        # Background tiles whose pixel std-dev is below this are dropped
+SAMPLE_SEED = 0           # Change to sample a different (but still reproducible) set of background tiles
+JPEG_QUALITY = 95
+WORKERS = os.cpu_count()
+# ---------------------
+
+
+def slice_name(size, overlap):
+    """Name used for a slice config in output paths, e.g. (640, 0.2) -> '640_02' (sahi's convention)."""
+    return f"{size}_{str(overlap).replace('.', '')}"
+
+
+def tile_grid(width, height, size, overlap, pad=False):
+    """
+    Tile rectangles covering an image, as an (T, 4) int array of x0, y0, x1, y1.
+
+    Tiles step by size * (1 - overlap). Without padding the last row/column is
+    moved back so it ends on the image edge; with padding it stays on the grid
+    and is clipped to the image (the caller pads the crop up to `size`).
+    """
+    step = max(1, int(size * (1 - overlap)))
+
+    def starts(length):
+        if pad:
+            return np.arange(0, length, step)
+        last = max(0, length - size)
+        positions = np.arange(0, last + 1, step)
+        if positions[-1] != last:
+            positions = np.append(positions, last)
+        return positions
+
+    xs = starts(width)
+    ys = starts(height)
+    x0, y0 = np.meshgrid(xs, ys)
+    x0 = x0.ravel()
+    y0 = y0.ravel()
+    return np.stack([x0, y0, np.minimum(x0 + size, width), np.minimum(y0 + size, height)], axis=1)
+
+
+def clip_boxes_to_tiles(boxes, tiles, min_size=MIN_BOX_SIZE, min_area_ratio=MIN_AREA_RATIO):
+    """
+    Clips every box against every tile in one NumPy operation.
+
+    `boxes` is (N, 4) and `tiles` (T, 4), both x0, y0, x1, y1 in image pixels.
+    Returns (tile_idx, box_idx, clipped): for each kept (tile, box) pair the
+    box clipped to the tile, in x0, y0, x1, y1 relative to the tile origin.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    tiles = np.asarray(tiles, dtype=np.float64).reshape(-1, 4)
+
+    # (T, N) intersections through broadcasting
+    x0 = np.maximum(tiles[:, None, 0], boxes[None, :, 0])
+    y0 = np.maximum(tiles[:, None, 1], boxes[None, :, 1])
+    x1 = np.minimum(tiles[:, None, 2], boxes[None, :, 2])
+    y1 = np.minimum(tiles[:, None, 3], boxes[None, :, 3])
+    w = x1 - x0
+    h = y1 - y0
+    box_area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    keep = (w > min_size) & (h > min_size) & (w * h >= min_area_ratio * box_area[None, :])
+    tile_idx, box_idx = np.nonzero(keep)
+    origin = tiles[tile_idx, :2]
+    clipped = np.stack([x0[keep], y0[keep], x1[keep], y1[keep]], axis=1) - np.hstack([origin, origin])
+    return tile_idx, box_idx, clipped
+
+
+def write_tile(crop, destinations, store_dir, jpeg_quality=JPEG_QUALITY):
+    """
+    Encodes a tile once and puts it at every destination path.
+
+    With a store_dir the encoded bytes are saved as <store_dir>/ab/<sha256><ext>
+    (skipped if that object already exists) and the destinations are linked to
+    it, so identical tiles only take disk space once.
+    """
+    ext = os.path.splitext(destinations[0])[1]
+    ok, encoded = cv2.imencode(ext, crop, [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality])
+    if not ok:
+        raise OSError(f"Could not encode tile {destinations[0]}")
+    data = encoded.tobytes()
+
+    if store_dir is None:
+        for dest in destinations:
+            with open(dest, 'wb') as f:
+                f.write(data)
+        return
+
+    digest = hashlib.sha256(data).hexdigest()
+    object_path = os.path.join(store_dir, digest[:2], f"{digest}{ext}")
+    if not os.path.exists(object_path):
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        tmp = f"{object_path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, object_path)
+    for dest in destinations:
+        link_or_copy(object_path, dest)
+
+
+def keep_negative(tile_file, ratio, seed=SAMPLE_SEED):
+    """Deterministic sample of background tiles: True for about `ratio` of all tile names."""
+    digest = hashlib.blake2b(f"{seed}:{tile_file}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') < ratio * 2**64
+
+
+def prune_reason(crop, pad_fraction, tile_file, job):
+    """Why a tile without boxes isn't written ('padding', 'blank' or 'negative'), None to keep it."""
+    if pad_fraction > job['max_pad_fraction']:
+        return 'padding'
+    # Every 4th pixel is plenty to tell a flat tile from a textured one
+    sample = crop[::4, ::4]
+    if sample.size == 0 or sample.std() < job['min_tile_std']:
+        return 'blank'
+    if not keep_negative(tile_file, job['negative_ratio'], job['sample_seed']):
+        return 'negative'
+    return None
+
+
+def _pixel_boxes(boxes, width, height, yolo):
+    """Boxes as x0, y0, x1, y1 pixels (converting normalized YOLO cx, cy, w, h if needed)."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if not yolo:
+        return boxes
+    cx, cy, bw, bh = (boxes * [width, height, width, height]).T
+    return np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+
+
+def tile_image(job):
+    """
+    Worker: decodes one source image and writes its tiles for every slice config.
+
+    `job['annotations']` holds one entry per annotation set: (boxes, labels)
+    with boxes as (N, 4) x0, y0, x1, y1 pixels (normalized YOLO cx, cy, w, h
+    if job['yolo']), or None if the image isn't in that set. Returns
+    ({slice_name: [(file_name, width, height, per_set), ...]}, pruned) where
+    per_set has tile-relative (boxes_xyxy, labels) for every set, or None if
+    the tile isn't in that set, and pruned counts the tiles that were dropped
+    (see prune_reason) by reason.
+    """
+    img = cv2.imread(job['path'])
+    if img is None:
+        return None
+
+    h, w = img.shape[:2]
+    annotation_sets = [
+        None if entry is None
+        else (_pixel_boxes(entry[0], w, h, job.get('yolo')), np.asarray(entry[1], dtype=np.int64))
+        for entry in job['annotations']
+    ]
+    member_sets = [s for s, entry in enumerate(annotation_sets) if entry is not None]
+
+    stem, ext = os.path.splitext(os.path.basename(job['path']))
+    results = {}
+    pruned = Counter()
+    for size, overlap in job['slices']:
+        name = slice_name(size, overlap)
+        tiles = tile_grid(w, h, size, overlap, pad=job['pad'])
+        clipped_sets = [
+            None if entry is None
+            else clip_boxes_to_tiles(entry[0], tiles, job['min_box_size'], job['min_area_ratio'])
+            for entry in annotation_sets
+        ]
+
+        records = []
+        for t, (x0, y0, x1, y1) in enumerate(tiles.tolist()):
+            tile_file = f"{stem}_{x0}_{y0}_{x1}_{y1}{ext}"
+            per_set = []
+            for entry, clipped in zip(annotation_sets, clipped_sets):
+                if entry is None:
+                    per_set.append(None)
+                    continue
+                tile_idx, box_idx, boxes = clipped
+                in_tile = tile_idx == t
+                per_set.append((boxes[in_tile], entry[1][box_idx[in_tile]]))
+
+            # Decide which sets get the tile before it is padded or encoded
+            keep_sets = [s for s in member_sets if len(per_set[s][0])]
+            if len(keep_sets) < len(member_sets):
+                pad_fraction = 1 - (x1 - x0) * (y1 - y0) / (size * size) if job['pad'] else 0.0
+                reason = prune_reason(img[y0:y1, x0:x1], pad_fraction, tile_file, job)
+                if reason is None:
+                    keep_sets = member_sets
+                elif not keep_sets:
+                    pruned[reason] += 1
+                    continue
+            per_set = [entry if s in keep_sets else None for s, entry in enumerate(per_set)]
+
+            crop = img[y0:y1, x0:x1]
+            if job['pad'] and (crop.shape[0] < size or crop.shape[1] < size):
+                padded = np.zeros((size, size) + crop.shape[2:], dtype=crop.dtype)
+                padded[:crop.shape[0], :crop.shape[1]] = crop
+                crop = padded
+
+            write_tile(crop, [os.path.join(job['image_dirs'][s][name], tile_file) for s in keep_sets],
+                       job['tile_store'], job['jpeg_quality'])
+            if 'yolo' in job['formats']:
+                for s in keep_sets:
+                    write_yolo_labels(os.path.join(job['label_dirs'][s][name], f"{Path(tile_file).stem}.txt"),
+                                      *per_set[s], crop.shape[1], crop.shape[0])
+            records.append((tile_file, crop.shape[1], crop.shape[0], per_set))
+        results[name] = records
+    return results, pruned
+
+
+def write_yolo_labels(path, boxes_xyxy, labels, width, height):
+    """Writes 'class cx cy w h' lines normalized to the image size (no file if there are no boxes)."""
+    if len(boxes_xyxy) == 0:
+        return
+    boxes_xyxy = np.asarray(boxes_xyxy, dtype=np.float64)
+    normalized = np.stack([
+        (boxes_xyxy[:, 0] + boxes_xyxy[:, 2]) / 2 / width,
+        (boxes_xyxy[:, 1] + boxes_xyxy[:, 3]) / 2 / height,
+        (boxes_xyxy[:, 2] - boxes_xyxy[:, 0]) / width,
+        (boxes_xyxy[:, 3] - boxes_xyxy[:, 1]) / height,
+    ], axis=1)
+    with open(path, 'w') as f:
+        for label, row in zip(labels.tolist(), normalized.tolist()):
+            f.write(f"{label} {' '.join(f'{v:.6f}' for v in row)}\n")
+
+
+def source_path(image_dir, file_name):
+    """
+    Path of a COCO image: image_dir joined with the full file_name (like sahi,
+    e.g. "images/B1-00001.jpg" under the dataset root), falling back to the
+    base name directly in image_dir if that doesn't exist.
+    """
+    path = os.path.join(image_dir, file_name)
+    if os.path.exists(path):
+        return path
+    return os.path.join(image_dir, os.path.basename(file_name))
+
+
+def coco_sources(json_paths, image_dir):
+    """
+    Tiling jobs for one or more COCO files describing images in `image_dir`.
+
+    Images are matched across the files by file name, so each one becomes a
+    single job carrying every file's boxes (None where a file doesn't list the
+    image). Labels are COCO category ids. Returns (jobs, categories per file).
+    """
+    if isinstance(json_paths, (str, os.PathLike)):
+        json_paths = [json_paths]
+
+    jobs = {}
+    categories = []
+    for set_idx, json_path in enumerate(json_paths):
+        index = CocoIndex.load(json_path)
+        categories.append(index.categories)
+        for row, img in enumerate(index.images):
+            filename = os.path.basename(img['file_name'])
+            ann_rows = index.ann_order[index.offsets[row]:index.offsets[row + 1]]
+            x, y, bw, bh = index.ann_bboxes[ann_rows].T
+            job = jobs.setdefault(filename, {
+                'path': source_path(image_dir, img['file_name']),
+                'annotations': [None] * len(json_paths),
+            })
+            job['annotations'][set_idx] = (np.stack([x, y, x + bw, y + bh], axis=1), index.ann_category_ids[ann_rows])
+    return list(jobs.values()), categories
+
+
+def yolo_sources(image_dir, label_dir, extensions=('.jpg', '.jpeg', '.png')):
+    """Tiling jobs for a YOLO images/labels folder pair (labels are class indices)."""
+    jobs = []
+    for filename in sorted(os.listdir(image_dir)):
+        if not filename.lower().endswith(extensions):
+            continue
+        label_path = os.path.join(label_dir, f"{os.path.splitext(filename)[0]}.txt")
+        rows = np.zeros((0, 5))
+        if os.path.exists(label_path):
+            rows = np.loadtxt(label_path, ndmin=2).reshape(-1, 5) if os.path.getsize(label_path) else rows
+        jobs.append({
+            'path': os.path.join(image_dir, filename),
+            'annotations': [(rows[:, 1:5], rows[:, 0].astype(np.int64))],
+            'yolo': True,
+        })
+    return jobs
+
+
+def tile_dataset(jobs, annotation_sets, slices=SLICES, formats=OUTPUT_FORMATS, pad=PAD_EDGES,
+                 min_box_size=MIN_BOX_SIZE, min_area_ratio=MIN_AREA_RATIO, workers=WORKERS, tile_store=None,
+                 negative_ratio=NEGATIVE_RATIO, max_pad_fraction=MAX_PAD_FRACTION, min_tile_std=MIN_TILE_STD,
+                 sample_seed=SAMPLE_SEED):
+    """
+    Tiles every source image for every slice config and annotation set in one pass.
+
+    `annotation_sets` is a list of (dataset_name, output_dir, categories),
+    matching the entries of each job's 'annotations'. Images are spread over a
+    process pool; each worker decodes an image once and cuts all slice configs
+    from it. Per set and config this writes
+    <output_dir>/<dataset_name>_images_<size>_<overlap>/ and, depending on
+    `formats`, <dataset_name>_<size>_<overlap>.json (COCO) and/or
+    <dataset_name>_labels_<size>_<overlap>/ (YOLO).
+
+    With more than one set, tile pixels are stored once in `tile_store`
+    (content-addressed) and linked into each set's image dir. Tiles without
+    boxes are pruned before encoding (negative_ratio, max_pad_fraction and
+    min_tile_std, see the configuration).
+    Returns {slice_name: coco_path} per set.
+    """
+    names = [slice_name(size, overlap) for size, overlap in slices]
+    image_dirs = []
+    label_dirs = []
+    for dataset_name, output_dir, _ in annotation_sets:
+        image_dirs.append({name: str(Path(output_dir) / f"{dataset_name}_images_{name}") for name in names})
+        label_dirs.append({name: str(Path(output_dir) / f"{dataset_name}_labels_{name}") for name in names})
+        for name in names:
+            os.makedirs(image_dirs[-1][name], exist_ok=True)
+            if 'yolo' in formats:
+                os.makedirs(label_dirs[-1][name], exist_ok=True)
+
+    if len(annotation_sets) > 1:
+        if tile_store is None:
+            output_root = os.path.commonpath([os.path.abspath(d) for _, d, _ in annotation_sets])
+            tile_store = os.path.join(output_root, 'tile_store')
+        print(f"Tiles shared by {len(annotation_sets)} annotation sets are stored in {tile_store}")
+    else:
+        tile_store = None
+
+    settings = {
+        'slices': list(slices), 'pad': pad, 'formats': tuple(formats),
+        'min_box_size': min_box_size, 'min_area_ratio': min_area_ratio, 'jpeg_quality': JPEG_QUALITY,
+        'image_dirs': image_dirs, 'label_dirs': label_dirs, 'tile_store': tile_store,
+        'negative_ratio': negative_ratio, 'max_pad_fraction': max_pad_fraction, 'min_tile_std': min_tile_std,
+        'sample_seed': sample_seed,
+    }
+    jobs = [{**job, **settings} for job in jobs]
+
+    print(f"Tiling {len(jobs)} images into {len(slices)} slice configs with {workers} workers...")
+    tiles_by_slice = {name: [] for name in names}
+    pruned = Counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for job, result in zip(jobs, pool.map(tile_image, jobs, chunksize=4)):
+            if result is None:
+                print(f"  Warning: Could not read {job['path']}, skipping.")
+                continue
+            records_by_slice, image_pruned = result
+            for name, records in records_by_slice.items():
+                tiles_by_slice[name].extend(records)
+            pruned.update(image_pruned)
+
+    if pruned:
+        print(f"  Not written: {sum(pruned.values())} tiles without boxes ({pruned['padding']} mostly padding, "
+              f"{pruned['blank']} blank, {pruned['negative']} background tiles beyond negative_ratio {negative_ratio})")
+
+    coco_paths = []
+    for s, (dataset_name, output_dir, categories) in enumerate(annotation_sets):
+        coco_paths.append({})
+        for name in names:
+            records = [
+                (file_name, width, height, *per_set[s])
+                for file_name, width, height, per_set in tiles_by_slice[name]
+                if per_set[s] is not None
+            ]
+            if 'coco' in formats:
+                coco_paths[s][name] = Path(output_dir) / f"{dataset_name}_{name}.json"
+                write_tiled_coco(coco_paths[s][name], records, categories)
+
+            num_boxes = sum(len(record[3]) for record in records)
+            print(f"  {dataset_name} {name}: {len(records)} tiles, {num_boxes} boxes -> {image_dirs[s][name]}")
+    return coco_paths
+
+
+def write_tiled_coco(path, records, categories):
+    """Writes (file_name, width, height, boxes_xyxy, labels) tile records as a COCO file."""
+    with CocoStreamWriter(path) as out:
+        out.write_section("info", {"description": "Tiled dataset"})
+        out.write_section("licenses", [])
+        out.write_section("categories", categories)
+        out.begin_array("images")
+        for image_id, (file_name, width, height, _, _) in enumerate(records, start=1):
+            out.write_item({"id": image_id, "file_name": file_name, "width": width, "height": height})
+
+        out.begin_array("annotations")
+        ann_id = 1
+        for image_id, (_, _, _, boxes, labels) in enumerate(records, start=1):
+            if len(boxes) == 0:
+                continue
+            xywh = np.column_stack([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]])
+            areas = xywh[:, 2] * xywh[:, 3]
+            for bbox, area, label in zip(xywh.tolist(), areas.tolist(), labels.tolist()):
+                out.write_item({
+                    "id": ann_id, "image_id": image_id, "category_id": label,
+                    "segmentation": [], "bbox": bbox, "ignore": 0, "iscrowd": 0, "area": area,
+                })
+                ann_id += 1
+
+
+def tile_yolo_split(data_root, out_root, split, class_names, **kwargs):
+    """Tiles one split of a YOLO dataset laid out as images/<split>, labels/<split>."""
+    jobs = yolo_sources(os.path.join(data_root, 'images', split), os.path.join(data_root, 'labels', split))
+    categories = [{"id": i, "name": name} for i, name in enumerate(class_names)]
+    return tile_dataset(jobs, [(split, os.path.join(out_root, split), categories)], **kwargs)[0]
+
+
+def tile_coco(image_dir, json_paths, output_dirs, **kwargs):
+    """
+    Tiles one image dir for one or more COCO annotation files, decoding each
+    image once. `output_dirs` has one entry per file, or a single shared one.
+    """
+    if len(output_dirs) == 1:
+        output_dirs = list(output_dirs) * len(json_paths)
+    if len(output_dirs) != len(json_paths):
+        raise ValueError(f"Got {len(json_paths)} annotation files but {len(output_dirs)} output dirs")
+
+    jobs, categories = coco_sources(json_paths, image_dir)
+    annotation_sets = [
+        (Path(json_path).name.split('.')[0], output_dir, cats)
+        for json_path, output_dir, cats in zip(json_paths, output_dirs, categories)
+    ]
+    return tile_dataset(jobs, annotation_sets, **kwargs)
+
+
+def parse_slices(values):
+    """Parses ['640:0.2', '1280:0.25'] into [(640, 0.2), (1280, 0.25)]."""
+    slices = []
+    for value in values:
+        size, _, overlap = value.partition(':')
+        slices.append((int(size), float(overlap or 0.2)))
+    return slices
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tile a COCO dataset into one or more slice sizes in one pass.")
+    parser.add_argument('--image_dir', default=IMAGE_DIR)
+    parser.add_argument('--dataset_json_path', nargs='+', default=ANNOTATION_JSONS,
+                        help="One or more annotation files for the images in --image_dir")
+    parser.add_argument('--output_dir', nargs='+', default=OUTPUT_DIRS,
+                        help="One output dir per annotation file, or one for all of them")
+    parser.add_argument('--tile_store', default=TILE_STORE,
+                        help="Content-addressed store for tiles shared by several annotation files")
+    parser.add_argument('--slice', nargs='+', metavar='SIZE:OVERLAP',
+                        help="Slice configs, e.g. 640:0.2 1280:0.2 (default: SLICES)")
+    parser.add_argument('--format', nargs='+', choices=['coco', 'yolo'], default=list(OUTPUT_FORMATS))
+    parser.add_argument('--pad', action='store_true', default=PAD_EDGES, help="Pad edge tiles instead of shifting them")
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--negative_ratio', type=float, default=NEGATIVE_RATIO,
+                        help="Share of tiles without boxes to keep (1 keeps all of them)")
+    parser.add_argument('--max_pad_fraction', type=float, default=MAX_PAD_FRACTION,
+                        help="Drop tiles without boxes that are more padding than this")
+    parser.add_argument('--min_tile_std', type=float, default=MIN_TILE_STD,
+                        help="Drop tiles without boxes whose pixel std-dev is below this")
+    args = parser.parse_args()
+
+    tile_coco(args.image_dir, args.dataset_json_path, args.output_dir,
+              slices=parse_slices(args.slice) if args.slice else SLICES,
+              formats=args.format, pad=args.pad, workers=args.workers, tile_store=args.tile_store,
+              negative_ratio=args.negative_ratio, max_pad_fraction=args.max_pad_fraction,
+              min_tile_std=args.min_tile_std)
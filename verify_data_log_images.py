@@ -0,0 +1,190 @@
+"""
+Checks that every image listed in a combined data log (merge_data_logs.py,
+.csv or .parquet) exists, and optionally that it isn't truncated or corrupt.
+
+Existence is checked by listing each directory once and comparing sets, so
+hundreds of thousands of rows cost a handful of listdir calls instead of a
+stat per row. Deep checks run in parallel:
+    --deep header   parse JPEG/PNG headers via image_index.py (cached between runs)
+    --deep decode   header check plus a full decode of every image with imagecodecs
+
+The header check only looks for the end marker in the last 64 KB of a file,
+so files without one are reported as TRUNCATED?; with --deep decode they are
+only CORRUPT if they don't decode either.
+
+    python verify_data_log_images.py combined_data_log.csv --deep header --report problems.csv
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from image_index import scan_directory
+
+# --- CONFIGURATION ---
+CSV_FILE = "combined_data_log.csv"
+PATH_COLUMN = "image_path"
+DECODE_WORKERS = os.cpu_count()
+# ---------------------
+
+
+def read_image_paths(csv_file, column=PATH_COLUMN):
+    """The image paths listed in the data log (.csv or .parquet), in file order."""
+    if csv_file.endswith('.parquet'):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Reading a Parquet data log needs the 'pyarrow' package") from None
+        names = pq.read_schema(csv_file).names
+        values = pq.read_table(csv_file, columns=[column if column in names else names[0]]).column(0)
+        return [str(value).strip().strip('"') for value in values.to_pylist() if value]
+
+    with open(csv_file, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        col = header.index(column) if column in header else 0
+        return [row[col].strip().strip('"') for row in reader if row]
+
+
+def find_missing(paths, root='.'):
+    """
+    Returns the paths (relative to `root`) that don't exist as files, listing
+    every directory only once.
+    """
+    by_dir = defaultdict(set)
+    for path in paths:
+        directory, name = os.path.split(path)
+        by_dir[directory].add(name)
+
+    missing = []
+    for directory, names in by_dir.items():
+        try:
+            with os.scandir(os.path.join(root, directory)) as it:
+                present = {entry.name for entry in it if entry.is_file()}
+        except FileNotFoundError:
+            present = set()
+        missing.extend(os.path.join(directory, name) for name in sorted(names - present))
+    return missing
+
+
+def check_headers(paths, root='.'):
+    """
+    Returns ({path: problem} for images whose header is corrupt, [paths] of
+    images whose end marker wasn't found, i.e. that look truncated).
+    """
+    by_dir = defaultdict(list)
+    for path in paths:
+        directory, name = os.path.split(path)
+        by_dir[directory].append(name)
+
+    corrupt, truncated = {}, []
+    for directory, names in by_dir.items():
+        infos = scan_directory(os.path.join(root, directory) or '.')
+        for name in names:
+            info = infos.get(name)
+            if info is None or info.ok:
+                continue
+            if info.error:
+                corrupt[os.path.join(directory, name)] = info.error
+            else:
+                truncated.append(os.path.join(directory, name))
+    return corrupt, truncated
+
+
+def check_decode(paths, root='.', workers=DECODE_WORKERS):
+    """{path: problem} for images imagecodecs can't fully decode (runs on a thread pool)."""
+    import imagecodecs
+
+    def decode(path):
+        try:
+            imagecodecs.imread(os.path.join(root, path))
+        except Exception as e:  # imagecodecs raises codec specific errors
+            return path, str(e) or type(e).__name__
+        return path, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return {path: error for path, error in pool.map(decode, paths) if error is not None}
+
+
+def write_report(report_path, missing, corrupt, truncated=()):
+    """Writes missing/corrupt/truncated? files as CSV (path,status,detail) or JSON (by file extension)."""
+    if report_path.endswith('.json'):
+        with open(report_path, 'w') as f:
+            json.dump({"missing": missing, "corrupt": corrupt, "truncated": list(truncated)}, f, indent=2)
+        return
+
+    with open(report_path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["path", "status", "detail"])
+        writer.writerows([path, "missing", ""] for path in missing)
+        writer.writerows([path, "corrupt", detail] for path, detail in corrupt.items())
+        writer.writerows([path, "truncated?", "no end marker"] for path in truncated)
+
+
+def verify(csv_file=CSV_FILE, root='.', deep=None, workers=DECODE_WORKERS, report=None):
+    """
+    Runs the checks and prints a summary. Returns True if every file is
+    present and intact; files that only look truncated but decode are reported
+    without failing the check.
+    """
+    if not os.path.isfile(csv_file):
+        print(f"Error: data log '{csv_file}' not found.")
+        return False
+
+    print("Starting verification...")
+    start = time.perf_counter()
+    paths = read_image_paths(csv_file)
+    missing = find_missing(paths, root)
+    for path in missing:
+        print(f"[MISSING] {path}")
+
+    corrupt, truncated = {}, []
+    suspect_ok = []   # Look truncated but decode
+    if deep:
+        missing_set = set(missing)
+        present = [path for path in dict.fromkeys(paths) if path not in missing_set]
+        print(f"Deep check ({deep}) of {len(present)} files...")
+        corrupt, truncated = check_headers(present, root)
+        if deep == 'decode':
+            # Files that look truncated are decoded too, only a failed decode makes them corrupt
+            corrupt.update(check_decode([p for p in present if p not in corrupt], root, workers))
+            suspect_ok = [path for path in truncated if path not in corrupt]
+            truncated = []
+        for path, detail in corrupt.items():
+            print(f"[CORRUPT] {path}: {detail}")
+        for path in truncated:
+            print(f"[TRUNCATED?] {path}: no end marker in the last 64 KB")
+        for path in suspect_ok:
+            print(f"[TRUNCATED?] {path}: no end marker in the last 64 KB, but it decodes")
+
+    if report:
+        write_report(report, missing, corrupt, truncated + suspect_ok)
+
+    print("------------------------------------------------")
+    print(f"Verification complete in {time.perf_counter() - start:.1f}s.")
+    print(f"Checked {len(paths)} files.")
+    if suspect_ok:
+        print(f"WARNING: {len(suspect_ok)} files have no end marker but decode, check them by eye.")
+    if not missing and not corrupt and not truncated:
+        print("SUCCESS: All files exist." if not deep else "SUCCESS: All files exist and are intact.")
+        return True
+    print(f"FAILURE: {len(missing)} files are missing, {len(corrupt)} are corrupt, "
+          f"{len(truncated)} look truncated.")
+    return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify the images listed in a combined data log.")
+    parser.add_argument('csv_file', nargs='?', default=CSV_FILE, help="The data log (.csv or .parquet)")
+    parser.add_argument('--root', default='.', help="Directory the image paths are relative to")
+    parser.add_argument('--deep', choices=['header', 'decode'], help="Also check files for corruption")
+    parser.add_argument('--workers', type=int, default=DECODE_WORKERS, help="Threads for --deep decode")
+    parser.add_argument('--report', help="Write missing/corrupt files to this .csv or .json file")
+    args = parser.parse_args()
+
+    ok = verify(args.csv_file, args.root, args.deep, args.workers, args.report)
+    sys.exit(0 if ok else 1)